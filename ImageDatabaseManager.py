@@ -1,49 +1,250 @@
 import sqlite3
 import base64
+import hashlib
 from datetime import datetime
 from io import BytesIO
 from PIL import Image
 import numpy as np
+from hamming_index import HammingIndex
+from image_sampler import ImageSampler
+
+# image_store 只保存元数据，原始图片字节单独存放在 image_blob 中，
+# 按QQ号列表、查重等只读元数据的查询不会读入图片内容
+# content_hash 为图片字节的SHA-256（32字节），唯一索引，用于在解码图片前拒绝完全相同的重复上传
+IMAGE_STORE_COLUMNS = """
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    qq_number TEXT NOT NULL,
+    perceptual_hash INTEGER NOT NULL,
+    file_size INTEGER NOT NULL,
+    upload_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+    content_hash BLOB
+"""
+IMAGE_BLOB_COLUMNS = """
+    image_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+"""
+
+# 旧版（图片以Base64文本存放在 image_store.base64_data 中）迁移时每批处理的行数
+MIGRATION_BATCH_SIZE = 200
+
+def decode_image_data(image_data) -> bytes:
+    """
+    将图片数据统一为原始字节
+    :param image_data: 原始字节，或Base64字符串（可带 data:image/...;base64, 前缀）
+    """
+    if isinstance(image_data, (bytes, bytearray, memoryview)):
+        return bytes(image_data)
+    return base64.b64decode(image_data.split(',')[-1] if ',' in image_data else image_data)
+
+def migrate_base64_store(conn: sqlite3.Connection, batch_size: int = MIGRATION_BATCH_SIZE, progress=None) -> tuple:
+    """
+    将旧版以Base64 TEXT存储图片的 image_store 流式迁移为 元数据表 + BLOB表
+    按ID分批读取、解码、写入，每批一个事务，内存占用只与批大小有关；中途中断后再次运行会从已迁移的最大ID继续。
+    全部完成后用新表替换旧表（旧表空间需 VACUUM 后才会归还给文件系统）。
+    无法解码的行（Base64数据或感知哈希损坏）原样转存到 image_store_corrupt 表中并跳过，不会中断迁移。
+    :param conn: 图片库连接
+    :param batch_size: 每批行数
+    :param progress: 可选回调 progress(已迁移数, 总数)
+    :return: (本次迁移的行数, 转存到 image_store_corrupt 的行数)，不是旧版结构时返回 (0, 0)
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(image_store)")}
+    if "base64_data" not in columns:
+        return 0, 0
+
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS image_store_migrated ({IMAGE_STORE_COLUMNS});
+        CREATE TABLE IF NOT EXISTS image_blob ({IMAGE_BLOB_COLUMNS});
+        CREATE TABLE IF NOT EXISTS image_store_corrupt (
+            id INTEGER PRIMARY KEY,
+            qq_number TEXT,
+            base64_data TEXT,
+            perceptual_hash,
+            upload_time TIMESTAMP
+        );
+    """)
+    total = conn.execute("SELECT COUNT(*) FROM image_store").fetchone()[0]
+    last_id, done = conn.execute(
+        "SELECT COALESCE(MAX(id), 0), COUNT(*) FROM image_store_migrated"
+    ).fetchone()
+    done += conn.execute("SELECT COUNT(*) FROM image_store_corrupt WHERE id <= ?", (last_id,)).fetchone()[0]
+    migrated = skipped = 0
+    while True:
+        rows = conn.execute("""
+            SELECT id, qq_number, base64_data, perceptual_hash, upload_time
+            FROM image_store WHERE id > ? ORDER BY id LIMIT ?
+        """, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        with conn:
+            for image_id, qq_number, base64_data, perceptual_hash, upload_time in rows:
+                try:
+                    data = decode_image_data(base64_data)
+                    # 更早的版本中感知哈希是64字符01串
+                    if isinstance(perceptual_hash, str):
+                        stored_hash = ImageDatabaseManager._text_hash_to_db(perceptual_hash)
+                    else:
+                        stored_hash = perceptual_hash
+                except (ValueError, TypeError) as e:
+                    # binascii.Error 是 ValueError 的子类；NULL 数据为 TypeError
+                    print(f"图片 {image_id} 的数据无法解码，已转存到 image_store_corrupt: {str(e)}")
+                    conn.execute("""
+                        INSERT OR REPLACE INTO image_store_corrupt
+                            (id, qq_number, base64_data, perceptual_hash, upload_time)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, (image_id, qq_number, base64_data, perceptual_hash, upload_time))
+                    skipped += 1
+                    continue
+                conn.execute("""
+                    INSERT INTO image_store_migrated (id, qq_number, perceptual_hash, file_size, upload_time)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (image_id, qq_number, stored_hash, len(data), upload_time))
+                conn.execute(
+                    "INSERT OR REPLACE INTO image_blob (image_id, data) VALUES (?, ?)", (image_id, data)
+                )
+                migrated += 1
+        last_id = rows[-1][0]
+        if progress:
+            progress(done + migrated + skipped, total)
+
+    with conn:
+        conn.executescript("""
+            BEGIN;
+            DROP TABLE image_store;
+            ALTER TABLE image_store_migrated RENAME TO image_store;
+            CREATE INDEX IF NOT EXISTS idx_qq_number ON image_store (qq_number);
+            CREATE INDEX IF NOT EXISTS idx_perceptual_hash ON image_store (perceptual_hash);
+            COMMIT;
+        """)
+    return migrated, skipped
 
 class ImageDatabaseManager:
-    """以 Base64 编码存储图片数据的 SQLite 数据库管理器"""
+    """以 BLOB 存储原始图片字节的 SQLite 数据库管理器"""
     
-    def __init__(self, db_path: str = "image_data.db", similarity_threshold: float = 0.9):
+    # 随机图片抽中已被删除的行时的最大重试次数
+    RANDOM_RETRIES = 5
+
+    def __init__(self, db_path: str = "image_data.db", similarity_threshold: float = 0.9,
+                 sampler: ImageSampler = None):
         """
         初始化数据库连接并创建表
         :param db_path: 数据库文件路径
         :param similarity_threshold: 图片相似度阈值(0.0-1.0)，越高要求越相似
+        :param sampler: 随机图片抽样器（去重/偏向新图的配置），默认均匀抽样
         """
         self.conn = sqlite3.connect(db_path)
         self.similarity_threshold = similarity_threshold
+        migrated, skipped = migrate_base64_store(
+            self.conn, progress=lambda done, total: print(f"图片库迁移中: {done}/{total}")
+        )
+        if migrated:
+            print(f"已将 {migrated} 张Base64图片迁移为BLOB存储")
+        if skipped:
+            print(f"{skipped} 张图片数据损坏，已转存到 image_store_corrupt")
         self._create_table()
+        self._backfill_content_hashes()
+        # 入库各路径的计数
+        self.insert_stats = {"inserted": 0, "exact_duplicates": 0, "similar_duplicates": 0, "failed": 0}
+        # 感知哈希的内存索引与随机抽样用的ID列表，启动时从数据库构建，插入/删除时同步更新
+        self.index = HammingIndex()
+        self.sampler = sampler or ImageSampler()
+        self._load_index()
 
     def _create_table(self):
-        """创建数据表（如果不存在）"""
+        """创建数据表（如果不存在），为旧表补上 content_hash 列"""
+        self.conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS image_store ({IMAGE_STORE_COLUMNS});
+        CREATE TABLE IF NOT EXISTS image_blob ({IMAGE_BLOB_COLUMNS});
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(image_store)")}
+        if "content_hash" not in columns:
+            self.conn.execute("ALTER TABLE image_store ADD COLUMN content_hash BLOB")
         sql = """
-        CREATE TABLE IF NOT EXISTS image_store (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            qq_number TEXT NOT NULL,
-            base64_data TEXT NOT NULL,
-            perceptual_hash TEXT NOT NULL,
-            upload_time DATETIME DEFAULT CURRENT_TIMESTAMP
-        );
         CREATE INDEX IF NOT EXISTS idx_qq_number ON image_store (qq_number);
         CREATE INDEX IF NOT EXISTS idx_perceptual_hash ON image_store (perceptual_hash);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_content_hash ON image_store (content_hash);
         """
         self.conn.executescript(sql)
         self.conn.commit()
 
-    def _calculate_perceptual_hash(self, base64_data: str) -> str:
+    def _backfill_content_hashes(self, batch_size: int = MIGRATION_BATCH_SIZE):
+        """
+        为缺少内容摘要的记录（旧版本存入或刚迁移的）补算SHA-256，按ID分批流式读取BLOB
+        与已有图片字节完全相同的记录（旧版本未做精确查重时存入）直接删除，只保留最早的一张，
+        避免其摘要一直为空、每次启动都被重新读取
+        """
+        last_id = 0
+        filled = 0
+        removed = 0
+        while True:
+            rows = self.conn.execute("""
+                SELECT s.id, b.data FROM image_store s JOIN image_blob b ON b.image_id = s.id
+                WHERE s.content_hash IS NULL AND s.id > ? ORDER BY s.id LIMIT ?
+            """, (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            with self.conn:
+                for image_id, data in rows:
+                    try:
+                        self.conn.execute(
+                            "UPDATE image_store SET content_hash = ? WHERE id = ?",
+                            (self._content_digest(data), image_id)
+                        )
+                        filled += 1
+                    except sqlite3.IntegrityError:
+                        # 在索引加载前执行，无需同步更新索引与抽样器
+                        self.conn.execute("DELETE FROM image_store WHERE id = ?", (image_id,))
+                        self.conn.execute("DELETE FROM image_blob WHERE image_id = ?", (image_id,))
+                        removed += 1
+            last_id = rows[-1][0]
+        if filled:
+            print(f"已为 {filled} 张图片补算内容摘要")
+        if removed:
+            print(f"已删除 {removed} 张与已有图片完全相同的重复图片")
+
+    @staticmethod
+    def _content_digest(image_data: bytes) -> bytes:
+        """图片字节的SHA-256摘要"""
+        return hashlib.sha256(image_data).digest()
+
+    def _is_exact_duplicate(self, digest: bytes) -> bool:
+        """通过唯一索引检查是否已存在字节完全相同的图片"""
+        cursor = self.conn.execute("SELECT 1 FROM image_store WHERE content_hash = ?", (digest,))
+        return cursor.fetchone() is not None
+
+    def _load_index(self):
+        """从数据库加载所有感知哈希到索引，ID按升序加入抽样器"""
+        cursor = self.conn.execute("SELECT id, perceptual_hash FROM image_store ORDER BY id")
+        for image_id, stored_hash in cursor:
+            self.index.add(image_id, self._from_db(stored_hash))
+            self.sampler.add(image_id)
+
+    @staticmethod
+    def _to_db(perceptual_hash: int) -> int:
+        """无符号64位哈希转换为SQLite可存储的有符号64位整数"""
+        return perceptual_hash - (1 << 64) if perceptual_hash >= (1 << 63) else perceptual_hash
+
+    @staticmethod
+    def _from_db(stored_hash: int) -> int:
+        """SQLite中的有符号64位整数还原为无符号哈希"""
+        return stored_hash & ((1 << 64) - 1)
+
+    @classmethod
+    def _text_hash_to_db(cls, perceptual_hash: str) -> int:
+        """旧版01字符串哈希转换为数据库中的整数"""
+        return cls._to_db(int(perceptual_hash, 2))
+
+    def _max_distance(self, threshold: float) -> int:
+        """相似度阈值对应的最大汉明距离"""
+        return int(64 * (1 - threshold))
+
+    def _calculate_perceptual_hash(self, image_data: bytes) -> int:
         """
         计算图片的感知哈希值（pHash算法）
-        :param base64_data: 图片的Base64编码
-        :return: 感知哈希值字符串
+        :param image_data: 图片的原始字节
+        :return: 64位无符号整数形式的感知哈希（第一个像素为最高位）
         """
         try:
-            # 解码Base64数据
-            img_data = base64.b64decode(base64_data.split(',')[-1] if ',' in base64_data else base64_data)
-            img = Image.open(BytesIO(img_data))
+            img = Image.open(BytesIO(image_data))
             
             # 转为灰度图并缩放到8x8
             img = img.convert('L').resize((8, 8), Image.Resampling.LANCZOS)
@@ -54,110 +255,151 @@ class ImageDatabaseManager:
             
             # 生成64位哈希值（高于平均值记为1，否则为0）
             diff = pixels > avg_pixel
-            # 将布尔数组转换为01字符串
-            phash = ''.join('1' if x else '0' for x in diff.flatten())
-            return phash
+            return int.from_bytes(np.packbits(diff.flatten()).tobytes(), 'big')
             
         except Exception as e:
             print(f"计算感知哈希失败: {e}")
             # 出错时返回全0哈希，确保不影响后续操作
-            return '0' * 64
+            return 0
 
-    def _hamming_distance(self, hash1: str, hash2: str) -> int:
+    def _hamming_distance(self, hash1: int, hash2: int) -> int:
         """
         计算两个哈希值之间的汉明距离
         :return: 不同位的数量
         """
-        return sum(c1 != c2 for c1, c2 in zip(hash1, hash2))
+        return (hash1 ^ hash2).bit_count()
 
-    def _is_similar_image_exists(self, perceptual_hash: str) -> bool:
+    def _is_similar_image_exists(self, perceptual_hash: int) -> bool:
         """
-        检查数据库中是否存在相似图片
+        检查数据库中是否存在相似图片（通过索引，只校验候选）
         :param perceptual_hash: 待检查图片的感知哈希值
         :return: 是否存在相似图片
         """
-        # 获取所有图片的感知哈希值
-        cursor = self.conn.execute("SELECT perceptual_hash FROM image_store")
-        stored_hashes = cursor.fetchall()
-        
-        hash_length = len(perceptual_hash)
-        max_distance = int(hash_length * (1 - self.similarity_threshold))
-        
-        # 计算与现有图片的相似度
-        for (stored_hash,) in stored_hashes:
-            if self._hamming_distance(perceptual_hash, stored_hash) <= max_distance:
-                return True
-                
-        return False
-
-    def insert_image(self, qq_number: str, base64_data: str) -> bool:
-        """
-        插入图片数据（使用感知哈希检查相似性）
+        return self.index.any_within(perceptual_hash, self._max_distance(self.similarity_threshold))
+
+    def insert_image(self, qq_number: str, image_data) -> bool:
+        """
+        插入图片数据（先按内容摘要精确查重，再用感知哈希检查相似性）
         :param qq_number: 用户QQ号
-        :param base64_data: 图片的Base64编码字符串
+        :param image_data: 图片的原始字节（兼容Base64字符串）
         :return: True=插入成功, False=数据已存在或插入失败
         """
         try:
+            image_data = decode_image_data(image_data)
+            # 字节完全相同的重复上传在解码图片之前直接拒绝
+            digest = self._content_digest(image_data)
+            if self._is_exact_duplicate(digest):
+                self.insert_stats["exact_duplicates"] += 1
+                print("已存在完全相同的图片，跳过插入")
+                return False
+
             # 计算感知哈希
-            perceptual_hash = self._calculate_perceptual_hash(base64_data)
+            perceptual_hash = self._calculate_perceptual_hash(image_data)
             
             # 检查是否存在相似图片
             if self._is_similar_image_exists(perceptual_hash):
+                self.insert_stats["similar_duplicates"] += 1
                 print("已存在相似图片，跳过插入")
                 return False
 
-            # 插入新数据
-            sql = """
-                INSERT INTO image_store (qq_number, base64_data, perceptual_hash)
-                VALUES (?, ?, ?)
-            """
-            self.conn.execute(sql, (qq_number, base64_data, perceptual_hash))
-            self.conn.commit()
+            # 元数据与图片字节在同一事务中插入
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO image_store (qq_number, perceptual_hash, file_size, content_hash) VALUES (?, ?, ?, ?)",
+                    (qq_number, self._to_db(perceptual_hash), len(image_data), digest)
+                )
+                self.conn.execute(
+                    "INSERT INTO image_blob (image_id, data) VALUES (?, ?)",
+                    (cursor.lastrowid, sqlite3.Binary(image_data))
+                )
+            self.index.add(cursor.lastrowid, perceptual_hash)
+            self.sampler.add(cursor.lastrowid)
+            self.insert_stats["inserted"] += 1
             return True
+        except sqlite3.IntegrityError:
+            # 其他连接在查重之后插入了相同内容
+            self.insert_stats["exact_duplicates"] += 1
+            print("已存在完全相同的图片，跳过插入")
+            return False
         except sqlite3.Error as e:
+            self.insert_stats["failed"] += 1
             print(f"插入失败: {e}")
             return False
         except Exception as e:
+            self.insert_stats["failed"] += 1
             print(f"处理图片时发生错误: {e}")
             return False
 
+    def delete_image(self, image_id: int) -> bool:
+        """
+        删除一张图片
+        :param image_id: 图片ID
+        :return: 是否删除了记录
+        """
+        try:
+            with self.conn:
+                cursor = self.conn.execute("DELETE FROM image_store WHERE id = ?", (image_id,))
+                self.conn.execute("DELETE FROM image_blob WHERE image_id = ?", (image_id,))
+            self.index.remove(image_id)
+            self.sampler.discard(image_id)
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"删除失败: {e}")
+            return False
+
     def get_images_by_qq(self, qq_number: str) -> list:
         """
-        按QQ号查询所有关联的图片数据
+        按QQ号查询所有关联图片的元数据（不含图片内容，需要时用 get_image 按ID读取）
         :param qq_number: 要查询的QQ号
-        :return: 查询结果列表（按时间倒序）
+        :return: (id, qq_number, file_size, upload_time) 列表（按时间倒序）
         """
         try:
-            sql = "SELECT * FROM image_store WHERE qq_number = ? ORDER BY upload_time DESC"
+            sql = """
+                SELECT id, qq_number, file_size, upload_time
+                FROM image_store WHERE qq_number = ? ORDER BY upload_time DESC
+            """
             cursor = self.conn.execute(sql, (qq_number,))
             return cursor.fetchall()
         except sqlite3.Error as e:
             print(f"查询数据失败: {e}")
             return []
 
-    def get_random_image(self) -> str | None:
+    def get_image(self, image_id: int) -> bytes | None:
         """
-        随机获取一条图片的 Base64 数据
-        :return: Base64 字符串（若无数据返回 None）
+        读取一张图片的原始字节
+        :param image_id: 图片ID
+        :return: 图片字节（不存在时返回 None）
         """
         try:
-            sql = """
-                SELECT base64_data 
-                FROM image_store 
-                ORDER BY RANDOM() 
-                LIMIT 1
-            """
-            cursor = self.conn.execute(sql)
+            cursor = self.conn.execute("SELECT data FROM image_blob WHERE image_id = ?", (image_id,))
             result = cursor.fetchone()
             return result[0] if result else None
         except sqlite3.Error as e:
-            print(f"随机查询失败: {e}")
+            print(f"读取图片失败: {e}")
             return None
+
+    def get_random_image(self, scope=None) -> bytes | None:
+        """
+        随机获取一张图片的原始字节（从内存ID列表中O(1)抽样后按主键读取）
+        :param scope: 去重范围（如 "group:群号"），为None时不去重
+        :return: 图片字节（若无数据返回 None）
+        """
+        for _ in range(self.RANDOM_RETRIES):
+            image_id = self.sampler.sample(scope)
+            if image_id is None:
+                return None
+            data = self.get_image(image_id)
+            if data is not None:
+                return data
+            # 行已被其他连接删除，标记后重抽
+            self.sampler.discard(image_id)
+        print("随机查询失败: 多次抽中已删除的图片")
+        return None
             
-    def find_similar_images(self, base64_data: str, threshold: float = None) -> list:
+    def find_similar_images(self, image_data, threshold: float = None) -> list:
         """
         查找与输入图片相似的所有图片
-        :param base64_data: 图片的Base64编码字符串
+        :param image_data: 图片的原始字节（兼容Base64字符串）
         :param threshold: 可选的自定义阈值，不指定则使用实例默认值
         :return: 相似图片列表
         """
@@ -165,34 +407,47 @@ class ImageDatabaseManager:
             threshold = self.similarity_threshold
             
         try:
-            # 计算输入图片的感知哈希
-            query_hash = self._calculate_perceptual_hash(base64_data)
-            hash_length = len(query_hash)
-            max_distance = int(hash_length * (1 - threshold))
-            
-            # 获取所有图片哈希值
-            cursor = self.conn.execute("SELECT id, qq_number, perceptual_hash FROM image_store")
-            results = []
-            
-            for row in cursor.fetchall():
-                id, qq, stored_hash = row
-                distance = self._hamming_distance(query_hash, stored_hash)
-                similarity = 1 - (distance / hash_length)
-                
-                if distance <= max_distance:
-                    results.append({
-                        "id": id,
-                        "qq_number": qq,
-                        "similarity": similarity
-                    })
-            
-            # 按相似度降序排序
-            return sorted(results, key=lambda x: x["similarity"], reverse=True)
+            # 计算输入图片的感知哈希，通过索引查找候选
+            query_hash = self._calculate_perceptual_hash(decode_image_data(image_data))
+            matches = self.index.within(query_hash, self._max_distance(threshold))
+            return self._describe_matches(matches)
             
         except Exception as e:
             print(f"查找相似图片失败: {e}")
             return []
 
+    def find_nearest_images(self, image_data, k: int = 5) -> list:
+        """
+        查找与输入图片最相似的 k 张图片（不限阈值）
+        :param image_data: 图片的原始字节（兼容Base64字符串）
+        :param k: 返回数量
+        :return: 相似图片列表（按相似度降序）
+        """
+        try:
+            query_hash = self._calculate_perceptual_hash(decode_image_data(image_data))
+            return self._describe_matches(self.index.nearest(query_hash, k))
+        except Exception as e:
+            print(f"查找最相似图片失败: {e}")
+            return []
+
+    def _describe_matches(self, matches: list) -> list:
+        """将索引返回的 (ID, 距离) 补充QQ号并换算相似度"""
+        if not matches:
+            return []
+        ids = [image_id for image_id, _ in matches]
+        placeholders = ",".join("?" * len(ids))
+        owners = dict(self.conn.execute(
+            f"SELECT id, qq_number FROM image_store WHERE id IN ({placeholders})", ids
+        ))
+        return [
+            {
+                "id": image_id,
+                "qq_number": owners[image_id],
+                "similarity": 1 - (distance / 64)
+            }
+            for image_id, distance in matches if image_id in owners
+        ]
+
     def close(self):
         """关闭数据库连接"""
         self.conn.close()
\ No newline at end of file
@@ -0,0 +1,78 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+class BalanceMonitor:
+    """
+    API余额监控：后台定时查询并缓存最近一次结果，查询余额时直接读取内存
+    余额低于阈值时触发一次提醒，回升到阈值以上后才会再次提醒
+    """
+
+    def __init__(self, fetch: Callable[[], Awaitable[float]], interval: float, low_threshold: float):
+        """
+        :param fetch: 查询余额的协程函数，失败时抛出异常
+        :param interval: 查询间隔(秒)
+        :param low_threshold: 低余额提醒阈值
+        """
+        self.fetch = fetch
+        self.interval = interval
+        self.low_threshold = low_threshold
+        self.balance: Optional[float] = None
+        self.updated_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self._alerted = False
+        self._refresh_lock: Optional[asyncio.Lock] = None
+
+    async def refresh(self) -> Optional[float]:
+        """立即查询一次余额并更新缓存，失败时保留上一次的值"""
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            try:
+                self.balance = await self.fetch()
+                self.updated_at = time.time()
+                self.error = None
+            except Exception as e:
+                self.error = str(e)
+                logging.error(f"获取余额错误: {self.error}")
+            return self.balance
+
+    def is_low(self) -> bool:
+        return self.balance is not None and self.balance < self.low_threshold
+
+    async def run(self, on_low: Optional[Callable[[float], Awaitable[Any]]] = None):
+        """
+        后台任务：定时查询余额
+        :param on_low: 余额首次低于阈值时调用的提醒回调
+        """
+        while True:
+            await self.refresh()
+            if self.is_low():
+                if not self._alerted and on_low is not None:
+                    self._alerted = True
+                    try:
+                        await on_low(self.balance)
+                    except Exception as e:
+                        logging.error(f"发送低余额提醒失败: {str(e)}")
+            elif self.balance is not None:
+                self._alerted = False
+            await asyncio.sleep(self.interval)
+
+    def describe(self) -> str:
+        """余额的文字描述（含更新时间）"""
+        if self.balance is None:
+            return f"查询失败: {self.error}" if self.error else "尚未查询"
+        age = int(time.time() - self.updated_at)
+        text = f"{self.balance:.2f}（{age}秒前更新）"
+        if self.error:
+            text += f"，最近一次查询失败: {self.error}"
+        return text
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "balance": self.balance,
+            "updated_at": self.updated_at,
+            "error": self.error,
+            "low": self.is_low()
+        }
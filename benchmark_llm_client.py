@@ -0,0 +1,113 @@
+"""
+LLM请求基准：在本地替身补全接口上比较三种调用方式
+  - 阻塞调用：在事件循环中同步请求（原先 requests.post 的行为，请求被串行化）
+  - 每次新建客户端：每个请求新建 httpx.AsyncClient（无连接复用）
+  - 共享客户端：经 ChatManager.get_chat_response 走共享长连接客户端（完整请求路径）
+
+用法：
+    python benchmark_llm_client.py                        # 20个用户并发，上游延迟0.2秒
+    python benchmark_llm_client.py --users 50 --delay 0.5
+会话、用量等数据写入临时目录，不影响本地数据。
+"""
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from config import Config
+
+def build_stub(delay: float) -> FastAPI:
+    """替身OpenAI兼容补全接口：固定延迟后回显最后一条消息"""
+    app = FastAPI()
+
+    @app.post("/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(delay)
+        return {
+            "choices": [{"message": {"role": "assistant", "content": "echo:" + body["messages"][-1]["content"]}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30}
+        }
+
+    return app
+
+def start_stub(app: FastAPI) -> str:
+    """在独立线程中运行替身接口（阻塞调用会卡住当前事件循环，不能与其共用），返回补全地址"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="critical"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    return f"http://127.0.0.1:{port}/chat/completions"
+
+def _payload(user: int):
+    return {"model": "stub", "messages": [{"role": "user", "content": f"问题{user}"}]}
+
+async def blocking_calls(endpoint: str, users: int):
+    with httpx.Client() as client:
+        async def one(user):
+            client.post(endpoint, json=_payload(user)).raise_for_status()
+        await asyncio.gather(*(one(user) for user in range(users)))
+
+async def new_client_calls(endpoint: str, users: int):
+    async def one(user):
+        async with httpx.AsyncClient() as client:
+            (await client.post(endpoint, json=_payload(user))).raise_for_status()
+    await asyncio.gather(*(one(user) for user in range(users)))
+
+async def shared_client_calls(chat_manager, users: int):
+    results = await asyncio.gather(*(chat_manager.get_chat_response(user, f"问题{user}") for user in range(users)))
+    failed = [result for result in results if result[0] != 200]
+    assert not failed, f"请求失败: {failed[:3]}"
+
+async def main_async(args):
+    endpoint = start_stub(build_stub(args.delay))
+
+    tmp = tempfile.mkdtemp(prefix="llm_bench_")
+    Config.HISTORY_DIR = os.path.join(tmp, "history")
+    Config.SESSION_DB_PATH = os.path.join(tmp, "sessions.db")
+    Config.USAGE_DB_PATH = os.path.join(tmp, "usage.db")
+    Config.LLM_BACKENDS = [{"name": "stub", "endpoint": endpoint, "model": "stub", "api_key": "x"}]
+    # 只比较HTTP层：关闭排队上限与自适应并发
+    Config.LLM_MAX_CONCURRENT = max(Config.LLM_MAX_CONCURRENT, args.users)
+    Config.LLM_ADAPTIVE_CONCURRENCY = False
+    Config.HISTORY_SUMMARY_ENABLED = False
+    Config.init()
+    from chat_manager import ChatManager
+    chat_manager = ChatManager()
+
+    cases = [
+        ("阻塞调用(原实现)", lambda: blocking_calls(endpoint, args.users)),
+        ("每次新建客户端", lambda: new_client_calls(endpoint, args.users)),
+        ("共享客户端(ChatManager)", lambda: shared_client_calls(chat_manager, args.users)),
+    ]
+    print(f"{args.users} 个用户并发，上游延迟 {args.delay:.2f}s")
+    try:
+        for name, run in cases:
+            timings = []
+            for _ in range(args.rounds):
+                # 每轮使用新的会话，避免回复缓存与历史增长影响结果
+                chat_manager.sessions.clear()
+                chat_manager.response_cache.clear()
+                start = time.perf_counter()
+                await run()
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            print(f"{name:<24} 最快一轮 {best:6.2f}s | {args.users / best:7.1f} 请求/秒")
+    finally:
+        await chat_manager.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM请求方式基准")
+    parser.add_argument("--users", type=int, default=20, help="并发用户数")
+    parser.add_argument("--delay", type=float, default=0.2, help="替身接口的响应延迟(秒)")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
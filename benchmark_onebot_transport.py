@@ -0,0 +1,101 @@
+"""
+OneBot出站发送基准：比较HTTP POST与反向WebSocket两种传输
+
+在本地启动一个替身OneBot（HTTP接口 + 反向WebSocket客户端，均立即应答），
+分别用两种传输发送同样数量的消息，统计吞吐与单次延迟。
+
+用法：
+    python benchmark_onebot_transport.py                       # 2000条，并发1/16
+    python benchmark_onebot_transport.py --messages 5000 --concurrency 1 8 64
+"""
+import json
+import time
+import asyncio
+import argparse
+import statistics
+import uvicorn
+import websockets
+from fastapi import FastAPI, WebSocket
+from config import Config
+from onebot_ws import OneBotWebSocket
+from message_handler import MessageHandler
+
+def build_app(onebot: OneBotWebSocket) -> FastAPI:
+    app = FastAPI()
+
+    async def ignore_event(event):
+        pass
+
+    @app.websocket(Config.WS_PATH)
+    async def ws_endpoint(websocket: WebSocket):
+        await onebot.serve(websocket, ignore_event)
+
+    @app.post("/{action}")
+    async def http_action(action: str):
+        return {"status": "ok", "retcode": 0, "data": {"message_id": 1}}
+
+    return app
+
+async def stand_in_client(url: str):
+    """替身LLOneBot的反向WebSocket客户端：对每个API调用立即应答"""
+    async with websockets.connect(url) as connection:
+        async for frame in connection:
+            request = json.loads(frame)
+            await connection.send(json.dumps({"status": "ok", "retcode": 0, "data": {}, "echo": request["echo"]}))
+
+async def run_batch(handler: MessageHandler, messages: int, concurrency: int):
+    """以给定并发发送 messages 条消息，返回 (总耗时秒, 各次延迟毫秒)"""
+    latencies = []
+    counter = iter(range(messages))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            response = await handler.send_message(1, [{"type": "text", "data": {"text": f"消息{i}"}}])
+            assert response is not None, "发送失败"
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+async def main_async(args):
+    onebot = OneBotWebSocket()
+    server = uvicorn.Server(uvicorn.Config(build_app(onebot), host="127.0.0.1", port=0, log_level="critical"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    client_task = asyncio.create_task(stand_in_client(f"ws://127.0.0.1:{port}{Config.WS_PATH}"))
+    while not onebot.connected:
+        await asyncio.sleep(0.01)
+
+    handler = MessageHandler(websocket=onebot)
+    handler.server_url = f"http://127.0.0.1:{port}/send_group_msg"
+    Config.WS_HTTP_FALLBACK = False
+    try:
+        for transport in ("http", "ws"):
+            Config.ONEBOT_TRANSPORT = transport
+            # 预热（建立连接）
+            await run_batch(handler, 50, 1)
+            for concurrency in args.concurrency:
+                elapsed, latencies = await run_batch(handler, args.messages, concurrency)
+                latencies.sort()
+                print(f"{transport:>4} 并发{concurrency:>3} | {args.messages / elapsed:8.0f} 条/秒 | "
+                      f"平均 {statistics.mean(latencies):6.2f} ms | "
+                      f"p99 {latencies[int(len(latencies) * 0.99) - 1]:6.2f} ms")
+    finally:
+        await handler.close()
+        client_task.cancel()
+        server.should_exit = True
+        await server_task
+
+def main():
+    parser = argparse.ArgumentParser(description="OneBot HTTP/WebSocket发送基准")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
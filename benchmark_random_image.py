@@ -0,0 +1,80 @@
+"""
+随机图片基准：比较 ORDER BY RANDOM() 与内存ID列表O(1)抽样
+
+用法：
+    python benchmark_random_image.py                      # 1千/1万/10万张
+    python benchmark_random_image.py --sizes 10000 --blob-size 65536
+在临时目录中生成图库（随机字节代替真实图片），不会修改 image_data.db。
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+from ImageDatabaseManager import ImageDatabaseManager
+from image_sampler import ImageSampler
+
+def _timeit(func, repeat: int) -> float:
+    """执行 repeat 次，返回平均耗时(毫秒)"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def _fill(db: ImageDatabaseManager, size: int, blob_size: int):
+    """直接批量写入元数据与BLOB（跳过感知哈希计算）"""
+    base = os.urandom(max(blob_size, 8))
+    with db.conn:
+        for start in range(0, size, 1000):
+            # 每张图片字节各不相同（开头写入ID），并写好内容摘要，重新打开时不会被当作重复图片删除
+            blobs = [
+                (image_id, image_id.to_bytes(8, "little") + base[8:])
+                for image_id in range(start + 1, min(size, start + 1000) + 1)
+            ]
+            db.conn.executemany(
+                "INSERT INTO image_store (id, qq_number, perceptual_hash, file_size, content_hash) VALUES (?, ?, ?, ?, ?)",
+                ((image_id, "0", random.getrandbits(63), len(data), db._content_digest(data))
+                 for image_id, data in blobs)
+            )
+            db.conn.executemany("INSERT INTO image_blob (image_id, data) VALUES (?, ?)", blobs)
+
+def bench_size(size: int, blob_size: int, repeat: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "images.db")
+        db = ImageDatabaseManager(path)
+        _fill(db, size, blob_size)
+        db.close()
+
+        start = time.perf_counter()
+        db = ImageDatabaseManager(path, sampler=ImageSampler(no_repeat=20, recent_count=100, recent_ratio=0.3))
+        load_ms = (time.perf_counter() - start) * 1000
+
+        order_by_ms = _timeit(
+            lambda: db.conn.execute("SELECT data FROM image_blob ORDER BY RANDOM() LIMIT 1").fetchone(),
+            max(1, min(repeat, 20))
+        )
+        uniform_ms = _timeit(db.get_random_image, repeat)
+        scoped_ms = _timeit(lambda: db.get_random_image("group:1"), repeat)
+
+        # 删除一成图片后（标记删除，抽中时重抽）
+        for image_id in random.sample(range(1, size + 1), size // 10):
+            db.delete_image(image_id)
+        deleted_ms = _timeit(lambda: db.get_random_image("group:1"), repeat)
+        db.close()
+
+    print(f"{size:>9,} 张 | 启动加载 {load_ms:8.1f} ms | ORDER BY RANDOM() {order_by_ms:9.3f} ms | "
+          f"抽样 {uniform_ms:6.3f} ms | 去重+偏向新图 {scoped_ms:6.3f} ms | 删除10%后 {deleted_ms:6.3f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="随机图片抽样基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--blob-size", type=int, default=4096, help="每张图片的字节数")
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    for size in args.sizes:
+        bench_size(size, args.blob_size, args.repeat)
+
+if __name__ == "__main__":
+    main()
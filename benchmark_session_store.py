@@ -0,0 +1,82 @@
+"""
+会话存储基准：10万个会话下的读取、写入与批量落盘
+
+用法：
+    python benchmark_session_store.py                     # 10万个会话，每个会话10条消息
+    python benchmark_session_store.py --sessions 20000 --messages 30
+SQLite库建在临时目录中，不影响本地数据。
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from session_store import MemorySessionBackend, SQLiteSessionBackend
+
+def _messages(count: int):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"第{i}条消息，内容长度大致相当于一句普通的聊天。"}
+        for i in range(count)
+    ]
+
+async def _max_loop_lag(stop: asyncio.Event) -> float:
+    """落盘期间事件循环的最大延迟(毫秒)，用于确认落盘没有阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(0.001)
+        worst = max(worst, loop.time() - start - 0.001)
+    return worst * 1000
+
+async def bench_backend(name: str, backend, sessions: int, messages: int, lookups: int):
+    history = _messages(messages)
+
+    start = time.perf_counter()
+    for user_id in range(sessions):
+        backend.save(user_id, history)
+    save_us = (time.perf_counter() - start) / sessions * 1e6
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(_max_loop_lag(stop))
+    start = time.perf_counter()
+    await backend.flush()
+    flush_s = time.perf_counter() - start
+    stop.set()
+    lag_ms = await lag_task
+
+    users = [random.randrange(sessions) for _ in range(lookups)]
+    start = time.perf_counter()
+    for user_id in users:
+        assert backend.load(user_id) is not None
+    load_us = (time.perf_counter() - start) / lookups * 1e6
+
+    # 已落盘后追加一轮对话（只写入内存缓冲）
+    longer = history + _messages(2)
+    start = time.perf_counter()
+    for user_id in users:
+        backend.save(user_id, longer)
+    append_us = (time.perf_counter() - start) / lookups * 1e6
+    await backend.close()
+
+    print(f"{name:<7} {sessions:>7,} 个会话 | 写入 {save_us:6.2f} us | 全部落盘 {flush_s:6.2f} s "
+          f"(事件循环最大延迟 {lag_ms:6.1f} ms) | 读取 {load_us:6.2f} us | 追加 {append_us:6.2f} us")
+
+async def main_async(args):
+    random.seed(0)
+    await bench_backend("memory", MemorySessionBackend(3600), args.sessions, args.messages, args.lookups)
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SQLiteSessionBackend(os.path.join(tmp, "sessions.db"))
+        await bench_backend("sqlite", backend, args.sessions, args.messages, args.lookups)
+
+def main():
+    parser = argparse.ArgumentParser(description="会话存储基准")
+    parser.add_argument("--sessions", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=10, help="每个会话的消息数")
+    parser.add_argument("--lookups", type=int, default=20_000, help="随机读取次数")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
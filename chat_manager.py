@@ -1,136 +1,668 @@
 import json
+import re
+import asyncio
 import httpx
 import logging
-import random
-import pandas as pd
-import requests
 import time
-from typing import Dict, Tuple, Any
+from typing import Dict, List, Tuple, Any, Callable, Awaitable, Optional
 from config import Config
+from conversation import ConversationSession, estimate_tokens
+from expiring_map import ExpiringDict
+from session_store import create_session_backend
+from video_catalog import VideoCatalog, VideoMetadataStore
+from video_catalog_compiler import fetch_video_info
+from balance_monitor import BalanceMonitor
+from usage_tracker import UsageTracker, SYSTEM_USER
+from llm_router import LLMBackend, LLMRouter
+from response_cache import ResponseCache
+from single_flight import SingleFlight
+from llm_scheduler import (
+    LLMDispatcher, AdaptiveConcurrency, QueueTimeoutError, parse_retry_after,
+    PRIORITY_ADMIN, PRIORITY_GROUP, PRIORITY_BACKGROUND
+)
+
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 流式输出的分段边界：中文句末标点、英文句号后接空白、换行
+SENTENCE_BOUNDARY = re.compile(r'[。！？!?；;…\n]|\.(?=\s)')
 
 class ChatManager:
     def __init__(self):
-        self.sessions: Dict[int, list] = {}
-        self.session_timestamps: Dict[int, float] = {}
         self.session_timeout = Config.SESSION_TIMEOUT if hasattr(Config, 'SESSION_TIMEOUT') else 1800
+        # 活跃会话的内存缓存，按最后访问时间过期；完整数据保存在存储后端
+        self.sessions: ExpiringDict = ExpiringDict(self.session_timeout)
+        self.store = create_session_backend()
+        # 视频目录，文件变化时自动重载
+        self.video_catalog = VideoCatalog(Config.VIDEO_FILE)
+        self.video_metadata = VideoMetadataStore(Config.VIDEO_CATALOG_DB)
+        self.usage = UsageTracker(Config.USAGE_DB_PATH, Config.USAGE_DAILY_TOKEN_QUOTA)
+        self.balance_monitor = BalanceMonitor(
+            self._fetch_balance, Config.BALANCE_POLL_INTERVAL, Config.BALANCE_LOW_THRESHOLD
+        )
+        # 所有对话请求共享的长连接客户端
+        self._client: Optional[httpx.AsyncClient] = None
+        # 无上下文提问的回复缓存
+        self.response_cache = ResponseCache(
+            ttl=Config.RESPONSE_CACHE_TTL,
+            max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+            max_bytes=Config.RESPONSE_CACHE_MAX_BYTES
+        )
+        # 相同上下文的并发请求共享一次上游调用
+        self.single_flight = SingleFlight()
+        # 后台历史摘要：正在压缩的用户及任务（持有引用，避免任务被回收）
+        self._compacting: set = set()
+        self._compaction_tasks: set = set()
+        self._summary_backend: Optional[LLMBackend] = (
+            LLMBackend(**Config.HISTORY_SUMMARY_BACKEND) if Config.HISTORY_SUMMARY_BACKEND else None
+        )
+        # 限制并发补全数，超出部分按优先级排队
+        self.dispatcher = LLMDispatcher(
+            max_concurrent=Config.LLM_MAX_CONCURRENT,
+            max_wait=Config.LLM_QUEUE_MAX_WAIT,
+            notice_delay=Config.LLM_QUEUE_NOTICE_DELAY
+        )
+        # 按上游的429/超时/延迟反馈自适应调整并发上限
+        self.concurrency: Optional[AdaptiveConcurrency] = None
+        if Config.LLM_ADAPTIVE_CONCURRENCY:
+            self.concurrency = AdaptiveConcurrency(
+                self.dispatcher,
+                min_limit=Config.LLM_MIN_CONCURRENT,
+                max_limit=Config.LLM_MAX_CONCURRENT,
+                initial_limit=Config.LLM_INITIAL_CONCURRENT,
+                decrease_factor=Config.LLM_AIMD_DECREASE,
+                latency_spike=Config.LLM_LATENCY_SPIKE,
+                max_retry_after=Config.LLM_RETRY_AFTER_MAX
+            )
+        # 多个OpenAI兼容后端之间按延迟/失败率路由，失败时自动切换
+        self.router = LLMRouter(
+            [LLMBackend(**backend) for backend in Config.LLM_BACKENDS],
+            failure_threshold=Config.LLM_BREAKER_FAILURES,
+            open_seconds=Config.LLM_BREAKER_OPEN_SECONDS,
+            alpha=Config.LLM_ROUTER_EWMA_ALPHA
+        )
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """获取共享的LLM客户端（不存在时创建）"""
+        if self._client is None or self._client.is_closed:
+            http2 = Config.LLM_HTTP2 and HTTP2_AVAILABLE
+            if Config.LLM_HTTP2 and not HTTP2_AVAILABLE:
+                logging.warning("未安装 h2，LLM客户端使用 HTTP/1.1")
+            self._client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=Config.LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.LLM_MAX_KEEPALIVE_CONNECTIONS
+                ),
+                timeout=httpx.Timeout(
+                    connect=Config.LLM_CONNECT_TIMEOUT,
+                    read=Config.LLM_READ_TIMEOUT,
+                    write=Config.LLM_CONNECT_TIMEOUT,
+                    pool=Config.LLM_POOL_TIMEOUT
+                )
+            )
+        return self._client
+
+    async def close(self):
+        """关闭共享的LLM客户端，并将会话落盘"""
+        for task in list(self._compaction_tasks):
+            task.cancel()
+        await asyncio.gather(*self._compaction_tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        await self.store.close()
+        await self.usage.close()
+        self.video_metadata.close()
+
+    async def run_session_flusher(self):
+        """后台任务：定期批量写入会话"""
+        while True:
+            await asyncio.sleep(Config.SESSION_FLUSH_INTERVAL)
+            try:
+                await self.store.flush()
+            except Exception as e:
+                logging.error(f"会话写入失败: {str(e)}")
+
+    async def probe_backend(self, backend: LLMBackend) -> bool:
+        """健康探测：后端能正常应答（非5xx）即视为可用"""
+        response = await self._get_client().get(
+            backend.probe_url,
+            headers=self._build_headers(backend.api_key),
+            timeout=Config.LLM_CONNECT_TIMEOUT
+        )
+        return response.status_code < 500
+
+    async def run_health_probes(self):
+        """后台任务：定期探测已熔断的LLM后端"""
+        await self.router.run_health_probes(self.probe_backend, Config.LLM_PROBE_INTERVAL)
+
+    async def purge_stored_sessions(self) -> int:
+        """删除存储后端中已超时的会话"""
+        return await self.store.purge(time.time() - self.session_timeout)
         
-    def get_fresh_session(self, user_id: int) -> list:
+    @staticmethod
+    def _preset_name(user_id: int) -> Any:
+        """用户所用预设的名称：USER_PRESETS 中的键，或 default"""
+        return user_id if user_id in Config.USER_PRESETS else "default"
+
+    def get_fresh_session(self, user_id: int) -> ConversationSession:
         """获取一个新的会话"""
         preset = Config.USER_PRESETS.get(user_id, Config.DEFAULT_PRESET)
-        self.sessions[user_id] = [preset.copy()]
-        self.session_timestamps[user_id] = time.time()
-        return self.sessions[user_id]
-    
-    def add_message(self, user_id: int, message: str, role: str):
-        """添加消息到当前会话"""
+        session = ConversationSession(preset)
+        self.sessions[user_id] = session
+        return session
+
+    def get_session(self, user_id: int) -> ConversationSession:
+        """获取用户当前会话（首次访问时从存储后端加载，不存在时新建）并刷新活跃时间"""
+        session = self.sessions.get(user_id)
+        if session is None:
+            return self._load_session(user_id)
+        return session
+
+    def _load_session(self, user_id: int) -> ConversationSession:
+        """从存储后端加载会话，已超时的会话视为新会话"""
+        stored = self.store.load(user_id)
+        if stored is None or time.time() - stored[1] > self.session_timeout:
+            return self.get_fresh_session(user_id)
+
         session = self.get_fresh_session(user_id)
-        session.append({"content": message, "role": role})
-        
-    async def get_chat_response(self, user_id: int, message: str) -> Tuple[int, str]:
-        """获取AI响应"""
-        self.clean_expired_sessions()
-        self.add_message(user_id, message, "user")
-        session = self.sessions[user_id]
+        session.restore(stored[0])
+        session.trim(Config.CHAT_HISTORY_TOKEN_BUDGET)
+        return session
+    
+    def _trim_and_save(self, user_id: int, session: ConversationSession):
+        """超出token预算时淘汰最早的对话，并保存会话"""
+        evicted = session.trim(Config.CHAT_HISTORY_TOKEN_BUDGET)
+        if evicted:
+            logging.info(f"用户 {user_id} 的会话超出token预算，淘汰 {evicted} 条历史消息")
+        self.store.save(user_id, session.history())
+
+    def add_message(self, user_id: int, message: str, role: str) -> Dict[str, str]:
+        """添加消息到当前会话，返回加入的消息对象"""
+        session = self.get_session(user_id)
+        added = session.append(role, message)
+        self._trim_and_save(user_id, session)
+        return added
+
+    def add_reply(self, user_id: int, question: Dict[str, str], reply: str):
+        """将回复插入到对应提问之后（同一用户的并发请求不会交错成 问,问,答,答）"""
+        session = self.get_session(user_id)
+        session.insert_after(question, "assistant", reply)
+        self._trim_and_save(user_id, session)
+
+    def discard_message(self, user_id: int, question: Dict[str, str]):
+        """请求失败时移除本次请求加入的提问（不影响同一用户的其他并发请求）"""
+        session = self.sessions.peek(user_id)
+        if session is not None and session.remove(question):
+            self.store.save(user_id, session.history())
         
-        payload = {
-            "messages": session,
-            "model": "deepseek-chat",
+    @staticmethod
+    def _model_params() -> Dict[str, Any]:
+        """对话补全的模型参数"""
+        # 实际请求时替换为所选后端的模型
+        return {
+            "model": Config.LLM_BACKENDS[0]["model"],
             "max_tokens": 2048,
             "temperature": 1,
             "top_p": 1
         }
-        
-        headers = {
+
+    def _build_payload(self, session: ConversationSession, context: Optional[str] = None) -> Dict[str, Any]:
+        """
+        构造对话补全请求体
+        :param context: 本次请求的附加上下文（如群聊最近消息），放在最后一条用户消息之前，不写入会话
+        """
+        messages = session.to_messages()
+        if context:
+            messages.insert(len(messages) - 1, {"role": "system", "content": f"{Config.GROUP_CONTEXT_PROMPT}\n{context}"})
+        return {"messages": messages, **self._model_params()}
+
+    def _cache_key(self, user_id: int, message: str) -> Optional[str]:
+        """
+        计算回复缓存键；仅无历史上下文的提问可以使用缓存
+        :return: 缓存键，不可缓存时返回None
+        """
+        if not Config.RESPONSE_CACHE_ENABLED:
+            return None
+        if self._preset_name(user_id) in Config.RESPONSE_CACHE_EXCLUDED_PRESETS:
+            return None
+        session = self.get_session(user_id)
+        if len(session) > 0 or session.summary:
+            return None
+        preset = Config.USER_PRESETS.get(user_id, Config.DEFAULT_PRESET)
+        return ResponseCache.make_key(preset, message, self._model_params())
+
+    def _build_headers(self, api_key: Optional[str] = None) -> Dict[str, str]:
+        """构造API请求头（默认使用 Config.API_KEY）"""
+        return {
             'Content-Type': 'application/json',
             'Accept': 'application/json',
-            'Authorization': f'Bearer {Config.API_KEY}'
+            'Authorization': f'Bearer {api_key or Config.API_KEY}'
         }
 
+    @staticmethod
+    def _should_failover(error: Exception) -> bool:
+        """判断错误是否由后端引起：超时、连接错误、429/5xx、响应无法解析时切换后端"""
+        if isinstance(error, httpx.HTTPStatusError):
+            status = error.response.status_code
+            return status == 429 or status >= 500
+        return isinstance(error, (asyncio.TimeoutError, httpx.TransportError, ValueError))
+
+    def _report_error(self, error: Exception):
+        """将429/超时反馈给自适应并发控制"""
+        if self.concurrency is None:
+            return
+        if isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429:
+            self.concurrency.on_overload(
+                "上游返回429", parse_retry_after(error.response.headers.get("Retry-After"))
+            )
+        elif isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+            self.concurrency.on_overload("上游请求超时")
+
+    async def _post_completion(self, backend: LLMBackend, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """向指定后端发送一次非流式对话补全请求，返回 (状态码, 响应JSON)"""
+        start = time.monotonic()
         try:
-            response = requests.post(
-                Config.CHAT_ENDPOINT, 
-                headers=headers, 
-                json=payload
+            # 连接/读取超时由客户端控制，整体耗时另设上限
+            response = await asyncio.wait_for(
+                self._get_client().post(
+                    backend.endpoint,
+                    headers=self._build_headers(backend.api_key),
+                    json={**payload, "model": backend.model}
+                ),
+                Config.LLM_TOTAL_TIMEOUT
             )
             response.raise_for_status()
-            
             response_json = response.json()
+        except Exception as e:
+            self._report_error(e)
+            raise
+        if self.concurrency is not None:
+            usage = response_json.get("usage") or {}
+            self.concurrency.on_success(time.monotonic() - start, usage.get("completion_tokens"))
+        return response.status_code, response_json
+
+    async def _request_completion(self, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """按路由选择后端发送补全请求，失败时依次切换到其他后端"""
+        return await self.router.call(
+            lambda backend: self._post_completion(backend, payload),
+            self._should_failover
+        )
+
+    async def _dispatch_completion(self, payload: Dict[str, Any], priority: int,
+                                   on_queued: Optional[Callable[[], Awaitable[Any]]],
+                                   user_id: int, group_id: Optional[int]) -> Tuple[int, Dict[str, Any]]:
+        """占用调度器的并发额度后发送补全请求，并记录用量（合并的请求只由实际发起调用的一方记录）"""
+        async with self.dispatcher.slot(priority, on_queued):
+            start = time.monotonic()
+            status_code, response_json = await self._request_completion(payload)
+            self.usage.record(user_id, group_id, self._preset_name(user_id),
+                              response_json.get("usage"), time.monotonic() - start)
+            return status_code, response_json
+
+    def _check_quota(self, user_id: int, priority: int) -> Optional[Tuple[int, str]]:
+        """检查用户每日token额度（管理员优先级不受限制），超出时返回错误响应"""
+        if priority != PRIORITY_ADMIN and self.usage.quota_exceeded(user_id):
+            logging.warning(f"用户 {user_id} 今日token用量已达上限")
+            return 429, "今日对话额度已用完，请明天再来"
+        return None
+
+    async def get_chat_response(self, user_id: int, message: str, priority: int = PRIORITY_GROUP,
+                                on_queued: Optional[Callable[[], Awaitable[Any]]] = None,
+                                group_id: Optional[int] = None, context: Optional[str] = None) -> Tuple[int, str]:
+        """
+        获取AI响应
+        :param user_id: 用户ID
+        :param message: 用户消息
+        :param priority: 调度优先级（llm_scheduler.PRIORITY_*）
+        :param on_queued: 排队较久时调用的提示回调
+        :param group_id: 群号（私聊为None），用于用量统计
+        :param context: 群聊最近消息等附加上下文，只用于本次请求
+        """
+        quota_error = self._check_quota(user_id, priority)
+        if quota_error is not None:
+            return quota_error
+
+        self.clean_expired_sessions()
+        # 带附加上下文的请求不使用回复缓存
+        cache_key = None if context else self._cache_key(user_id, message)
+        question = self.add_message(user_id, message, "user")
+        session = self.sessions[user_id]
+
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.add_reply(user_id, question, cached)
+                return 200, cached
+        
+        payload = self._build_payload(session, context)
+
+        try:
+            # 上下文与参数完全相同的并发请求只发起一次上游调用，各自处理自己的会话
+            status_code, response_json = await self.single_flight.do(
+                SingleFlight.make_key(payload),
+                lambda: self._dispatch_completion(payload, priority, on_queued, user_id, group_id)
+            )
+            
             if "choices" not in response_json or not response_json["choices"]:
-                return response.status_code, "响应缺少有效的 'choices' 字段"
+                self.discard_message(user_id, question)
+                return status_code, "响应缺少有效的 'choices' 字段"
             
             bot_reply = response_json["choices"][0]["message"]["content"]
             
-            self.end_chat(user_id)
+            self.add_reply(user_id, question, bot_reply)
+            if cache_key is not None:
+                self.response_cache.put(cache_key, bot_reply)
+            self._schedule_compaction(user_id)
             
-            return response.status_code, bot_reply
+            return status_code, bot_reply
+
+        except QueueTimeoutError:
+            logging.warning(f"用户 {user_id} 的请求排队超时")
+            self.discard_message(user_id, question)
+            return 503, "当前请求较多，排队超时，请稍后再试"
+
+        except asyncio.TimeoutError:
+            logging.error(f"Chat请求超时: 超过 {Config.LLM_TOTAL_TIMEOUT} 秒")
+            self.discard_message(user_id, question)
+            return 504, "请求超时，请稍后再试"
             
         except Exception as e:
             logging.error(f"Chat请求错误: {str(e)}")
-            self.end_chat(user_id)
+            self.discard_message(user_id, question)
             return 500, f"请求错误: {str(e)}"
+
+    @staticmethod
+    def _estimate_usage(payload: Dict[str, Any], reply: str) -> Dict[str, int]:
+        """上游未返回 usage 时按文本估算token数"""
+        return {
+            "prompt_tokens": sum(estimate_tokens(message["content"]) for message in payload["messages"]),
+            "completion_tokens": estimate_tokens(reply) if reply else 0
+        }
+
+    @staticmethod
+    def _split_stream_buffer(buffer: str, elapsed: float) -> Tuple[str, str]:
+        """
+        决定流式缓冲区中可以发出的部分
+        :param buffer: 尚未发出的文本
+        :param elapsed: 距上次发出的时间(秒)
+        :return: (本次发出的文本, 剩余文本)
+        """
+        if len(buffer) < Config.STREAM_FLUSH_CHARS and elapsed < Config.STREAM_FLUSH_INTERVAL:
+            return "", buffer
+
+        cut = 0
+        for match in SENTENCE_BOUNDARY.finditer(buffer):
+            cut = match.end()
+        # 超过上限仍没有句子边界时整段发出
+        if cut == 0 and len(buffer) >= Config.STREAM_MAX_CHARS:
+            cut = len(buffer)
+        return buffer[:cut], buffer[cut:]
+
+    async def get_chat_response_stream(self, user_id: int, message: str,
+                                       on_segment: Callable[[str], Awaitable[Any]],
+                                       priority: int = PRIORITY_GROUP,
+                                       on_queued: Optional[Callable[[], Awaitable[Any]]] = None,
+                                       group_id: Optional[int] = None,
+                                       context: Optional[str] = None) -> Tuple[int, str]:
+        """
+        流式获取AI响应，生成过程中按句子/段落分段交给 on_segment 发送
+        :param user_id: 用户ID
+        :param message: 用户消息
+        :param on_segment: 分段回调，接收一段完整句子/段落（未去除首尾空白）
+        :param priority: 调度优先级（llm_scheduler.PRIORITY_*）
+        :param on_queued: 排队较久时调用的提示回调
+        :param group_id: 群号（私聊为None），用于用量统计
+        :param context: 群聊最近消息等附加上下文，只用于本次请求
+        :return: (状态码, 完整回复或错误信息)；状态码为200时回复已全部交付
+        """
+        quota_error = self._check_quota(user_id, priority)
+        if quota_error is not None:
+            return quota_error
+
+        self.clean_expired_sessions()
+        # 带附加上下文的请求不使用回复缓存
+        cache_key = None if context else self._cache_key(user_id, message)
+        question = self.add_message(user_id, message, "user")
+        session = self.sessions[user_id]
+
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                self.add_reply(user_id, question, cached)
+                await on_segment(cached)
+                return 200, cached
+
+        reply = ""
+        buffer = ""
+        usage = None
+        delivered = False
+        last_flush = time.monotonic()
+
+        async def flush(text: str):
+            nonlocal delivered, last_flush
+            last_flush = time.monotonic()
+            if text.strip():
+                # 保留首尾空白（句间空格、段落换行），发送队列合并同一回复的分段时据此无缝拼接
+                await on_segment(text)
+                delivered = True
+
+        try:
+            await self.dispatcher.acquire(priority, on_queued)
+        except QueueTimeoutError:
+            logging.warning(f"用户 {user_id} 的流式请求排队超时")
+            self.discard_message(user_id, question)
+            return 503, "当前请求较多，排队超时，请稍后再试"
+
+        # 流式请求只使用路由首选的后端；失败且尚未发出内容时由普通请求负责切换
+        # 拿到调度额度后才选择后端：熔断后端的试探机会不能在排队期间被占用
+        backend = self.router.acquire_backend()
+        payload = self._build_payload(session, context)
+        payload["model"] = backend.model
+        payload["stream"] = True
+        # 在最后一个数据块中返回 usage
+        payload["stream_options"] = {"include_usage": True}
+        headers = self._build_headers(backend.api_key)
+        headers['Accept'] = 'text/event-stream'
+
+        try:
+            start = time.monotonic()
+            # 上游已开始返回内容（从此时起计费）
+            streaming = False
+            # 流式请求不设整体超时，读取超时限制两个数据块之间的等待
+            try:
+                async with self._get_client().stream("POST", backend.endpoint, headers=headers, json=payload) as response:
+                    response.raise_for_status()
+                    streaming = True
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+
+                        chunk = json.loads(data)
+                        usage = chunk.get("usage") or usage
+                        choices = chunk.get("choices") or []
+                        if not choices:
+                            continue
+                        delta = choices[0].get("delta", {}).get("content") or ""
+                        reply += delta
+                        buffer += delta
+
+                        text, buffer = self._split_stream_buffer(buffer, time.monotonic() - last_flush)
+                        if text:
+                            await flush(text)
+            except asyncio.CancelledError:
+                self.router.release(backend)
+                raise
+            except Exception as e:
+                self._report_error(e)
+                if self._should_failover(e):
+                    self.router.record_failure(backend)
+                else:
+                    self.router.release(backend)
+                raise
+            finally:
+                self.dispatcher.release()
+                if streaming:
+                    # 中途断开的流同样已被计费：没有收到 usage 时按已生成的内容估算，保证计入每日额度
+                    self.usage.record(user_id, group_id, self._preset_name(user_id),
+                                      usage or self._estimate_usage(payload, reply), time.monotonic() - start)
+            latency = time.monotonic() - start
+            self.router.record_success(backend, latency)
+            if self.concurrency is not None:
+                # 流式耗时取决于回复长度，不参与延迟突增判断
+                self.concurrency.on_success()
+
+            await flush(buffer)
+            if not reply:
+                self.discard_message(user_id, question)
+                return response.status_code, "响应缺少有效的 'choices' 字段"
+            self.add_reply(user_id, question, reply)
+            if cache_key is not None:
+                self.response_cache.put(cache_key, reply)
+            self._schedule_compaction(user_id)
+            return response.status_code, reply
+
+        except Exception as e:
+            logging.error(f"Chat流式请求错误: {str(e)}")
+            self.discard_message(user_id, question)
+            if not delivered:
+                # 尚未发出任何内容，回退到普通请求
+                code, answer = await self.get_chat_response(user_id, message, priority,
+                                                            group_id=group_id, context=context)
+                if code == 200:
+                    await on_segment(answer)
+                return code, answer
+            # 已发出部分内容：补发缓冲区剩余内容，并按错误返回
+            try:
+                await flush(buffer)
+            except Exception as flush_error:
+                logging.error(f"补发流式剩余内容失败: {str(flush_error)}")
+            return 500, f"流式响应中断: {str(e)}"
     
+    def _schedule_compaction(self, user_id: int):
+        """回复完成后，若会话的对话部分超过阈值，在后台把较早的轮次压缩为摘要"""
+        if not Config.HISTORY_SUMMARY_ENABLED or user_id in self._compacting:
+            return
+        session = self.sessions.peek(user_id)
+        if session is None or session.turn_tokens < Config.HISTORY_SUMMARY_TRIGGER_TOKENS:
+            return
+        self._compacting.add(user_id)
+        task = asyncio.get_running_loop().create_task(self._compact_history(user_id, session))
+        self._compaction_tasks.add(task)
+        task.add_done_callback(self._compaction_tasks.discard)
+
+    @staticmethod
+    def _build_summary_payload(summary: str, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """构造生成摘要的请求体：已有摘要 + 待压缩的对话"""
+        transcript = "\n".join(
+            f"{'用户' if message['role'] == 'user' else '助手'}：{message['content']}" for message in messages
+        )
+        content = (f"已有摘要：\n{summary}\n\n" if summary else "") + f"新增对话：\n{transcript}"
+        return {
+            "messages": [
+                {"role": "system", "content": Config.HISTORY_SUMMARY_PROMPT},
+                {"role": "user", "content": content}
+            ],
+            "model": Config.LLM_BACKENDS[0]["model"],
+            "max_tokens": Config.HISTORY_SUMMARY_MAX_TOKENS,
+            "temperature": 0.3
+        }
+
+    async def _compact_history(self, user_id: int, session: ConversationSession):
+        """后台任务：以最低优先级调用摘要模型，成功后用摘要替换较早的消息"""
+        try:
+            compacted = session.compactable(Config.HISTORY_SUMMARY_KEEP_MESSAGES)
+            if not compacted:
+                return
+            payload = self._build_summary_payload(session.summary, compacted)
+            async with self.dispatcher.slot(PRIORITY_BACKGROUND):
+                start = time.monotonic()
+                if self._summary_backend is not None:
+                    _, response_json = await self._post_completion(self._summary_backend, payload)
+                else:
+                    _, response_json = await self._request_completion(payload)
+                # 摘要是用户没有主动发起的后台工作，不占用该用户的每日额度
+                self.usage.record(SYSTEM_USER, None, "history_summary",
+                                  response_json.get("usage"), time.monotonic() - start)
+
+            summary = response_json["choices"][0]["message"]["content"].strip()
+            if not summary:
+                return
+            # 会话在生成期间可能已结束/过期，或较早的消息已被淘汰
+            if self.sessions.peek(user_id) is session and session.apply_summary(summary, compacted):
+                self.store.save(user_id, session.history())
+                logging.info(f"用户 {user_id} 的 {len(compacted)} 条历史消息已压缩为摘要")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"压缩用户 {user_id} 的对话历史失败: {str(e)}")
+        finally:
+            self._compacting.discard(user_id)
+
     def clean_expired_sessions(self):
-        """清理过期的会话"""
-        current_time = time.time()
-        expired_users = [
-            user_id for user_id, timestamp in self.session_timestamps.items()
-            if current_time - timestamp > self.session_timeout
-        ]
-        
-        for user_id in expired_users:
-            self.end_chat(user_id)
+        """清理过期的会话（只处理已到期的条目）"""
+        for user_id, _ in self.sessions.expire():
+            logging.info(f"用户 {user_id} 的会话已过期")
             
-    def get_random_video(self) -> Dict[str, Any]:
-        """获取随机视频"""
-        filename = "up_videos.xlsx"
+    def get_random_video(self, key: Optional[Any] = None) -> Optional[str]:
+        """
+        获取随机视频
+        :param key: 不重复推荐的范围（群号/用户ID），为None时完全随机
+        """
         try:
-            df = pd.read_excel(filename)
-            non_empty_cells = [(i, j) for i in range(df.shape[0]) for j in range(df.shape[1]) if pd.notnull(df.iat[i, j])]
-            if not non_empty_cells:
-                logging.warning("文件中没有非空单元格。")
-                return None
-            random_cell = random.choice(non_empty_cells)
-            row, col = random_cell
-            cell_value = df.iat[row, col]
-            return cell_value
+            video = self.video_catalog.pick(key)
+            if video is None:
+                logging.warning("视频目录为空。")
+            return video
         except Exception as e:
             logging.error(f"获取随机视频失败: {str(e)}")
             return None
     
-    async def get_balance(self) -> str:
-        """获取API账户余额"""
+    def get_video_info(self, bvid: str) -> Optional[Dict[str, str]]:
+        """从离线信息库读取视频标题/封面/链接，不访问网络"""
+        return self.video_metadata.get(bvid)
+
+    async def fetch_video_info(self, bvid: str) -> Optional[Dict[str, str]]:
+        """在线获取视频信息（信息库中缺少该视频且开启 VIDEO_LIVE_FALLBACK 时使用，复用共享客户端连接）"""
+        return await fetch_video_info(self._get_client(), bvid)
+
+    async def _fetch_balance(self) -> float:
+        """查询API账户余额（复用LLM客户端连接），失败时抛出异常"""
         headers = {
             'Accept': 'application/json',
             'Authorization': f'Bearer {Config.API_KEY}'
         }
-        
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(Config.API_ENDPOINT, headers=headers)
-                response.raise_for_status()
-                data = response.json()
-
-                if not data.get("is_available"):
-                    return "API服务不可用"
-
-                balance_info = data.get("balance_infos", [])
-                if not balance_info:
-                    return "无可用余额信息"
-                    
-                balance = balance_info[0].get("total_balance")
-                if balance is None:
-                    return "余额信息无效"
-                    
-                return f"{balance:.2f}"
+        response = await self._get_client().get(Config.API_ENDPOINT, headers=headers)
+        response.raise_for_status()
+        data = response.json()
 
-        except Exception as e:
-            logging.error(f"获取余额错误: {str(e)}")
-            return f"查询失败: {str(e)}"
+        if not data.get("is_available"):
+            raise ValueError("API服务不可用")
+
+        balance_info = data.get("balance_infos", [])
+        if not balance_info:
+            raise ValueError("无可用余额信息")
+            
+        balance = balance_info[0].get("total_balance")
+        if balance is None:
+            raise ValueError("余额信息无效")
+        return float(balance)
+
+    async def get_balance(self) -> str:
+        """获取API账户余额（读取后台监控缓存的结果，尚未查询过时立即查询一次）"""
+        if self.balance_monitor.updated_at is None and self.balance_monitor.error is None:
+            await self.balance_monitor.refresh()
+        return self.balance_monitor.describe()
             
     def end_chat(self, user_id: int):
         """结束并清除用户会话"""
-        if user_id in self.sessions:
-            del self.sessions[user_id]
-        if user_id in self.session_timestamps:
-            del self.session_timestamps[user_id]
+        self.sessions.pop(user_id, None)
+        self.store.delete(user_id)
         logging.info(f"已结束用户 {user_id} 的会话")
\ No newline at end of file
@@ -6,6 +6,87 @@ class Config:
     API_KEY = "your_api_key_here"
     API_ENDPOINT = "https://api.deepseek.com/user/balance"
     CHAT_ENDPOINT = "https://api.deepseek.com/chat/completions"
+    BALANCE_POLL_INTERVAL = 600         # 后台查询余额的间隔(秒)
+    BALANCE_LOW_THRESHOLD = 5.0         # 余额低于该值时私聊提醒管理员（每次跌破只提醒一次）
+
+    # 对话历史配置
+    SESSION_TIMEOUT = 1800              # 会话无活动多久后过期(秒)
+    CHAT_HISTORY_TOKEN_BUDGET = 3000    # 单个会话发送给API的估算token上限（含预设）
+    SESSION_BACKEND = "memory"          # 会话存储后端："memory"（进程内）或 "sqlite"（重启后保留，可多进程共享）
+    SESSION_DB_PATH = "chat_sessions.db"  # SQLite会话库路径
+    SESSION_FLUSH_INTERVAL = 2.0        # 会话批量写入间隔(秒)
+
+    # 历史摘要配置：对话部分超过阈值后，回复发出后在后台把较早的轮次压缩为摘要
+    HISTORY_SUMMARY_ENABLED = False         # 默认关闭：开启后每次压缩会额外发起一次摘要请求
+    HISTORY_SUMMARY_TRIGGER_TOKENS = 2000   # 会话中对话消息（不含预设与摘要）的估算token数超过该值时触发
+    HISTORY_SUMMARY_KEEP_MESSAGES = 6       # 压缩时保留的最近消息数
+    HISTORY_SUMMARY_MAX_TOKENS = 400        # 摘要的最大token数
+    HISTORY_SUMMARY_BACKEND = None          # 摘要使用的廉价模型后端（格式同 LLM_BACKENDS 的条目），None表示使用对话后端
+    HISTORY_SUMMARY_PROMPT = (
+        "你负责压缩对话历史。请把已有摘要和新增对话合并成一段简洁的中文摘要，"
+        "保留用户的关键信息、偏好、约定和尚未结束的话题，省略寒暄，不超过300字。只输出摘要本身。"
+    )
+
+    # 群聊上下文配置：记录各群最近的消息，@机器人时一并提供给模型
+    GROUP_CONTEXT_ENABLED = False
+    GROUP_CONTEXT_SIZE = 20             # 每个群保留的最近消息条数
+    GROUP_CONTEXT_MAX_CHARS = 100       # 每条消息保留的最大字符数
+    GROUP_CONTEXT_MAX_AGE = 1800        # 只提供该时间(秒)内的消息
+    GROUP_CONTEXT_IDLE = 3600           # 群闲置多久后回收其记录(秒)
+    GROUP_CONTEXT_MAX_GROUPS = 500      # 同时记录的群数上限
+    GROUP_CONTEXT_PROMPT = "以下是群聊中最近的消息（格式为 [时间] 发送者QQ号: 内容，\"你\"表示你自己的回复），仅供理解上下文："
+
+    # 用量统计配置
+    USAGE_DB_PATH = "usage_stats.db"    # 用量统计库路径
+    USAGE_FLUSH_INTERVAL = 30           # 用量计数写入统计库的间隔(秒)
+    USAGE_DAILY_TOKEN_QUOTA = 0         # 每个用户每天的token上限（管理员不受限），0表示不限制
+    USAGE_PROMPT_PRICE = 2.0            # 提示token单价(元/百万token)，用于估算费用
+    USAGE_COMPLETION_PRICE = 8.0        # 补全token单价(元/百万token)
+
+    # 回复缓存配置（仅缓存无历史上下文的提问，如空@默认的"你好"）
+    RESPONSE_CACHE_ENABLED = False
+    RESPONSE_CACHE_TTL = 600                  # 缓存有效期(秒)
+    RESPONSE_CACHE_MAX_ENTRIES = 1000         # 最大缓存条数
+    RESPONSE_CACHE_MAX_BYTES = 4 * 1024 * 1024  # 缓存内容的内存上限(字节)
+    RESPONSE_CACHE_EXCLUDED_PRESETS = set()   # 不使用缓存的预设：USER_PRESETS 中的键或 "default"
+
+    # 流式回复配置：生成过程中按句子/段落分段发送
+    CHAT_STREAM = False           # 是否启用流式回复
+    STREAM_FLUSH_CHARS = 80       # 缓冲达到该长度后在句子边界处发出
+    STREAM_FLUSH_INTERVAL = 1.0   # 距上次发出超过该时间(秒)后在句子边界处发出
+    STREAM_MAX_CHARS = 300        # 缓冲超过该长度且无句子边界时整段发出
+
+    # LLM客户端配置（所有对话请求共享连接池）
+    LLM_HTTP2 = True                    # 服务端支持时使用HTTP/2（需安装 h2）
+    LLM_MAX_CONNECTIONS = 50            # 最大连接数（HTTP/2下可多路复用）
+    LLM_MAX_KEEPALIVE_CONNECTIONS = 20  # 保持的空闲长连接数
+    LLM_CONNECT_TIMEOUT = 10.0          # 建立连接/发送请求超时(秒)
+    LLM_READ_TIMEOUT = 60.0             # 读取超时(秒)，流式模式下为两个数据块之间的最长等待
+    LLM_POOL_TIMEOUT = 30.0             # 等待空闲连接的超时(秒)
+    LLM_TOTAL_TIMEOUT = 120.0           # 非流式请求的整体超时(秒)
+
+    # LLM调度配置：超出并发上限的请求按优先级（管理员 > 私聊授权用户 > 群聊）排队
+    LLM_MAX_CONCURRENT = 8              # 同时进行的补全请求上限（启用自适应时为其上界）
+    LLM_QUEUE_MAX_WAIT = 60.0           # 单个请求的最长排队时间(秒)
+    LLM_QUEUE_NOTICE_DELAY = 3.0        # 排队超过该时间(秒)后提示用户"排队中"
+
+    # 自适应并发（AIMD）：请求正常时并发上限缓慢加1，429/超时/延迟突增时减半
+    LLM_ADAPTIVE_CONCURRENCY = True
+    LLM_MIN_CONCURRENT = 1              # 并发上限的下界
+    LLM_INITIAL_CONCURRENT = 4          # 启动时的并发上限
+    LLM_AIMD_DECREASE = 0.5             # 下降时的乘数
+    LLM_LATENCY_SPIKE = 3.0             # 每token耗时超过基线的该倍数视为延迟突增
+    LLM_RETRY_AFTER_MAX = 60.0          # 按 Retry-After 暂停放行的最长时间(秒)
+
+    # LLM后端配置：多个OpenAI兼容后端按延迟/失败率路由，失败时自动切换
+    # 每项包含 name、endpoint、model、api_key，可选 probe_url（健康探测地址，默认为 endpoint 同级的 /models）
+    LLM_BACKENDS = [
+        {"name": "deepseek", "endpoint": CHAT_ENDPOINT, "model": "deepseek-chat", "api_key": API_KEY},
+    ]
+    LLM_BREAKER_FAILURES = 3            # 后端连续失败多少次后熔断
+    LLM_BREAKER_OPEN_SECONDS = 30.0     # 熔断冷却时间(秒)，之后放行一个试探请求
+    LLM_PROBE_INTERVAL = 15.0           # 熔断后端的健康探测间隔(秒)
+    LLM_ROUTER_EWMA_ALPHA = 0.3         # 延迟/失败率EWMA的平滑系数
     
     # 系统配置
     ADMIN_ID = "your_admini_qq_id_here"
@@ -14,7 +95,28 @@ class Config:
     ADMIN_SERVER = "http://localhost:3000/send_msg"
     LOCAL_SERVER = "http://localhost:3000/send_group_msg"
     BILIBILI_COOKIE = "SESSDATA=; bili_jct=;"
-    
+
+    # 与LLOneBot的通信方式："http"（HTTP上报 + HTTP POST调用）或 "ws"（反向WebSocket）
+    ONEBOT_TRANSPORT = "http"
+    WS_PATH = "/onebot/v11/ws"   # 反向WebSocket监听路径
+    WS_ACCESS_TOKEN = ""         # LLOneBot配置的access token，留空不校验
+    WS_ACTION_TIMEOUT = 15.0     # 等待API响应的超时(秒)
+    WS_HTTP_FALLBACK = True      # WebSocket未连接时是否回退到HTTP发送
+
+    # 发往LLOneBot的HTTP连接池配置
+    HTTP_MAX_CONNECTIONS = 20            # 每个上游最大连接数
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = 10  # 每个上游保持的空闲长连接数
+    HTTP_KEEPALIVE_EXPIRY = 30.0         # 空闲长连接保留时间(秒)
+    HTTP_CONNECT_TIMEOUT = 5.0           # 建立连接超时(秒)
+    HTTP_TIMEOUT = 15.0                  # 读/写/等待连接池超时(秒)
+
+    # 出站消息调度配置
+    SEND_TARGET_INTERVAL = 1.0   # 同一群/用户两次发送的最小间隔(秒)
+    SEND_GLOBAL_INTERVAL = 0.2   # 所有目标之间两次发送的最小间隔(秒)
+    SEND_MERGE_MAX_CHARS = 3000  # 相邻文本合并后的最大长度
+    SEND_WORKER_IDLE = 60        # 目标队列空闲多久后回收工作协程(秒)
+    SEND_DRAIN_TIMEOUT = 5.0     # 关闭时等待队列发完的最长时间(秒)
+
     # 特定用户预设
     USER_PRESETS = {
         ADMIN_ID: {
@@ -29,6 +131,21 @@ class Config:
         "role": "assistant"
     }
     
+    # 视频推荐配置
+    VIDEO_FILE = "up_videos.xlsx"  # 视频表格，每个非空单元格为一个BV号
+    VIDEO_NO_REPEAT = True         # 每个群/用户一轮推荐完所有视频前不重复
+    VIDEO_CATALOG_DB = "video_catalog.db"  # 离线编译的视频信息库（python video_catalog_compiler.py 生成）
+    VIDEO_LIVE_FALLBACK = False    # 设为True时，信息库中缺少的视频在线获取；默认完全不访问网络
+    VIDEO_PREFETCH_SIZE = 3        # 每个群/用户预先构建好的推荐条数，0表示关闭预取
+    VIDEO_PREFETCH_RATE = 2.0      # 后台预取速率上限(条/秒)
+    VIDEO_PREFETCH_IDLE = 3600     # 群/用户的预取池闲置多久后回收(秒)
+
+    # 随机图片配置
+    IMAGE_NO_REPEAT = 20           # 每个群/用户最近发送过的多少张不再重复，0表示不去重
+    IMAGE_RECENT_COUNT = 100       # "最近上传"的范围（最新的多少张）
+    IMAGE_RECENT_RATIO = 0.0       # 从最近上传范围内抽取的概率，0表示完全均匀
+    IMAGE_HISTORY_IDLE = 86400     # 群/用户的发送记录闲置多久后回收(秒)
+
     # 媒体资源配置
     MEDIA = {
         "schedule_image": "http://example.com/schedule.jpg",
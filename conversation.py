@@ -0,0 +1,154 @@
+import re
+from collections import deque
+from typing import Dict, List, Optional
+
+# 中日韩字符（含全角标点）按约0.6个token估算，其余字符约0.3个token
+CJK_PATTERN = re.compile(r'[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]')
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算一条消息的token数（不依赖分词器）
+    :param text: 消息文本
+    :return: 估算的token数，含每条消息的固定开销
+    """
+    if not text:
+        return MESSAGE_OVERHEAD_TOKENS
+    cjk = len(CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return int(cjk * 0.6 + other * 0.3) + 1 + MESSAGE_OVERHEAD_TOKENS
+
+SUMMARY_PREFIX = "此前对话的摘要："
+
+class ConversationSession:
+    """
+    单个用户的对话会话：固定保留预设，最近的对话轮次总token数控制在预算内
+    较早的轮次可以被压缩为一段摘要，摘要位于预设之后、最近轮次之前
+    """
+    __slots__ = ('preset', 'preset_tokens', 'turns', 'turn_tokens', 'summary', 'summary_tokens')
+
+    def __init__(self, preset: Dict[str, str]):
+        self.preset = dict(preset)
+        self.preset_tokens = estimate_tokens(self.preset.get('content', ''))
+        # 每个元素为 (消息, 估算token数)，token数在加入时计算一次并缓存
+        self.turns: deque = deque()
+        self.turn_tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.preset_tokens + self.summary_tokens + self.turn_tokens
+
+    def set_summary(self, summary: str):
+        self.summary = summary
+        self.summary_tokens = estimate_tokens(SUMMARY_PREFIX + summary) if summary else 0
+
+    def compactable(self, keep: int) -> List[Dict[str, str]]:
+        """
+        可以压缩进摘要的较早消息：保留最近至少 keep 条，且剩余部分从用户消息开始
+        :param keep: 至少保留的最近消息数
+        :return: 从最早开始的消息列表（可能为空）
+        """
+        cut = len(self.turns) - max(keep, 1)
+        while cut > 0 and self.turns[cut][0]["role"] != "user":
+            cut -= 1
+        return [message for message, _ in list(self.turns)[:max(cut, 0)]]
+
+    def apply_summary(self, summary: str, compacted: List[Dict[str, str]]) -> bool:
+        """
+        用摘要替换已压缩的较早消息
+        :param compacted: 生成摘要时使用的消息（compactable 的返回值）
+        :return: 这些消息仍位于会话开头时替换并返回True；期间被淘汰/回滚过则放弃
+        """
+        if len(compacted) > len(self.turns):
+            return False
+        if any(self.turns[i][0] is not message for i, message in enumerate(compacted)):
+            return False
+        for _ in compacted:
+            self._pop_oldest()
+        self.set_summary(summary)
+        return True
+
+    def append(self, role: str, content: str) -> Dict[str, str]:
+        """追加一条消息，返回该消息对象（可用于之后按身份定位）"""
+        message = {"content": content, "role": role}
+        tokens = estimate_tokens(content)
+        self.turns.append((message, tokens))
+        self.turn_tokens += tokens
+        return message
+
+    def _index_of(self, message: Dict[str, str]) -> Optional[int]:
+        """按对象身份查找消息的位置（从最近的开始找），不存在时返回None"""
+        for i in range(len(self.turns) - 1, -1, -1):
+            if self.turns[i][0] is message:
+                return i
+        return None
+
+    def insert_after(self, anchor: Dict[str, str], role: str, content: str) -> Dict[str, str]:
+        """
+        在指定消息之后插入一条消息（并发请求时回复紧跟在对应的提问之后）
+        :param anchor: append 返回的消息对象，已不在会话中时改为追加到末尾
+        """
+        index = self._index_of(anchor)
+        if index is None or index == len(self.turns) - 1:
+            return self.append(role, content)
+        message = {"content": content, "role": role}
+        tokens = estimate_tokens(content)
+        self.turns.insert(index + 1, (message, tokens))
+        self.turn_tokens += tokens
+        return message
+
+    def remove(self, message: Dict[str, str]) -> bool:
+        """移除指定的消息对象（请求失败时回滚用），不在会话中时返回False"""
+        index = self._index_of(message)
+        if index is None:
+            return False
+        _, tokens = self.turns[index]
+        del self.turns[index]
+        self.turn_tokens -= tokens
+        return True
+
+    def _pop_oldest(self):
+        _, tokens = self.turns.popleft()
+        self.turn_tokens -= tokens
+
+    def trim(self, budget: int) -> int:
+        """
+        从最早的消息开始淘汰，直到总token数不超过预算（至少保留最后一条消息）
+        :param budget: token预算（含预设）
+        :return: 淘汰的消息数
+        """
+        evicted = 0
+        while len(self.turns) > 1 and self.total_tokens > budget:
+            self._pop_oldest()
+            evicted += 1
+        # 历史不能以助手回复开头
+        while len(self.turns) > 1 and self.turns[0][0]["role"] != "user":
+            self._pop_oldest()
+            evicted += 1
+        return evicted
+
+    def _summary_message(self) -> List[Dict[str, str]]:
+        if not self.summary:
+            return []
+        return [{"content": SUMMARY_PREFIX + self.summary, "role": "system"}]
+
+    def history(self) -> List[Dict[str, str]]:
+        """不含预设的对话消息（用于持久化），有摘要时以一条system消息开头"""
+        return self._summary_message() + [message for message, _ in self.turns]
+
+    def restore(self, messages: List[Dict[str, str]]):
+        """从 history() 的结果恢复会话"""
+        for message in messages:
+            if message["role"] == "system" and message["content"].startswith(SUMMARY_PREFIX):
+                self.set_summary(message["content"][len(SUMMARY_PREFIX):])
+            else:
+                self.append(message["role"], message["content"])
+
+    def to_messages(self) -> List[Dict[str, str]]:
+        """生成发送给API的消息列表"""
+        return [self.preset] + self._summary_message() + [message for message, _ in self.turns]
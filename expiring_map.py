@@ -0,0 +1,101 @@
+import time
+import heapq
+import itertools
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+class ExpiringDict(MutableMapping):
+    """
+    按最后访问时间过期的字典
+    每个键在最小堆中只有一个 (过期时间, 序号, 键) 记录，访问时只更新时间戳；
+    清理时从堆顶弹出到期记录，仍活跃的按新的过期时间重新入堆，
+    因此清理代价与到期条目数成正比，而不是与总条目数成正比。
+    """
+
+    def __init__(self, ttl: float, on_expire: Optional[Callable[[Hashable, Any], None]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param ttl: 条目在最后一次访问后的存活时间(秒)
+        :param on_expire: 条目过期时的回调 (键, 值)
+        :param clock: 时钟函数
+        """
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self._clock = clock
+        # 键 -> [值, 最后访问时间, 序号]；序号用于识别删除后重新插入的键在堆中的旧记录
+        self._data: Dict[Hashable, list] = {}
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator:
+        return iter(self._data)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __getitem__(self, key):
+        """读取并刷新最后访问时间"""
+        entry = self._data[key]
+        entry[1] = self._clock()
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        now = self._clock()
+        entry = self._data.get(key)
+        if entry is not None:
+            entry[0] = value
+            entry[1] = now
+            return
+        seq = next(self._seq)
+        self._data[key] = [value, now, seq]
+        heapq.heappush(self._heap, (now + self.ttl, seq, key))
+
+    def __delitem__(self, key):
+        # 堆中的旧记录在弹出时因找不到对应序号而被丢弃
+        del self._data[key]
+
+    def peek(self, key, default=None):
+        """读取但不刷新最后访问时间"""
+        entry = self._data.get(key)
+        return default if entry is None else entry[0]
+
+    def touch(self, key) -> bool:
+        """刷新最后访问时间，键不存在时返回False"""
+        entry = self._data.get(key)
+        if entry is None:
+            return False
+        entry[1] = self._clock()
+        return True
+
+    def clear(self):
+        self._data.clear()
+        self._heap.clear()
+
+    def expire(self, now: Optional[float] = None) -> List[Tuple[Hashable, Any]]:
+        """
+        移除所有已过期的条目
+        :param now: 当前时间，默认取时钟
+        :return: 被移除的 (键, 值) 列表
+        """
+        if now is None:
+            now = self._clock()
+        expired = []
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            _, seq, key = heapq.heappop(heap)
+            entry = self._data.get(key)
+            if entry is None or entry[2] != seq:
+                continue
+            deadline = entry[1] + self.ttl
+            if deadline > now:
+                # 期间被访问过，按新的过期时间重新入堆
+                heapq.heappush(heap, (deadline, seq, key))
+                continue
+            del self._data[key]
+            expired.append((key, entry[0]))
+            if self.on_expire is not None:
+                self.on_expire(key, entry[0])
+        return expired
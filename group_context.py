@@ -0,0 +1,99 @@
+import time
+from array import array
+from typing import Any, List, Optional, Tuple
+from expiring_map import ExpiringDict
+
+# 记录机器人自己的回复时使用的发送者ID
+BOT_SENDER = 0
+
+class GroupContextBuffer:
+    """单个群最近N条消息的环形缓冲：只保存发送者、截断后的文本和时间"""
+    __slots__ = ('user_ids', 'texts', 'times', 'next', 'count')
+
+    def __init__(self, capacity: int):
+        self.user_ids = array('q', [0]) * capacity
+        self.texts: List[str] = [""] * capacity
+        self.times = array('d', [0.0]) * capacity
+        self.next = 0
+        self.count = 0
+
+    def append(self, user_id: int, text: str, timestamp: float):
+        """写入一条消息，缓冲已满时覆盖最早的一条"""
+        capacity = len(self.texts)
+        self.user_ids[self.next] = user_id
+        self.texts[self.next] = text
+        self.times[self.next] = timestamp
+        self.next = (self.next + 1) % capacity
+        if self.count < capacity:
+            self.count += 1
+
+    def items(self) -> List[Tuple[int, str, float]]:
+        """按时间顺序返回 (发送者, 文本, 时间) 列表"""
+        capacity = len(self.texts)
+        start = (self.next - self.count) % capacity
+        return [
+            (self.user_ids[i], self.texts[i], self.times[i])
+            for i in ((start + offset) % capacity for offset in range(self.count))
+        ]
+
+class GroupContextStore:
+    """
+    各群的最近消息，用于在@请求的提示中补充群聊上下文
+    内存上限约为 群数上限 × 条数 × 截断长度；闲置的群自动回收
+    """
+
+    def __init__(self, capacity: int, max_chars: int, max_age: float, idle_ttl: float, max_groups: int):
+        """
+        :param capacity: 每个群保留的消息条数
+        :param max_chars: 每条消息保留的最大字符数
+        :param max_age: 只有该时间(秒)内的消息会加入提示
+        :param idle_ttl: 群闲置多久后回收其缓冲(秒)
+        :param max_groups: 同时保留缓冲的群数上限，达到上限时新群不记录
+        """
+        self.capacity = capacity
+        self.max_chars = max_chars
+        self.max_age = max_age
+        self.max_groups = max_groups
+        self._groups = ExpiringDict(idle_ttl)
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def record(self, group_id: Any, user_id: Any, text: str):
+        """记录一条群消息（机器人自己的回复使用 BOT_SENDER）"""
+        text = " ".join(text.split())
+        if not text:
+            return
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars - 1] + "…"
+
+        key = int(group_id)
+        buffer = self._groups.get(key)
+        if buffer is None:
+            if len(self._groups) >= self.max_groups:
+                self._groups.expire()
+                if len(self._groups) >= self.max_groups:
+                    return
+            buffer = GroupContextBuffer(self.capacity)
+            self._groups[key] = buffer
+        buffer.append(int(user_id), text, time.time())
+
+    def render(self, group_id: Any) -> Optional[str]:
+        """
+        生成加入提示的群聊上下文
+        :return: 每行一条 "[时:分] 发送者: 内容"（机器人自己的回复记为"你"），没有近期消息时返回None
+        """
+        buffer = self._groups.peek(int(group_id))
+        if buffer is None:
+            return None
+        since = time.time() - self.max_age
+        lines = [
+            f"[{time.strftime('%H:%M', time.localtime(timestamp))}] "
+            f"{'你' if user_id == BOT_SENDER else user_id}: {text}"
+            for user_id, text, timestamp in buffer.items() if timestamp >= since
+        ]
+        return "\n".join(lines) or None
+
+    def expire(self) -> int:
+        """回收闲置群的缓冲，返回回收数量"""
+        return len(self._groups.expire())
@@ -0,0 +1,222 @@
+import numpy as np
+from itertools import combinations
+from typing import Dict, Iterable, List, Set, Tuple
+
+HASH_BITS = 64
+BAND_BITS = 16
+BAND_COUNT = HASH_BITS // BAND_BITS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# 每个字节的置位数，用于不支持 np.bitwise_count 的旧版NumPy
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """uint64数组逐元素的置位数"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+class HashArray:
+    """
+    64位哈希的连续内存镜像（NumPy uint64数组），容量不足时翻倍扩容
+    删除时用最后一个元素填补空位，保持数组紧凑，可对全部哈希做一次向量化的异或+置位计数
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._values = np.empty(capacity, dtype=np.uint64)
+        self._size = 0
+        # ID -> 在数组中的位置
+        self._positions: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._positions
+
+    @property
+    def capacity(self) -> int:
+        return len(self._values)
+
+    def _grow(self, minimum: int):
+        capacity = max(self.capacity * 2, minimum, 16)
+        ids = np.empty(capacity, dtype=np.int64)
+        values = np.empty(capacity, dtype=np.uint64)
+        ids[:self._size] = self._ids[:self._size]
+        values[:self._size] = self._values[:self._size]
+        self._ids, self._values = ids, values
+
+    def add(self, item_id: int, value: int):
+        """加入或更新一个哈希"""
+        position = self._positions.get(item_id)
+        if position is not None:
+            self._values[position] = value
+            return
+        if self._size == self.capacity:
+            self._grow(self._size + 1)
+        self._ids[self._size] = item_id
+        self._values[self._size] = value
+        self._positions[item_id] = self._size
+        self._size += 1
+
+    def remove(self, item_id: int) -> bool:
+        position = self._positions.pop(item_id, None)
+        if position is None:
+            return False
+        last = self._size - 1
+        if position != last:
+            moved = int(self._ids[last])
+            self._ids[position] = moved
+            self._values[position] = self._values[last]
+            self._positions[moved] = position
+        self._size = last
+        return True
+
+    def get(self, item_id: int) -> int:
+        return int(self._values[self._positions[item_id]])
+
+    def items(self) -> Iterable[Tuple[int, int]]:
+        return zip(self._ids[:self._size].tolist(), self._values[:self._size].tolist())
+
+    def distances(self, value: int) -> np.ndarray:
+        """与所有哈希的汉明距离（与数组中的顺序一致）"""
+        return popcount64(self._values[:self._size] ^ np.uint64(value))
+
+    def within(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """全量向量化扫描：汉明距离不超过 max_distance 的 (ID, 距离)，按距离升序"""
+        distances = self.distances(value)
+        positions = np.flatnonzero(distances <= max_distance)
+        matches = zip(self._ids[positions].tolist(), distances[positions].tolist())
+        return sorted(matches, key=lambda item: (item[1], item[0]))
+
+    def any_within(self, value: int, max_distance: int) -> bool:
+        return bool(self._size) and bool((self.distances(value) <= max_distance).any())
+
+    def nearest(self, value: int, k: int) -> List[Tuple[int, int]]:
+        """全量向量化扫描：最近的 k 个 (ID, 距离)，按距离升序"""
+        if k <= 0 or not self._size:
+            return []
+        distances = self.distances(value)
+        if k < self._size:
+            positions = np.argpartition(distances, k - 1)[:k]
+        else:
+            positions = np.arange(self._size)
+        matches = zip(self._ids[positions].tolist(), distances[positions].tolist())
+        return sorted(matches, key=lambda item: (item[1], item[0]))
+
+def _band_flips(radius: int) -> List[int]:
+    """16位内汉明距离不超过 radius 的所有异或掩码"""
+    masks = []
+    for r in range(radius + 1):
+        for bits in combinations(range(BAND_BITS), r):
+            mask = 0
+            for bit in bits:
+                mask |= 1 << bit
+            masks.append(mask)
+    return masks
+
+class HammingIndex:
+    """
+    64位感知哈希的多索引哈希（Multi-Index Hashing）
+    哈希被切成4段16位，每段各建一张 段值 -> ID集合 的表。由抽屉原理，汉明距离不超过d的两个哈希
+    至少有一段的距离不超过 d // 4，因此只需在各段表中探测该半径内的段值，再对候选做完整校验。
+    完整哈希保存在 HashArray 中，探测半径过大时改为对其做向量化全量扫描。
+    """
+
+    # 段内探测半径超过该值时探测量（C(16, r)）过大，改为全量扫描
+    MAX_PROBE_RADIUS = 2
+
+    def __init__(self):
+        self._hashes = HashArray()
+        self._bands: List[Dict[int, Set[int]]] = [{} for _ in range(BAND_COUNT)]
+        self._flips = {r: _band_flips(r) for r in range(self.MAX_PROBE_RADIUS + 1)}
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._hashes
+
+    @staticmethod
+    def _split(value: int) -> List[int]:
+        return [(value >> (band * BAND_BITS)) & BAND_MASK for band in range(BAND_COUNT)]
+
+    def add(self, item_id: int, value: int):
+        """加入（或替换）一个哈希"""
+        if item_id in self._hashes:
+            self.remove(item_id)
+        self._hashes.add(item_id, value)
+        for table, key in zip(self._bands, self._split(value)):
+            table.setdefault(key, set()).add(item_id)
+
+    def build(self, items: Iterable[Tuple[int, int]]):
+        """批量加入 (ID, 哈希)"""
+        for item_id, value in items:
+            self.add(item_id, value)
+
+    def remove(self, item_id: int) -> bool:
+        """移除一个哈希，不存在时返回False"""
+        if item_id not in self._hashes:
+            return False
+        value = self._hashes.get(item_id)
+        self._hashes.remove(item_id)
+        for table, key in zip(self._bands, self._split(value)):
+            ids = table.get(key)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del table[key]
+        return True
+
+    def _candidates(self, value: int, radius: int):
+        """各段在 radius 内的候选ID（可能重复）"""
+        flips = self._flips[radius]
+        for table, key in zip(self._bands, self._split(value)):
+            for mask in flips:
+                ids = table.get(key ^ mask)
+                if ids:
+                    yield from ids
+
+    def within(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """
+        查找汉明距离不超过 max_distance 的所有哈希
+        :return: (ID, 距离) 列表，按距离升序
+        """
+        radius = max_distance // BAND_COUNT
+        if radius > self.MAX_PROBE_RADIUS:
+            return self._hashes.within(value, max_distance)
+        results = {}
+        for item_id in self._candidates(value, radius):
+            if item_id in results:
+                continue
+            distance = (value ^ self._hashes.get(item_id)).bit_count()
+            if distance <= max_distance:
+                results[item_id] = distance
+        return sorted(results.items(), key=lambda item: (item[1], item[0]))
+
+    def any_within(self, value: int, max_distance: int) -> bool:
+        """是否存在汉明距离不超过 max_distance 的哈希（找到一个即返回）"""
+        radius = max_distance // BAND_COUNT
+        if radius > self.MAX_PROBE_RADIUS:
+            return self._hashes.any_within(value, max_distance)
+        hashes = self._hashes
+        return any(
+            (value ^ hashes.get(item_id)).bit_count() <= max_distance
+            for item_id in self._candidates(value, radius)
+        )
+
+    def nearest(self, value: int, k: int) -> List[Tuple[int, int]]:
+        """
+        查找最近的 k 个哈希
+        :return: (ID, 距离) 列表，按距离升序
+        """
+        if k <= 0 or not len(self._hashes):
+            return []
+        # 逐步扩大探测半径；半径 r 能保证找全距离 < 4(r+1) 的所有哈希
+        for radius in range(self.MAX_PROBE_RADIUS + 1):
+            exact_limit = BAND_COUNT * (radius + 1) - 1
+            found = self.within(value, exact_limit)
+            if len(found) >= k:
+                return found[:k]
+        return self._hashes.nearest(value, k)
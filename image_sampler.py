@@ -0,0 +1,128 @@
+import random
+from array import array
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Any, Dict, Hashable, Iterable, Optional
+from expiring_map import ExpiringDict
+
+class ImageSampler:
+    """
+    图片ID的O(1)随机抽样（替代 ORDER BY RANDOM() 的全表排序）
+    所有ID按上传顺序（即ID升序）缓存在紧凑数组中；删除只做标记，抽中已删除的ID时重抽，标记超过一半时压缩数组。
+    可选：按群/用户记住最近发送过的若干张，抽中时重抽；按比例偏向最近上传的若干张。
+    """
+
+    # 单次抽样最多重抽的次数，超过后接受最后一个有效ID（图片很少时无法完全避免重复）
+    MAX_ATTEMPTS = 16
+
+    def __init__(self, no_repeat: int = 0, recent_count: int = 0, recent_ratio: float = 0.0,
+                 idle_ttl: float = 86400):
+        """
+        :param no_repeat: 每个群/用户最近发送过的多少张不再抽中，0表示不去重
+        :param recent_count: "最近上传"的范围（最新的多少张）
+        :param recent_ratio: 从最近上传范围内抽取的概率(0.0-1.0)，0表示完全均匀
+        :param idle_ttl: 群/用户的发送记录闲置多久后回收(秒)
+        """
+        self.no_repeat = no_repeat
+        self.recent_count = recent_count
+        self.recent_ratio = recent_ratio
+        self._ids = array('q')
+        self._deleted = set()
+        # 键 -> (最近发送的ID队列, 与队列内容相同的集合)
+        self._history = ExpiringDict(idle_ttl)
+        self.samples = 0
+        self.retries = 0
+
+    def __len__(self) -> int:
+        return len(self._ids) - len(self._deleted)
+
+    def _contains(self, image_id: int) -> bool:
+        position = bisect_left(self._ids, image_id)
+        return position < len(self._ids) and self._ids[position] == image_id
+
+    def add(self, image_id: int):
+        """加入一个ID（通常比已有ID都大，直接追加）"""
+        if not self._ids or image_id > self._ids[-1]:
+            self._ids.append(image_id)
+        elif image_id in self._deleted:
+            self._deleted.discard(image_id)
+        elif not self._contains(image_id):
+            insort(self._ids, image_id)
+
+    def extend(self, image_ids: Iterable[int]):
+        for image_id in image_ids:
+            self.add(image_id)
+
+    def discard(self, image_id: int):
+        """标记一个ID已删除"""
+        if image_id in self._deleted or not self._contains(image_id):
+            return
+        self._deleted.add(image_id)
+        if len(self._deleted) * 2 > len(self._ids):
+            self._compact()
+
+    def _compact(self):
+        deleted = self._deleted
+        self._ids = array('q', (image_id for image_id in self._ids if image_id not in deleted))
+        self._deleted = set()
+
+    def _position(self) -> int:
+        """抽一个数组下标：按 recent_ratio 的概率落在最新的 recent_count 张中，否则均匀"""
+        count = len(self._ids)
+        if self.recent_count > 0 and self.recent_ratio > 0 and random.random() < self.recent_ratio:
+            return random.randrange(max(0, count - self.recent_count), count)
+        return random.randrange(count)
+
+    def sample(self, key: Optional[Hashable] = None) -> Optional[int]:
+        """
+        随机抽取一个图片ID
+        :param key: 去重范围（如群号/用户），为None或未开启去重时不记录
+        :return: 图片ID，没有图片时返回None
+        """
+        if not len(self):
+            return None
+        history = None
+        if key is not None and self.no_repeat > 0:
+            history = self._history.get(key)
+            if history is None:
+                history = self._history[key] = (deque(), set())
+
+        self.samples += 1
+        image_id = None
+        for attempt in range(self.MAX_ATTEMPTS):
+            if attempt:
+                self.retries += 1
+            candidate = self._ids[self._position()]
+            if candidate in self._deleted:
+                continue
+            image_id = candidate
+            if history is None or candidate not in history[1]:
+                break
+        if image_id is None:
+            # 连续抽中已删除的ID（概率极低），压缩后必然命中有效ID
+            self._compact()
+            image_id = self._ids[self._position()]
+
+        if history is not None:
+            recent, seen = history
+            if image_id not in seen:
+                recent.append(image_id)
+                seen.add(image_id)
+            # 图片数不多于去重窗口时，窗口缩小到 图片数-1，保证相邻两次不重复即可
+            window = min(self.no_repeat, len(self) - 1)
+            while len(recent) > window:
+                seen.discard(recent.popleft())
+        return image_id
+
+    def expire(self) -> int:
+        """回收闲置群/用户的发送记录，返回回收数量"""
+        return len(self._history.expire())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "images": len(self),
+            "deleted": len(self._deleted),
+            "scopes": len(self._history),
+            "samples": self.samples,
+            "retries": self.retries
+        }
@@ -0,0 +1,204 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# 熔断器状态
+STATE_CLOSED = "closed"        # 正常
+STATE_OPEN = "open"            # 熔断中，不参与路由，等待健康探测恢复
+STATE_HALF_OPEN = "half_open"  # 熔断冷却结束，已放行一个试探请求，等待其结果
+
+class LLMBackend:
+    """一个OpenAI兼容的补全后端及其运行指标"""
+
+    def __init__(self, name: str, endpoint: str, model: str, api_key: str, probe_url: Optional[str] = None):
+        """
+        :param name: 后端名称（用于日志与状态展示）
+        :param endpoint: 对话补全地址
+        :param model: 模型名
+        :param api_key: API密钥
+        :param probe_url: 健康探测地址，默认为同一服务的 /models
+        """
+        self.name = name
+        self.endpoint = endpoint
+        self.model = model
+        self.api_key = api_key
+        if probe_url is None:
+            base = endpoint.rsplit("/chat/completions", 1)[0]
+            probe_url = f"{base}/models"
+        self.probe_url = probe_url
+        self.latency: Optional[float] = None   # 成功请求耗时的EWMA(秒)
+        self.error_rate = 0.0                   # 请求失败率的EWMA
+        self.consecutive_failures = 0
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        self.successes = 0
+        self.failures = 0
+
+class LLMRouter:
+    """
+    多后端路由：按延迟EWMA与失败率选择后端，失败时依次切换到下一个
+    连续失败达到阈值的后端熔断，由后台健康探测恢复；冷却结束后也会放行一个试探请求
+    """
+
+    def __init__(self, backends: List[LLMBackend], failure_threshold: int = 3,
+                 open_seconds: float = 30.0, alpha: float = 0.3):
+        """
+        :param backends: 后端列表，顺序即指标相同时的优先顺序
+        :param failure_threshold: 连续失败多少次后熔断
+        :param open_seconds: 熔断冷却时间(秒)，之后进入半开状态
+        :param alpha: EWMA平滑系数，越大越看重最近的请求
+        """
+        if not backends:
+            raise ValueError("至少需要配置一个LLM后端")
+        self.backends = backends
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.alpha = alpha
+        self.failovers = 0
+
+    @staticmethod
+    def score(backend: LLMBackend) -> float:
+        """路由评分，越小越优先；尚无延迟数据的后端视为0以便尽快获得样本"""
+        latency = backend.latency or 0.0
+        return latency / max(0.05, 1.0 - backend.error_rate)
+
+    def _available(self, backend: LLMBackend, now: float) -> bool:
+        """后端可以接收请求：正常，或熔断冷却已结束（可以试探）"""
+        if backend.state == STATE_OPEN:
+            return now - backend.opened_at >= self.open_seconds
+        return backend.state == STATE_CLOSED
+
+    def candidates(self) -> List[LLMBackend]:
+        """
+        按评分排序的可用后端（只读，不改变熔断状态）
+        全部熔断时仍返回全部后端，尽力一试
+        """
+        now = time.monotonic()
+        available = [backend for backend in self.backends if self._available(backend, now)]
+        return sorted(available or self.backends, key=self.score)
+
+    def try_acquire(self, backend: LLMBackend) -> bool:
+        """
+        即将向后端真正发出请求时调用
+        冷却结束的熔断后端在此转为半开，只有抢到这次试探机会的请求返回True；
+        试探结果出来前（半开状态）其他请求返回False
+        """
+        if backend.state == STATE_CLOSED:
+            return True
+        if backend.state == STATE_OPEN and time.monotonic() - backend.opened_at >= self.open_seconds:
+            backend.state = STATE_HALF_OPEN
+            return True
+        return False
+
+    def release(self, backend: LLMBackend):
+        """请求没有得出后端是否健康的结论（被取消、客户端错误）时，交还试探机会"""
+        if backend.state == STATE_HALF_OPEN:
+            # opened_at 不变，冷却仍视为已结束，下一个请求可以继续试探
+            backend.state = STATE_OPEN
+
+    def acquire_backend(self) -> LLMBackend:
+        """选择并占用一个后端（用于不做切换的单次请求，如流式请求）"""
+        candidates = self.candidates()
+        for backend in candidates:
+            if self.try_acquire(backend):
+                return backend
+        return candidates[0]
+
+    def record_success(self, backend: LLMBackend, latency: float):
+        backend.successes += 1
+        backend.latency = latency if backend.latency is None else (
+            self.alpha * latency + (1 - self.alpha) * backend.latency
+        )
+        backend.error_rate *= 1 - self.alpha
+        backend.consecutive_failures = 0
+        if backend.state != STATE_CLOSED:
+            logging.info(f"LLM后端 {backend.name} 已恢复")
+        backend.state = STATE_CLOSED
+
+    def record_failure(self, backend: LLMBackend):
+        backend.failures += 1
+        backend.error_rate = self.alpha + (1 - self.alpha) * backend.error_rate
+        backend.consecutive_failures += 1
+        # 半开状态下的试探失败立即重新熔断
+        if backend.state == STATE_HALF_OPEN or (
+            backend.state == STATE_CLOSED and backend.consecutive_failures >= self.failure_threshold
+        ):
+            backend.state = STATE_OPEN
+            backend.opened_at = time.monotonic()
+            logging.warning(f"LLM后端 {backend.name} 连续失败 {backend.consecutive_failures} 次，已熔断")
+
+    async def call(self, request: Callable[[LLMBackend], Awaitable[Any]],
+                   should_failover: Callable[[Exception], bool]) -> Any:
+        """
+        按路由顺序调用后端，失败时切换到下一个
+        :param request: 对指定后端发起请求的协程函数
+        :param should_failover: 判断异常是否由后端引起（是则记入失败并切换，否则直接抛出）
+        :raises: 所有后端都失败时抛出最后一个异常
+        """
+        last_error: Optional[Exception] = None
+        candidates = self.candidates()
+        now = time.monotonic()
+        # 全部后端都熔断时不再检查试探机会，尽力一试
+        all_down = not any(self._available(backend, now) for backend in candidates)
+        attempted = 0
+        for backend in candidates:
+            if not self.try_acquire(backend) and not all_down:
+                # 其他请求正在试探该后端
+                continue
+            if attempted:
+                self.failovers += 1
+                logging.warning(f"切换到LLM后端 {backend.name}: {str(last_error)}")
+            attempted += 1
+            start = time.monotonic()
+            try:
+                result = await request(backend)
+            except asyncio.CancelledError:
+                self.release(backend)
+                raise
+            except Exception as e:
+                if not should_failover(e):
+                    self.release(backend)
+                    raise
+                self.record_failure(backend)
+                last_error = e
+                continue
+            self.record_success(backend, time.monotonic() - start)
+            return result
+        if last_error is None:
+            last_error = ConnectionError("没有可用的LLM后端")
+        raise last_error
+
+    async def run_health_probes(self, probe: Callable[[LLMBackend], Awaitable[bool]], interval: float):
+        """
+        后台任务：定期探测已熔断的后端，探测成功即恢复
+        :param probe: 探测协程函数，后端可用时返回True
+        """
+        while True:
+            await asyncio.sleep(interval)
+            for backend in self.backends:
+                if backend.state == STATE_CLOSED:
+                    continue
+                try:
+                    healthy = await probe(backend)
+                except Exception as e:
+                    logging.error(f"探测LLM后端 {backend.name} 出错: {str(e)}")
+                    healthy = False
+                if healthy:
+                    backend.consecutive_failures = 0
+                    backend.state = STATE_CLOSED
+                    logging.info(f"LLM后端 {backend.name} 健康探测通过，已恢复")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "name": backend.name,
+                "model": backend.model,
+                "state": backend.state,
+                "latency": backend.latency,
+                "error_rate": backend.error_rate,
+                "successes": backend.successes,
+                "failures": backend.failures
+            }
+            for backend in self.backends
+        ]
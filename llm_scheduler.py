@@ -0,0 +1,305 @@
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from bisect import bisect_left
+from email.utils import parsedate_to_datetime
+from contextlib import asynccontextmanager
+from typing import Optional, Callable, Awaitable, Dict, Any, List
+
+# 优先级：数值越小越先调度
+PRIORITY_ADMIN = 0     # 管理员/豁免用户
+PRIORITY_PRIVATE = 1   # 已授权用户私聊
+PRIORITY_GROUP = 2     # 群聊@
+PRIORITY_BACKGROUND = 3  # 后台任务（如历史摘要），不与用户请求争抢
+
+class QueueTimeoutError(Exception):
+    """排队等待超过上限"""
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class LLMDispatcher:
+    """LLM调用调度器：限制同时进行的补全请求数，超出部分按优先级排队"""
+
+    # 等待时间直方图的桶上界(秒)，最后一个桶收集超出部分
+    WAIT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60)
+    # 排队长度直方图的桶上界（请求到达时前面的排队数）
+    QUEUE_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+
+    def __init__(self, max_concurrent: int, max_wait: float, notice_delay: float):
+        """
+        :param max_concurrent: 最大并发补全数
+        :param max_wait: 单个请求的最长排队时间(秒)
+        :param notice_delay: 排队超过该时间(秒)后触发排队提示
+        """
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.notice_delay = notice_delay
+        self.active = 0
+        # 暂停放行的截止时间（如上游要求 Retry-After），之前的请求继续排队
+        self._paused_until = 0.0
+        self._resume_handle: Optional[asyncio.TimerHandle] = None
+        # 堆元素为 (优先级, 序号, future)，被取消的future在出堆时跳过
+        self._waiters: List[tuple] = []
+        self._queued = 0
+        self._seq = itertools.count()
+        self.dispatched = 0
+        self.timeouts = 0
+        self.max_queue = 0
+        self.wait_histogram = [0] * (len(self.WAIT_BUCKETS) + 1)
+        self.queue_histogram = [0] * (len(self.QUEUE_BUCKETS) + 1)
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def _record_wait(self, waited: float):
+        self.wait_histogram[bisect_left(self.WAIT_BUCKETS, waited)] += 1
+
+    def paused_for(self) -> float:
+        """距离恢复放行还有多少秒，未暂停时为0"""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def pause(self, seconds: float):
+        """在指定时间内暂停放行新请求（已在进行的请求不受影响）"""
+        until = time.monotonic() + seconds
+        if until <= self._paused_until:
+            return
+        self._paused_until = until
+        if self._resume_handle is not None:
+            self._resume_handle.cancel()
+        self._resume_handle = asyncio.get_running_loop().call_later(seconds, self._resume)
+
+    def _resume(self):
+        remaining = self.paused_for()
+        if remaining > 0:
+            # 定时器可能略早触发
+            self._resume_handle = asyncio.get_running_loop().call_later(remaining, self._resume)
+            return
+        self._resume_handle = None
+        self._wake()
+
+    def set_limit(self, limit: int):
+        """调整并发上限，上调时立即放行排队的请求"""
+        self.max_concurrent = limit
+        self._wake()
+
+    def _wake(self):
+        """在并发额度内按优先级放行排队的请求"""
+        if self.paused_for() > 0:
+            return
+        while self.active < self.max_concurrent and self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._queued -= 1
+            self.active += 1
+            future.set_result(None)
+
+    async def acquire(self, priority: int, on_queued: Optional[Callable[[], Awaitable[Any]]] = None):
+        """
+        获取一个并发额度，必要时排队
+        :param priority: 优先级（PRIORITY_*）
+        :param on_queued: 排队超过 notice_delay 时调用一次的提示回调
+        :raises QueueTimeoutError: 排队超过 max_wait
+        """
+        self.queue_histogram[bisect_left(self.QUEUE_BUCKETS, self._queued)] += 1
+        if self.active < self.max_concurrent and not self._queued and not self.paused_for():
+            self.active += 1
+            self.dispatched += 1
+            self._record_wait(0.0)
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._queued += 1
+        if self._queued > self.max_queue:
+            self.max_queue = self._queued
+        start = time.monotonic()
+
+        notice_task = None
+        if on_queued is not None:
+            async def notify():
+                await asyncio.sleep(self.notice_delay)
+                if not future.done():
+                    try:
+                        await on_queued()
+                    except Exception as e:
+                        logging.error(f"发送排队提示失败: {str(e)}")
+            notice_task = loop.create_task(notify())
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 超时/取消与放行同时发生：额度已分配
+                if not isinstance(e, asyncio.TimeoutError):
+                    self.release()
+                    raise
+            else:
+                future.cancel()
+                self._queued -= 1
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timeouts += 1
+                    self._record_wait(time.monotonic() - start)
+                    raise QueueTimeoutError(f"排队超过 {self.max_wait} 秒") from None
+                raise
+        finally:
+            if notice_task is not None:
+                notice_task.cancel()
+
+        self.dispatched += 1
+        self._record_wait(time.monotonic() - start)
+
+    def release(self):
+        """归还并发额度"""
+        self.active -= 1
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, priority: int, on_queued: Optional[Callable[[], Awaitable[Any]]] = None):
+        """占用一个并发额度执行代码块"""
+        await self.acquire(priority, on_queued)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """调度统计信息，直方图以 "上界: 次数" 的形式给出"""
+        def label(bounds, index, unit):
+            return f"≤{bounds[index]}{unit}" if index < len(bounds) else f">{bounds[-1]}{unit}"
+
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "paused_for": self.paused_for(),
+            "queued": self._queued,
+            "max_queue": self.max_queue,
+            "dispatched": self.dispatched,
+            "timeouts": self.timeouts,
+            "wait_histogram": {
+                label(self.WAIT_BUCKETS, i, "s"): count
+                for i, count in enumerate(self.wait_histogram) if count
+            },
+            "queue_histogram": {
+                label(self.QUEUE_BUCKETS, i, ""): count
+                for i, count in enumerate(self.queue_histogram) if count
+            }
+        }
+
+class AdaptiveConcurrency:
+    """
+    按上游反馈自适应调整调度器并发上限（AIMD）
+    延迟正常的成功请求使上限缓慢加性增长（每约一整轮并发+1）；
+    429、超时或延迟突增时上限乘性下降，并按 Retry-After 暂停放行。
+    延迟按每个回复token的耗时衡量，长回复本身耗时更久不会被误判为突增。
+    """
+
+    def __init__(self, dispatcher: LLMDispatcher, min_limit: int, max_limit: int, initial_limit: int,
+                 decrease_factor: float = 0.5, latency_spike: float = 3.0, alpha: float = 0.2,
+                 max_retry_after: float = 60.0, min_sample_tokens: int = 32):
+        """
+        :param dispatcher: 被控制的调度器
+        :param min_limit: 并发上限的下限
+        :param max_limit: 并发上限的上限
+        :param initial_limit: 初始并发上限
+        :param decrease_factor: 下降时的乘数
+        :param latency_spike: 每token耗时超过基线的该倍数视为延迟突增
+        :param alpha: 基线延迟EWMA的平滑系数
+        :param max_retry_after: Retry-After 暂停时间上限(秒)
+        :param min_sample_tokens: 回复少于该token数时耗时主要是首字延迟，不参与延迟判断
+        """
+        self.dispatcher = dispatcher
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_spike = latency_spike
+        self.alpha = alpha
+        self.max_retry_after = max_retry_after
+        self.min_sample_tokens = min_sample_tokens
+        self.baseline: Optional[float] = None  # 每token耗时的EWMA(秒)
+        self._credit = 0.0
+        self._last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.last_reason = ""
+        dispatcher.set_limit(max(min_limit, min(max_limit, initial_limit)))
+
+    @property
+    def limit(self) -> int:
+        return self.dispatcher.max_concurrent
+
+    def on_success(self, latency: Optional[float] = None, tokens: Optional[int] = None):
+        """
+        上游请求成功
+        :param latency: 请求耗时(秒)
+        :param tokens: 回复的token数；与 latency 均给出且不少于 min_sample_tokens 时才参与延迟判断，
+                       否则（如流式请求、缺少用量信息、短回复）只计入增长
+        """
+        if latency is not None and tokens is not None and tokens >= self.min_sample_tokens:
+            per_token = latency / tokens
+            spike = self.baseline is not None and per_token > self.baseline * self.latency_spike
+            # 突增的样本同样计入基线：上游持续变慢时基线随之抬升，不会此后每次都判为突增
+            self.baseline = per_token if self.baseline is None else (
+                self.alpha * per_token + (1 - self.alpha) * self.baseline
+            )
+            if spike:
+                self._decrease(f"延迟突增 {per_token * 1000:.0f}ms/token")
+                return
+        # 加性增长：每累计 limit 次成功，上限+1
+        self._credit += 1 / self.limit
+        if self._credit >= 1:
+            self._credit = 0.0
+            if self.limit < self.max_limit:
+                self.increases += 1
+                self.dispatcher.set_limit(self.limit + 1)
+
+    def on_overload(self, reason: str, retry_after: Optional[float] = None):
+        """
+        上游过载（429/超时）
+        :param reason: 原因，用于日志与状态展示
+        :param retry_after: 上游要求的等待时间(秒)
+        """
+        if retry_after:
+            self.dispatcher.pause(min(retry_after, self.max_retry_after))
+        self._decrease(reason)
+
+    def _decrease(self, reason: str):
+        # 同一轮并发中的多个失败只下降一次：距上次下降不足1秒时忽略
+        now = time.monotonic()
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self._credit = 0.0
+        new_limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+        self.last_reason = reason
+        if new_limit < self.limit:
+            self.decreases += 1
+            logging.warning(f"LLM并发上限由 {self.limit} 降至 {new_limit}: {reason}")
+            self.dispatcher.set_limit(new_limit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "baseline": self.baseline,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "last_reason": self.last_reason,
+            "paused_for": self.dispatcher.paused_for()
+        }
@@ -2,17 +2,23 @@ from config import Config
 from auth_manager import AuthManager
 from message_handler import MessageHandler
 from chat_manager import ChatManager
+from llm_scheduler import PRIORITY_ADMIN, PRIORITY_PRIVATE, PRIORITY_GROUP
+from usage_tracker import SCOPE_USER, SCOPE_GROUP, SCOPE_PRESET
+from expiring_map import ExpiringDict
 from ImageDatabaseManager import ImageDatabaseManager
-from fastapi import FastAPI, Request
+from image_sampler import ImageSampler
+from onebot_ws import OneBotWebSocket
+from video_prefetch import VideoPrefetchPool
+from group_context import GroupContextStore, BOT_SENDER
+from fastapi import FastAPI, Request, WebSocket
 import uvicorn
 import logging
 import httpx
 import psutil
 import time
 import asyncio
-import threading
+from contextlib import asynccontextmanager
 from collections import defaultdict
-import httpx
 import base64
 import io
 
@@ -66,41 +72,42 @@ class TokenBucket:
             return True
         return False
 
-# 全局令牌桶限流器
-chat_limiter = TokenBucket(5, 5)  # 每秒5个请求，最多积累5个令牌
+# 全局令牌桶限流器（聊天请求的整体并发由 ChatManager 的自适应调度控制，不再设固定速率）
 video_limiter = TokenBucket(10, 3)  # 每秒3个视频请求，最多积累10个令牌
 
-# 限流器
-user_chat_limiters = {}
-user_video_limiters = {}
+# 限流器（30分钟未使用的用户限流器自动过期）
+user_chat_limiters = ExpiringDict(1800)
+user_video_limiters = ExpiringDict(1800)
 
 # 数据库授权列表
 EXEMPT_USERS = {Config.ADMIN_ID}
 
 # 消息处理工具类
 class MessageUtil:
-    """消息处理工具类，封装各种消息发送模式"""
+    """消息处理工具类，封装各种消息发送模式（消息进入出站队列后立即返回）"""
     
     def __init__(self, message_handler):
         self.message_handler = message_handler
     
-    async def send_text(self, target_id, text, is_private=False, user_id=None):
-        """发送文本消息"""
+    async def send_text(self, target_id, text, is_private=False, user_id=None, stream=None):
+        """发送文本消息（stream 为所属流式回复的标识，同一回复的相邻分段合并时直接拼接）"""
         try:
             if is_private:
-                await self.message_handler.send_private_message(target_id, text)
+                self.message_handler.enqueue_private_message(target_id, text, stream=stream)
             elif user_id:  # 群@ 消息
-                await self.message_handler.send_group_message(target_id, user_id, text)
+                self.message_handler.enqueue_group_message(target_id, user_id, text, stream=stream)
             else:  # 群普通消息
-                await self.message_handler.send_message(
+                self.message_handler.enqueue_message(
                     target_id,
-                    {'type': 'text', 'data': {'text': text}}
+                    {'type': 'text', 'data': {'text': text}},
+                    stream=stream
                 )
         except Exception as e:
             logging.error(f"发送文本消息失败: {e}")
     
-    async def send_image(self, target_id, image_url=None, image_file=None, image_base=None, is_private=False):
-        """发送图片消息"""
+    async def send_image(self, target_id, image_url=None, image_file=None, image_base=None,
+                         image_bytes=None, is_private=False):
+        """发送图片消息（image_bytes 为原始图片字节，在此处才编码为Base64）"""
         try:
             image_data = {}
             if image_url:
@@ -109,66 +116,78 @@ class MessageUtil:
                 image_data['file'] = image_file
             elif image_base:
                 image_data['file'] = "base64://" + image_base
+            elif image_bytes:
+                image_data['file'] = "base64://" + base64.b64encode(image_bytes).decode('ascii')
             message = {'type': 'image', 'data': image_data}
             
             if is_private:
-                await self.message_handler.send_private_message(target_id, message)
+                self.message_handler.enqueue_private_message(target_id, message)
             else:
-                await self.message_handler.send_message(target_id, message)
+                self.message_handler.enqueue_message(target_id, message)
         except Exception as e:
             logging.error(f"发送图片消息失败: {e}")
     
-    async def send_video_recommendation(self, target_id, video_data, is_private=False):
-        """发送视频推荐信息"""
+    @staticmethod
+    def build_video_recommendation(video_data):
+        """构建视频推荐消息段"""
+        title = video_data.get('title', '无标题')
+        cover_url = video_data.get('cover_url', '')
+        jump_url = video_data.get('jump_url', '')
+        
+        return [
+            {
+                'type': 'text',
+                'data': {
+                    'text': (
+                        f"要睡觉了吗？那就让小粥哄哥哥吧\n"
+                        f"-------------------------------------\n"
+                        f"视频标题：{title}\n"
+                    )
+                }
+            },
+            {
+                'type': 'image',
+                'data': {
+                    'url': cover_url
+                }
+            },
+            {
+                'type': 'text',
+                'data': {
+                    'text': f"视频链接：{jump_url}"
+                }
+            }
+        ]
+    
+    async def send_video_recommendation(self, target_id, video_data=None, is_private=False, videos=None):
+        """
+        发送视频推荐信息
+        :param video_data: 视频信息（标题/封面/链接）
+        :param videos: 已构建好的消息段（来自预取池），提供时忽略 video_data
+        """
         try:
-            title = video_data.get('title', '无标题')
-            cover_url = video_data.get('cover_url', '')
-            jump_url = video_data.get('jump_url', '')
-            
-            videos = [
-                    {
-                        'type': 'text',
-                        'data': {
-                            'text': (
-                                f"要睡觉了吗？那就让小粥哄哥哥吧\n"
-                                f"-------------------------------------\n"
-                                f"视频标题：{title}\n"
-                            )
-                        }
-                    },
-                    {
-                        'type': 'image',
-                        'data': {
-                            'url': cover_url
-                        }
-                    },
-                    {
-                        'type': 'text',
-                        'data': {
-                            'text': f"视频链接：{jump_url}"
-                        }
-                    }
-                ]
+            if videos is None:
+                videos = self.build_video_recommendation(video_data)
 
             if is_private:
-                await self.message_handler.send_private_message(
+                self.message_handler.enqueue_private_message(
                     target_id, 
                     videos
                 )
             else:
-                await self.message_handler.send_message(
+                self.message_handler.enqueue_message(
                     target_id,
                     videos
                 )
         except Exception as e:
             logging.error(f"发送视频推荐失败: {e}")
             if is_private:
-                await self.message_handler.send_private_message(
+                self.message_handler.enqueue_private_message(
                     target_id, 
                     f"发送视频失败: {str(e)}"
                 )
             else:
-                await self.message_handler.send_message(
+                self.message_handler.enqueue_message(
                     target_id,
                     {'type': 'text', 'data': {'text': f"发送视频失败: {str(e)}"}}
                 )
@@ -177,9 +196,9 @@ class MessageUtil:
         """发送消息"""
         try:
             if is_private:
-                await self.message_handler.send_private_message(target_id, message)
+                self.message_handler.enqueue_private_message(target_id, message)
             else:
-                await self.message_handler.send_message(target_id, message)
+                self.message_handler.enqueue_message(target_id, message)
         except Exception as e:
             logging.error(f"发送消息失败: {e}")
 
@@ -187,7 +206,7 @@ class MessageUtil:
 def rate_limit(limiter, user_limiters, user_id, exempt_users=None):
     """
     速率限制检查
-    :param limiter: 全局限流器
+    :param limiter: 全局限流器，为None时只检查用户级限流
     :param user_limiters: 用户级限流器字典
     :param user_id: 当前用户ID
     :param exempt_users: 豁免用户列表
@@ -198,7 +217,7 @@ def rate_limit(limiter, user_limiters, user_id, exempt_users=None):
         return True, ""
     
     # 全局限流检查
-    if not limiter.consume(1):
+    if limiter is not None and not limiter.consume(1):
         return False, "系统繁忙，请稍后再试"
     
     # 用户级限流器
@@ -232,9 +251,9 @@ async def extract_image_urls(message_array):
     
     return image_urls
 
-# url_to_base64 函数
-async def url_to_base64(url):
-    """将图片URL转换为Base64编码"""
+# download_image 函数
+async def download_image(url):
+    """下载图片URL，返回原始字节（入库不再做Base64编码，发送时才编码）"""
     try:
         import subprocess
         import os
@@ -250,9 +269,8 @@ async def url_to_base64(url):
             if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
                 with open(temp_path, "rb") as f:
                     image_data = f.read()
-                    base64_data = base64.b64encode(image_data).decode('utf-8')
                 os.unlink(temp_path)
-                return base64_data
+                return image_data
         except Exception as e:
             logging.error(f"使用curl下载图片失败: {str(e)}")
             if os.path.exists(temp_path):
@@ -265,16 +283,68 @@ async def url_to_base64(url):
         return None
         
     except Exception as e:
-        logging.error(f"URL转Base64全局异常: {str(e)}")
+        logging.error(f"下载图片全局异常: {str(e)}")
         return None
     
+async def notify_low_balance(balance):
+    """余额低于阈值时私聊提醒管理员（每次跌破阈值只提醒一次）"""
+    logging.warning(f"API余额不足: {balance:.2f}")
+    await msg_util.send_text(
+        Config.ADMIN_ID,
+        f"API余额不足: 当前 {balance:.2f}，低于提醒阈值 {Config.BALANCE_LOW_THRESHOLD:.2f}，请及时充值",
+        is_private=True
+    )
+
+@asynccontextmanager
+async def lifespan(app):
+    """应用生命周期：在主事件循环上运行后台任务，退出时释放连接"""
+    background_tasks = [
+        asyncio.create_task(greetings()),
+        asyncio.create_task(periodic_cleanup()),
+        asyncio.create_task(chat_manager.run_session_flusher()),
+        # 关闭按范围去重时只有一个全局池，启动即预取
+        asyncio.create_task(video_pool.run(() if Config.VIDEO_NO_REPEAT else (None,))),
+        asyncio.create_task(chat_manager.balance_monitor.run(notify_low_balance)),
+        asyncio.create_task(chat_manager.usage.run_flusher(Config.USAGE_FLUSH_INTERVAL)),
+        asyncio.create_task(chat_manager.run_health_probes())
+    ]
+    logging.info("后台任务已启动")
+    try:
+        yield
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        await message_handler.close()
+        await chat_manager.close()
+        logging.info("后台任务已停止，连接已关闭")
+
 # 初始化应用组件
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 auth_manager = AuthManager(admin_id=Config.ADMIN_ID)
-message_handler = MessageHandler()
+onebot_ws = OneBotWebSocket()
+message_handler = MessageHandler(websocket=onebot_ws)
 chat_manager = ChatManager()
 msg_util = MessageUtil(message_handler)
-image_db = ImageDatabaseManager()
+group_context = GroupContextStore(
+    capacity=Config.GROUP_CONTEXT_SIZE,
+    max_chars=Config.GROUP_CONTEXT_MAX_CHARS,
+    max_age=Config.GROUP_CONTEXT_MAX_AGE,
+    idle_ttl=Config.GROUP_CONTEXT_IDLE,
+    max_groups=Config.GROUP_CONTEXT_MAX_GROUPS
+)
+video_pool = VideoPrefetchPool(
+    lambda key: build_video_payload(key),
+    Config.VIDEO_PREFETCH_SIZE,
+    Config.VIDEO_PREFETCH_RATE,
+    Config.VIDEO_PREFETCH_IDLE
+)
+image_db = ImageDatabaseManager(sampler=ImageSampler(
+    no_repeat=Config.IMAGE_NO_REPEAT,
+    recent_count=Config.IMAGE_RECENT_COUNT,
+    recent_ratio=Config.IMAGE_RECENT_RATIO,
+    idle_ttl=Config.IMAGE_HISTORY_IDLE
+))
 
 async def extract_at_content(raw_message, message_array):
     """提取@消息的内容"""
@@ -310,12 +380,27 @@ async def extract_at_content(raw_message, message_array):
         
     return is_at_bot, actual_content
 
-async def handle_at_message(user_id, group_id, content, message_array=None):
-    """处理@消息"""
+def extract_plain_text(raw_message, message_array):
+    """提取消息的纯文本（用于群聊上下文），图片记为[图片]，@与其他消息段忽略"""
+    if not message_array:
+        return raw_message
+    parts = []
+    for segment in message_array:
+        if segment.get('type') == 'text':
+            parts.append(segment.get('data', {}).get('text', ''))
+        elif segment.get('type') == 'image':
+            parts.append('[图片]')
+    return ''.join(parts)
+
+async def handle_at_message(user_id, group_id, content, message_array=None, context=None):
+    """
+    处理@消息
+    :param context: 群聊最近消息（未启用群聊上下文时为None）
+    """
     try:
         # 应用限流
         allowed, reason = rate_limit(
-            chat_limiter, 
+            None,
             user_chat_limiters, 
             user_id,
             EXEMPT_USERS
@@ -358,11 +443,11 @@ async def handle_at_message(user_id, group_id, content, message_array=None):
             image_count = 0
             for url in image_urls:
                 logging.info(f"处理图片URL: {url}")
-                # 转换图片为Base64
-                base64_data = await url_to_base64(url)
-                if base64_data:
+                # 下载图片
+                image_data = await download_image(url)
+                if image_data:
                     # 保存到数据库
-                    result = image_db.insert_image(str(user_id), base64_data)
+                    result = image_db.insert_image(str(user_id), image_data)
                     if result:
                         image_count += 1
                         logging.info(f"成功保存用户 {user_id} 的图片到数据库")
@@ -386,8 +471,52 @@ async def handle_at_message(user_id, group_id, content, message_array=None):
             return {}
             
 
-        # 获取AI响应
-        code, answer = await chat_manager.get_chat_response(user_id, content)
+        # 管理员优先调度，排队较久时提示用户
+        priority = PRIORITY_ADMIN if user_id in EXEMPT_USERS else PRIORITY_GROUP
+
+        async def notify_queued():
+            await msg_util.send_text(
+                group_id,
+                "排队中，请稍候…",
+                is_private=False,
+                user_id=str(user_id)
+            )
+
+        # 获取AI响应（流式模式下回复在生成过程中分段发出，仅第一段@用户）
+        if Config.CHAT_STREAM:
+            segment_count = 0
+            reply_stream = object()
+
+            async def deliver(segment):
+                nonlocal segment_count
+                await msg_util.send_text(
+                    group_id,
+                    segment,
+                    is_private=False,
+                    user_id=str(user_id) if segment_count == 0 else None,
+                    stream=reply_stream
+                )
+                segment_count += 1
+
+            code, answer = await chat_manager.get_chat_response_stream(
+                user_id, content, deliver, priority=priority, on_queued=notify_queued,
+                group_id=group_id, context=context
+            )
+        else:
+            code, answer = await chat_manager.get_chat_response(
+                user_id, content, priority=priority, on_queued=notify_queued,
+                group_id=group_id, context=context
+            )
+
+        if code in (429, 503):
+            # 额度用完或排队超时，直接告知用户
+            await msg_util.send_text(
+                group_id,
+                answer,
+                is_private=False,
+                user_id=str(user_id)
+            )
+            return {}
             
         if code != 200:
             logging.error(f"AI响应错误: {code}, {answer}")
@@ -399,12 +528,15 @@ async def handle_at_message(user_id, group_id, content, message_array=None):
             return {}
             
         # 发送回复
-        await msg_util.send_text(
-            group_id,
-            answer,
-            is_private=False,
-            user_id=str(user_id)
-        )
+        if not Config.CHAT_STREAM:
+            await msg_util.send_text(
+                group_id,
+                answer,
+                is_private=False,
+                user_id=str(user_id)
+            )
+        if Config.GROUP_CONTEXT_ENABLED:
+            group_context.record(group_id, BOT_SENDER, answer)
         
         return {}
     except Exception as e:
@@ -430,7 +562,16 @@ async def handle_video_request(target_id, is_private=False, user_id=None):
                 )
                 return {}
         
-        bvs = chat_manager.get_random_video()
+        # 按群/私聊分别去重
+        no_repeat_key = ('private' if is_private else 'group', target_id) if Config.VIDEO_NO_REPEAT else None
+        
+        # 优先使用预取池中已构建好的推荐
+        videos = video_pool.take(no_repeat_key)
+        if videos is not None:
+            await msg_util.send_video_recommendation(target_id, is_private=is_private, videos=videos)
+            return {}
+        
+        bvs = chat_manager.get_random_video(no_repeat_key)
         if not bvs:
             await msg_util.send_text(
                 target_id,
@@ -440,7 +581,7 @@ async def handle_video_request(target_id, is_private=False, user_id=None):
             return {}
         
         # 获取视频信息
-        video_data = await fetch_video_info(bvs)
+        video_data = await get_video_data(bvs)
         if not video_data:
             await msg_util.send_text(
                 target_id,
@@ -462,33 +603,22 @@ async def handle_video_request(target_id, is_private=False, user_id=None):
         )
         return {}
 
-async def fetch_video_info(bvid):
-    """获取视频信息"""
-    try:
-        videos_url = f"https://api.bilibili.com/x/web-interface/view?bvid={bvid}"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Cookie": Config.BILIBILI_COOKIE
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(videos_url, headers=headers, timeout=10.0)
-        
-        if response.status_code != 200:
-            logging.error(f"获取视频信息失败: 状态码 {response.status_code}")
-            return None
-
-        data = response.json()
-        items = data.get('data', {})
-        
-        return {
-            'title': items.get('title', '无标题'),
-            'cover_url': items.get('pic', ''),
-            'jump_url': f"https://www.bilibili.com/video/{bvid}"
-        }
-    except Exception as e:
-        logging.error(f"获取视频信息出错: {str(e)}")
+async def get_video_data(bvid):
+    """获取视频信息：优先使用离线信息库，缺失时按配置在线获取"""
+    video_data = chat_manager.get_video_info(bvid)
+    if not video_data and Config.VIDEO_LIVE_FALLBACK:
+        video_data = await chat_manager.fetch_video_info(bvid)
+    return video_data
+
+async def build_video_payload(no_repeat_key=None):
+    """选取视频并构建推荐消息段（供预取池后台调用），失败时返回None"""
+    bvs = chat_manager.get_random_video(no_repeat_key)
+    if not bvs:
+        return None
+    video_data = await get_video_data(bvs)
+    if not video_data:
         return None
+    return MessageUtil.build_video_recommendation(video_data)
 
 async def handle_private_chat(user_id, message, message_array=None):
     """处理私聊聊天"""
@@ -504,7 +634,7 @@ async def handle_private_chat(user_id, message, message_array=None):
         
         # 应用限流
         allowed, reason = rate_limit(
-            chat_limiter, 
+            None,
             user_chat_limiters, 
             user_id,
             EXEMPT_USERS
@@ -531,11 +661,11 @@ async def handle_private_chat(user_id, message, message_array=None):
                 image_count = 0
                 for url in image_urls:
                     logging.info(f"处理私聊图片URL: {url}")
-                    # 转换图片为Base64
-                    base64_data = await url_to_base64(url)
-                    if base64_data:
+                    # 下载图片
+                    image_data = await download_image(url)
+                    if image_data:
                         # 保存到数据库
-                        result = image_db.insert_image(str(user_id), base64_data)
+                        result = image_db.insert_image(str(user_id), image_data)
                         if result:
                             image_count += 1
                             logging.info(f"成功保存用户 {user_id} 的图片到数据库")
@@ -556,8 +686,26 @@ async def handle_private_chat(user_id, message, message_array=None):
                     )
                 return {}
 
-        # 获取AI回复
-        code, answer = await chat_manager.get_chat_response(user_id, message)
+        # 管理员优先调度，排队较久时提示用户
+        priority = PRIORITY_ADMIN if user_id in EXEMPT_USERS else PRIORITY_PRIVATE
+
+        async def notify_queued():
+            await msg_util.send_text(user_id, "排队中，请稍候…", is_private=True)
+
+        # 获取AI回复（流式模式下回复在生成过程中分段发出）
+        if Config.CHAT_STREAM:
+            reply_stream = object()
+
+            async def deliver(segment):
+                await msg_util.send_text(user_id, segment, is_private=True, stream=reply_stream)
+
+            code, answer = await chat_manager.get_chat_response_stream(
+                user_id, message, deliver, priority=priority, on_queued=notify_queued
+            )
+        else:
+            code, answer = await chat_manager.get_chat_response(
+                user_id, message, priority=priority, on_queued=notify_queued
+            )
         
         if code != 200:
             logging.error(f"私聊AI响应错误: {code}, {answer}")
@@ -567,7 +715,7 @@ async def handle_private_chat(user_id, message, message_array=None):
                 is_private=True
             )
             
-            if code >= 500:
+            if code >= 500 and code != 503:
                 await msg_util.send_text(
                     Config.ADMIN_ID,
                     f"严重错误: 用户 {user_id} 的请求失败: {answer}",
@@ -575,7 +723,8 @@ async def handle_private_chat(user_id, message, message_array=None):
                 )
             return {}
             
-        await msg_util.send_text(user_id, answer, is_private=True)
+        if not Config.CHAT_STREAM:
+            await msg_util.send_text(user_id, answer, is_private=True)
         return {}
     except Exception as e:
         logging.error(f"处理私聊对话时发生错误: {str(e)}")
@@ -609,9 +758,9 @@ async def handle_songs_images(target_id, is_private=False):
 async def handle_random_image(target_id, is_private=False):
     """从数据库随机获取并发送一张图片"""
     try:
-        base64_data = image_db.get_random_image()
+        image_bytes = image_db.get_random_image(f"{'private' if is_private else 'group'}:{target_id}")
         
-        if not base64_data:
+        if not image_bytes:
             await msg_util.send_text(
                 target_id,
                 "暂无图片可以显示",
@@ -621,7 +770,7 @@ async def handle_random_image(target_id, is_private=False):
         
         await msg_util.send_image(
             target_id,
-            image_base=base64_data,
+            image_bytes=image_bytes,
             is_private=is_private
         )
         logging.info(f"成功发送随机图片: {'私聊' if is_private else '群聊'}")
@@ -651,6 +800,14 @@ async def handle_admin_command(user_id, command):
         elif command == "重载配置":
             return await handle_reload_config(user_id)
             
+        elif command == "用量排行":
+            return await handle_usage_ranking(user_id)
+            
+        elif command == "余额查询":
+            balance = await chat_manager.get_balance()
+            await msg_util.send_text(user_id, f"API余额: {balance}", is_private=True)
+            return {}
+            
         else:
             await msg_util.send_text(
                 user_id, 
@@ -695,7 +852,7 @@ async def handle_private_message(user_id, message, message_array=None):
             return await handle_random_image(user_id, is_private=True)
         
         # 处理管理员命令
-        elif message in ["服务状态", "清理缓存", "重载配置"]:
+        elif message in ["服务状态", "清理缓存", "重载配置", "余额查询", "用量排行"]:
             return await handle_admin_command(user_id, message)
         
         # 处理普通聊天
@@ -737,15 +894,63 @@ async def handle_service_status(user_id):
         # 计算API调用次数和用户数
         api_calls = len(user_chat_limiters) + len(user_video_limiters)
         unique_users = set(user_chat_limiters.keys()) | set(user_video_limiters.keys())
+        send_stats = message_handler.get_stats()
+        cache_stats = chat_manager.response_cache.stats()
+        flight_stats = chat_manager.single_flight.stats()
+        dispatch_stats = chat_manager.dispatcher.stats()
+        prefetch_stats = video_pool.stats()
+        image_stats = image_db.sampler.stats()
+        insert_stats = image_db.insert_stats
+        if chat_manager.concurrency is not None:
+            aimd = chat_manager.concurrency.stats()
+            concurrency_line = (
+                f"- 自适应并发: 上限 {aimd['limit']} (范围 {aimd['min_limit']}-{aimd['max_limit']}), "
+                f"基线延迟 {(aimd['baseline'] or 0) * 1000:.0f}ms/token, 上调 {aimd['increases']} 次, 下调 {aimd['decreases']} 次"
+                + (f" (最近: {aimd['last_reason']})" if aimd['last_reason'] else "")
+                + (f", 暂停放行剩余 {aimd['paused_for']:.0f}s" if aimd['paused_for'] > 0 else "")
+                + "\n"
+            )
+        else:
+            concurrency_line = ""
+        balance = chat_manager.balance_monitor.describe()
+        backend_lines = "".join(
+            f"\n  · {b['name']}({b['model']}): {b['state']}, "
+            f"延迟 {b['latency'] or 0:.2f}s, 失败率 {b['error_rate']:.1%}, 成功 {b['successes']}/失败 {b['failures']}"
+            for b in chat_manager.router.stats()
+        )
+        wait_histogram = ", ".join(f"{k}:{v}" for k, v in dispatch_stats['wait_histogram'].items()) or "无"
+        queue_histogram = ", ".join(f"{k}:{v}" for k, v in dispatch_stats['queue_histogram'].items()) or "无"
         
         status = (
             f"服务状态报告:\n"
             f"- 运行时间: {uptime_str}\n"
             f"- 内存使用: {memory_mb:.2f} MB\n"
+            f"- API余额: {balance}\n"
             f"- API调用次数: {api_calls}\n"
             f"- 用户数: {len(unique_users)}\n"
             f"- 当前聊天限流器: {len(user_chat_limiters)}\n"
-            f"- 当前视频限流器: {len(user_video_limiters)}"
+            f"- 当前视频限流器: {len(user_video_limiters)}\n"
+            f"- 群聊上下文: {len(group_context)} 个群\n"
+            f"- 图片入库: 新增 {insert_stats['inserted']}, 完全相同 {insert_stats['exact_duplicates']}, "
+            f"相似 {insert_stats['similar_duplicates']}, 失败 {insert_stats['failed']}\n"
+            f"- 随机图片: {image_stats['images']} 张, 抽取 {image_stats['samples']} 次, "
+            f"重抽 {image_stats['retries']} 次, 去重记录 {image_stats['scopes']} 个范围\n"
+            f"- 出站队列: 待发送 {send_stats['queue_depth']} (峰值 {send_stats['max_depth']}), "
+            f"活跃目标 {send_stats['active_targets']}\n"
+            f"- 出站发送: 成功 {send_stats['sent']}, 失败 {send_stats['failed']}, 合并 {send_stats['merged']}\n"
+            f"- 出站延迟: 平均 {send_stats['avg_delay']:.2f}s, 最大 {send_stats['max_delay']:.2f}s\n"
+            f"- 回复缓存: 命中 {cache_stats['hits']}, 未命中 {cache_stats['misses']}, "
+            f"命中率 {cache_stats['hit_rate']:.1%}, 条目 {cache_stats['entries']}\n"
+            f"- 请求合并: 上游调用 {flight_stats['upstream_calls']}, 节省 {flight_stats['saved_calls']}\n"
+            f"- 视频预取: 命中 {prefetch_stats['hits']}, 未命中 {prefetch_stats['misses']}, "
+            f"命中率 {prefetch_stats['hit_rate']:.1%}, 池中 {prefetch_stats['pooled']} 条/{prefetch_stats['scopes']} 个范围\n"
+            f"- LLM调度: 并发 {dispatch_stats['active']}/{dispatch_stats['max_concurrent']}, "
+            f"排队 {dispatch_stats['queued']} (峰值 {dispatch_stats['max_queue']}), "
+            f"已调度 {dispatch_stats['dispatched']}, 排队超时 {dispatch_stats['timeouts']}\n"
+            f"{concurrency_line}"
+            f"- 排队等待分布: {wait_histogram}\n"
+            f"- 到达时排队长度分布: {queue_histogram}\n"
+            f"- LLM后端 (切换 {chat_manager.router.failovers} 次):{backend_lines}"
         )
         
         await msg_util.send_text(user_id, status, is_private=True)
@@ -759,6 +964,27 @@ async def handle_service_status(user_id):
         )
         return {}
 
+async def handle_usage_ranking(user_id, limit=5):
+    """查询今日用量最高的用户/群/预设"""
+    try:
+        sections = []
+        for scope, name in [(SCOPE_USER, "用户"), (SCOPE_GROUP, "群"), (SCOPE_PRESET, "预设")]:
+            rows = await chat_manager.usage.top(scope, limit=limit)
+            lines = [
+                f"{i}. {row['key']}: {row['prompt_tokens'] + row['completion_tokens']} tokens "
+                f"(提示 {row['prompt_tokens']} / 补全 {row['completion_tokens']}), "
+                f"{row['requests']} 次, 平均 {row['avg_latency']:.2f}s, 约 {row['cost']:.4f} 元"
+                for i, row in enumerate(rows, 1)
+            ]
+            sections.append(f"{name}:\n" + ("\n".join(lines) if lines else "暂无数据"))
+        
+        await msg_util.send_text(user_id, "今日用量排行:\n" + "\n\n".join(sections), is_private=True)
+        return {}
+    except Exception as e:
+        logging.error(f"查询用量排行时出错: {str(e)}")
+        await msg_util.send_text(user_id, f"查询用量排行失败: {str(e)}", is_private=True)
+        return {}
+
 async def handle_cache_cleanup(user_id):
     """清理系统缓存"""
     if user_id != Config.ADMIN_ID:
@@ -771,10 +997,12 @@ async def handle_cache_cleanup(user_id):
         
         user_chat_limiters.clear()
         user_video_limiters.clear()
+        cleared_replies = chat_manager.response_cache.clear()
                 
         await msg_util.send_text(
             user_id,
-            f"缓存清理完成:\n- 清除了 {cleared_chat} 个聊天限流器\n- 清除了 {cleared_video} 个视频限流器",
+            f"缓存清理完成:\n- 清除了 {cleared_chat} 个聊天限流器\n- 清除了 {cleared_video} 个视频限流器\n"
+            f"- 清除了 {cleared_replies} 条回复缓存",
             is_private=True
         )
         logging.info(f"缓存清理完成: {cleared_chat} 个聊天限流器, {cleared_video} 个视频限流器")
@@ -815,12 +1043,9 @@ async def handle_reload_config(user_id):
         return {}
 
 # 消息接收与处理
-@app.post("/")
-async def root(request: Request):
-    """消息接收与处理"""
+async def handle_event(data):
+    """消息接收与处理（HTTP上报与WebSocket事件共用）"""
     try:
-        data = await request.json()
-        
         # 提取消息内容
         raw_message = data.get('raw_message', '')
         message_array = data.get('message', [])
@@ -914,9 +1139,17 @@ async def root(request: Request):
 
         # 处理@机器人消息
         is_at_bot, actual_content = await extract_at_content(raw_message, message_array)
+
+        # 记录群聊上下文（@请求使用记录本条之前的消息）
+        context = None
+        if Config.GROUP_CONTEXT_ENABLED:
+            if is_at_bot:
+                context = group_context.render(group_id)
+            group_context.record(group_id, chat_user_id, extract_plain_text(raw_message, message_array))
+
         if is_at_bot:
             # 传递完整message_array给handle_at_message
-            return await handle_at_message(chat_user_id, int(group_id), actual_content, message_array)
+            return await handle_at_message(chat_user_id, int(group_id), actual_content, message_array, context)
 
     except Exception as e:
         logging.error(f"处理请求时发生错误: {str(e)}")
@@ -924,30 +1157,31 @@ async def root(request: Request):
         logging.error(traceback.format_exc())
         return {"status": "error", "message": "服务器内部错误"}    
 
+@app.post("/")
+async def root(request: Request):
+    """HTTP上报入口"""
+    try:
+        data = await request.json()
+    except Exception as e:
+        logging.error(f"解析上报数据失败: {str(e)}")
+        return {"status": "error", "message": "无效的请求数据"}
+    return await handle_event(data)
+
+@app.websocket(Config.WS_PATH)
+async def onebot_websocket(websocket: WebSocket):
+    """反向WebSocket入口：LLOneBot连接后在同一连接上收发事件与API调用"""
+    await onebot_ws.serve(websocket, handle_event)
+
 async def periodic_cleanup():
-    """定期清理过期的限流器"""
+    """定期清理过期的限流器和会话（只处理已到期的条目）"""
     while True:
         try:
-            current_time = time.time()
-            inactive_threshold = current_time - 1800
-            
-            # 清理聊天限流器
-            chat_inactive = []
-            for user_id, limiter in user_chat_limiters.items():
-                if limiter.last_time < inactive_threshold:
-                    chat_inactive.append(user_id)
-            
-            for user_id in chat_inactive:
-                user_chat_limiters.pop(user_id, None)
-            
-            # 清理视频限流器
-            video_inactive = []
-            for user_id, limiter in user_video_limiters.items():
-                if limiter.last_time < inactive_threshold:
-                    video_inactive.append(user_id)
-            
-            for user_id in video_inactive:
-                user_video_limiters.pop(user_id, None)
+            chat_inactive = user_chat_limiters.expire()
+            video_inactive = user_video_limiters.expire()
+            chat_manager.clean_expired_sessions()
+            await chat_manager.purge_stored_sessions()
+            group_context.expire()
+            image_db.sampler.expire()
                 
             if chat_inactive or video_inactive:
                 logging.info(f"自动清理: {len(chat_inactive)} 个聊天限流器, {len(video_inactive)} 个视频限流器")
@@ -972,25 +1206,7 @@ async def greetings():
         else:
             await asyncio.sleep(59)
 
-def run_background_tasks():
-    """在独立线程中运行后台任务"""
-    try:
-        # 创建新的事件循环
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        logging.INFO("后台任务线程已创建")
-        loop.run_until_complete(asyncio.gather(
-            greetings(),
-            periodic_cleanup()
-        ))
-    except Exception as e:
-        logging.error(f"后台任务线程初始化失败: {str(e)}")
-
 if __name__ == "__main__":
-    background_thread = threading.Thread(target=run_background_tasks, daemon=True)
-    background_thread.start()
-    logging.info("后台任务线程已启动")
-
     uvicorn.run(
         app,
         host="0.0.0.0",
@@ -1,33 +1,131 @@
+import asyncio
 import httpx
-import requests
-import concurrent.futures
-from typing import Optional, Dict, Any
+from collections import deque
+from typing import Optional, Dict, Any, List, Tuple, Union
+from urllib.parse import urlsplit
 from config import Config
+from onebot_ws import WebSocketSendError
+
+class _OutboundItem:
+    """待发送的一条出站消息"""
+    __slots__ = ('segments', 'enqueued_at', 'stream', 'untrimmed')
+
+    def __init__(self, segments: List[Dict[str, Any]], enqueued_at: float, stream: Any = None):
+        self.segments = segments
+        self.enqueued_at = enqueued_at
+        # 所属的流式回复（同一条回复的各段相同），普通消息为None
+        self.stream = stream
+        # 流式分段保留了首尾空白，发送前再去除
+        self.untrimmed = stream is not None
+
+class _TargetQueue:
+    """单个群/用户的发送队列，由一个工作协程独占消费"""
+    __slots__ = ('target_id', 'items', 'wakeup', 'worker', 'last_sent')
+
+    def __init__(self, target_id: int):
+        self.target_id = target_id
+        self.items: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+        self.last_sent = 0.0
 
 class MessageHandler:
-    def __init__(self):
+    def __init__(self, websocket=None):
         self.server_url = Config.LOCAL_SERVER
         self.private_url = Config.ADMIN_SERVER
-    
-    async def send_message(self, group_id:int, message: Dict[str, Any]) -> Optional[requests.Response]:
-        """发送群普通消息"""
-        def post_request():
-            try:
-                response = requests.post(self.server_url, json={
-                    'group_id': group_id,
-                    'message': message
-                })
-                response.raise_for_status()
-                return response
-            except requests.RequestException as e:
-                print(f"请求失败：{e}")
+        # 反向WebSocket连接（ONEBOT_TRANSPORT = "ws" 时使用），未连接时回退到HTTP
+        self.websocket = websocket
+        # 每个上游（scheme://host:port）一个长连接客户端，随机器人整个生命周期复用
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        # 出站队列：(类型, 目标ID字符串) -> 目标队列，每个目标一个工作协程
+        self._targets: Dict[Tuple[str, str], _TargetQueue] = {}
+        self._global_lock: Optional[asyncio.Lock] = None
+        self._global_last_sent = 0.0
+        self._pending = 0
+        # close() 开始后置位：工作协程发完队列中剩余消息即退出，不再等待空闲超时
+        self._closing = False
+        self.stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "merged": 0,
+            "failed": 0,
+            "max_depth": 0,
+            "total_delay": 0.0,
+            "max_delay": 0.0
+        }
+
+    def _get_client(self, url: str) -> httpx.AsyncClient:
+        """获取目标地址所属上游的共享客户端（不存在时创建）"""
+        parts = urlsplit(url)
+        upstream = f"{parts.scheme}://{parts.netloc}"
+        client = self._clients.get(upstream)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=Config.HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(
+                    Config.HTTP_TIMEOUT,
+                    connect=Config.HTTP_CONNECT_TIMEOUT
+                ),
+                headers={'Content-Type': 'application/json'}
+            )
+            self._clients[upstream] = client
+        return client
+
+    async def _post(self, url: str, payload: Dict[str, Any]) -> Optional[Union[httpx.Response, Dict[str, Any]]]:
+        """发送API请求：优先走WebSocket，否则通过共享客户端发送HTTP POST"""
+        if Config.ONEBOT_TRANSPORT == "ws":
+            if self.websocket is not None and self.websocket.connected:
+                try:
+                    return await self._call_ws(url, payload)
+                except WebSocketSendError as e:
+                    # 请求未写入连接（连接刚断开/已关闭），可以安全地改用HTTP发送
+                    if not Config.WS_HTTP_FALLBACK:
+                        print(f"WebSocket请求失败：{e!r}")
+                        return None
+                    print(f"WebSocket发送失败，回退到HTTP：{e!r}")
+            elif not Config.WS_HTTP_FALLBACK:
+                print("WebSocket未连接，消息未发送")
                 return None
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(post_request)
-            return future.result()
-    
-    async def send_group_message(self, group_id: int, user_id: str, message: str) -> Optional[requests.Response]:
+        try:
+            response = await self._get_client(url).post(url, json=payload)
+            response.raise_for_status()
+            return response
+        except httpx.HTTPError as e:
+            print(f"请求失败：{e}")
+            return None
+
+    async def _call_ws(self, url: str, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        通过WebSocket调用与URL路径同名的API
+        :raises WebSocketSendError: 请求未能写入连接，由调用方决定是否回退到HTTP
+        """
+        action = urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+        try:
+            response = await self.websocket.call_action(action, payload)
+        except WebSocketSendError:
+            raise
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            # 请求已发出但未收到响应，可能已经送达，不再重发以免重复
+            print(f"WebSocket请求失败：{e!r}")
+            return None
+        if response.get('status') == 'failed' or response.get('retcode', 0) != 0:
+            print(f"WebSocket请求失败：{response}")
+            return None
+        return response
+
+    async def send_message(self, group_id:int, message: Dict[str, Any]) -> Optional[Union[httpx.Response, Dict[str, Any]]]:
+        """发送群普通消息"""
+        return await self._post(self.server_url, {
+            'group_id': group_id,
+            'message': message
+        })
+
+    async def send_group_message(self, group_id: int, user_id: str, message: str) -> Optional[Union[httpx.Response, Dict[str, Any]]]:
         """发送群@消息"""
         message_payload = {
             "group_id": group_id,
@@ -46,34 +144,211 @@ class MessageHandler:
                 }
             ]
         }
-        try:
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.server_url,
-                    json=message_payload,
-                    headers={'Content-Type': 'application/json'}
-                )
-                response.raise_for_status()
-                return response
-        except Exception as e:
-            print(f"发送群消息失败：{e}")
-            return None
-    
-    async def send_private_message(self, user_id:int, messgae: Dict[str, Any]) -> Optional[httpx.Response]:
+        return await self._post(self.server_url, message_payload)
+
+    async def send_private_message(self, user_id:int, messgae: Dict[str, Any]) -> Optional[Union[httpx.Response, Dict[str, Any]]]:
         """发送私聊消息"""
-        def post_request():
-            try:
-                response = requests.post(self.private_url, json={
-                    'user_id': user_id,
-                    'message': messgae
-                })
-                response.raise_for_status()
-                return response
-            except requests.RequestException as e:
-                print(f"请求失败：{e}")
-                return None
+        return await self._post(self.private_url, {
+            'user_id': user_id,
+            'message': messgae
+        })
+
+    @staticmethod
+    def _to_segments(message: Union[str, Dict[str, Any], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """将字符串/单个消息段/消息段列表统一为消息段列表"""
+        if isinstance(message, str):
+            return [{'type': 'text', 'data': {'text': message}}]
+        if isinstance(message, dict):
+            return [message]
+        return list(message)
+
+    @staticmethod
+    def _split_text(segments: List[Dict[str, Any]]) -> Optional[Tuple[Optional[str], str]]:
+        """
+        拆分纯文本消息（允许开头一个@）
+        :return: (被@的QQ号或None, 文本)；含其他类型消息段时返回None
+        """
+        at_qq = None
+        if segments and segments[0].get('type') == 'at':
+            at_qq = str(segments[0].get('data', {}).get('qq'))
+            segments = segments[1:]
+        if not segments or any(seg.get('type') != 'text' for seg in segments):
+            return None
+        return at_qq, ''.join(seg.get('data', {}).get('text', '') for seg in segments)
+
+    def _try_merge(self, first: _OutboundItem, second: _OutboundItem) -> bool:
+        """尝试把相邻的第二条文本消息合并进第一条，成功返回True"""
+        head = self._split_text(first.segments)
+        tail = self._split_text(second.segments)
+        if head is None or tail is None:
+            return False
+        if tail[0] is not None and tail[0] != head[0]:
+            return False
+        head_text, tail_text = head[1], tail[1]
+        if first.stream is not None and first.stream is second.stream:
+            # 同一条流式回复的分段可能断在句子中间，按原样直接拼接
+            separator = ""
+        else:
+            # 不同的消息之间换行
+            separator = "\n"
+            if first.untrimmed:
+                head_text = head_text.rstrip()
+            if second.untrimmed:
+                tail_text = tail_text.lstrip()
+        text = f"{head_text}{separator}{tail_text}"
+        if len(text) > Config.SEND_MERGE_MAX_CHARS:
+            return False
+        first.segments = self._text_segments(head[0], text)
+        # 合并后的末尾来自第二条消息，之后能否直接拼接由它决定
+        first.stream = second.stream
+        first.untrimmed = first.untrimmed or second.untrimmed
+        return True
+
+    @staticmethod
+    def _text_segments(at_qq: Optional[str], text: str) -> List[Dict[str, Any]]:
+        """构造（可带开头@的）纯文本消息段"""
+        segments = [{'type': 'text', 'data': {'text': text}}]
+        if at_qq is not None:
+            segments.insert(0, {'type': 'at', 'data': {'qq': at_qq}})
+        return segments
+
+    def _trim(self, item: _OutboundItem):
+        """去除流式分段保留的首尾空白"""
+        if not item.untrimmed:
+            return
+        parts = self._split_text(item.segments)
+        if parts is not None:
+            item.segments = self._text_segments(parts[0], parts[1].strip())
+        item.untrimmed = False
+
+    def _enqueue(self, kind: str, target_id: int, message: Union[str, Dict[str, Any], List[Dict[str, Any]]],
+                 stream: Any = None):
+        """将消息放入目标队列，必要时启动该目标的工作协程"""
+        loop = asyncio.get_running_loop()
+        key = (kind, str(target_id))
+        state = self._targets.get(key)
+        if state is None:
+            state = _TargetQueue(target_id)
+            self._targets[key] = state
+            state.worker = loop.create_task(self._run_target(key, state))
+        state.items.append(_OutboundItem(self._to_segments(message), loop.time(), stream))
+        state.wakeup.set()
+
+        self._pending += 1
+        self.stats["enqueued"] += 1
+        if self._pending > self.stats["max_depth"]:
+            self.stats["max_depth"] = self._pending
+
+    def enqueue_message(self, group_id: int, message: Union[str, Dict[str, Any], List[Dict[str, Any]]],
+                        stream: Any = None):
+        """
+        排队发送群普通消息（立即返回）
+        :param stream: 所属流式回复的标识，同一标识的相邻文本合并时不加换行
+        """
+        self._enqueue('group', group_id, message, stream)
+
+    def enqueue_group_message(self, group_id: int, user_id: str, message: str, stream: Any = None):
+        """排队发送群@消息（立即返回）"""
+        self._enqueue('group', group_id, [
+            {'type': 'at', 'data': {'qq': f"{user_id}"}},
+            {'type': 'text', 'data': {'text': message}}
+        ], stream)
+
+    def enqueue_private_message(self, user_id: int, message: Union[str, Dict[str, Any], List[Dict[str, Any]]],
+                                stream: Any = None):
+        """排队发送私聊消息（立即返回）"""
+        self._enqueue('private', user_id, message, stream)
+
+    async def _wait_global_slot(self):
+        """全局节流：保证任意两次发送之间至少间隔 SEND_GLOBAL_INTERVAL"""
+        if self._global_lock is None:
+            self._global_lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        async with self._global_lock:
+            delay = self._global_last_sent + Config.SEND_GLOBAL_INTERVAL - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._global_last_sent = loop.time()
+
+    async def _run_target(self, key: Tuple[str, str], state: _TargetQueue):
+        """目标队列工作协程：按目标节流、合并相邻文本后依次发送"""
+        loop = asyncio.get_running_loop()
+        kind, target_id = key[0], state.target_id
+        try:
+            while True:
+                if not state.items:
+                    if self._closing:
+                        break
+                    state.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(state.wakeup.wait(), Config.SEND_WORKER_IDLE)
+                    except asyncio.TimeoutError:
+                        if not state.items:
+                            break
+                    continue
+
+                # 目标级节流，等待期间到达的消息可以一并合并
+                delay = state.last_sent + Config.SEND_TARGET_INTERVAL - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                item = state.items.popleft()
+                self._pending -= 1
+                while state.items and self._try_merge(item, state.items[0]):
+                    state.items.popleft()
+                    self._pending -= 1
+                    self.stats["merged"] += 1
+                self._trim(item)
+
+                await self._wait_global_slot()
+                waited = loop.time() - item.enqueued_at
+                self.stats["total_delay"] += waited
+                if waited > self.stats["max_delay"]:
+                    self.stats["max_delay"] = waited
+
+                try:
+                    if kind == 'group':
+                        response = await self.send_message(target_id, item.segments)
+                    else:
+                        response = await self.send_private_message(target_id, item.segments)
+                except Exception as e:
+                    print(f"发送队列消息失败：{e}")
+                    response = None
+                state.last_sent = loop.time()
+                self.stats["sent" if response is not None else "failed"] += 1
+        finally:
+            if self._targets.get(key) is state:
+                del self._targets[key]
+
+    def queue_depth(self) -> int:
+        """当前所有目标队列中待发送的消息数"""
+        return self._pending
+
+    def get_stats(self) -> Dict[str, Any]:
+        """出站队列统计信息"""
+        stats = dict(self.stats)
+        handled = stats["sent"] + stats["failed"]
+        stats["queue_depth"] = self.queue_depth()
+        stats["active_targets"] = len(self._targets)
+        stats["avg_delay"] = stats["total_delay"] / handled if handled else 0.0
+        return stats
+
+    async def close(self):
+        """等待出站队列发送完毕（有超时），然后关闭所有上游客户端"""
+        self._closing = True
+        workers = []
+        for state in self._targets.values():
+            # 唤醒空闲等待中的工作协程，使其发现队列已空后立即退出
+            state.wakeup.set()
+            if state.worker:
+                workers.append(state.worker)
+        if workers:
+            _, pending = await asyncio.wait(workers, timeout=Config.SEND_DRAIN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self._pending = 0
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(post_request)
-            return future.result()
\ No newline at end of file
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
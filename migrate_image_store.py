@@ -0,0 +1,45 @@
+"""
+图片库迁移工具：将旧版以Base64文本存储图片的 image_data.db 流式迁移为 元数据表 + BLOB表
+
+机器人启动时也会自动完成迁移；图片较多时建议停机后先用本工具离线迁移并回收空间：
+    python migrate_image_store.py                       # 迁移 image_data.db
+    python migrate_image_store.py --db other.db --vacuum
+迁移按批提交，中途中断后重新运行会从断点继续。
+"""
+import os
+import sqlite3
+import argparse
+from ImageDatabaseManager import MIGRATION_BATCH_SIZE, migrate_base64_store
+
+def main():
+    parser = argparse.ArgumentParser(description="图片库Base64 → BLOB迁移")
+    parser.add_argument("--db", default="image_data.db", help="图片库路径")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE, help="每批迁移的行数")
+    parser.add_argument("--vacuum", action="store_true", help="迁移后执行VACUUM，归还旧表占用的磁盘空间")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        parser.error(f"图片库不存在: {args.db}")
+
+    size_before = os.path.getsize(args.db)
+    conn = sqlite3.connect(args.db)
+    try:
+        migrated, skipped = migrate_base64_store(
+            conn,
+            batch_size=args.batch_size,
+            progress=lambda done, total: print(f"\r已处理 {done}/{total}", end="", flush=True)
+        )
+        if not migrated and not skipped:
+            print("图片库已是BLOB存储，无需迁移")
+        else:
+            print(f"\n迁移完成，共迁移 {migrated} 张图片")
+            if skipped:
+                print(f"{skipped} 张图片数据损坏，已原样转存到 image_store_corrupt 表，可人工检查后删除")
+        if args.vacuum:
+            conn.execute("VACUUM")
+            print(f"数据库大小: {size_before / 1024 / 1024:.1f} MB -> {os.path.getsize(args.db) / 1024 / 1024:.1f} MB")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import json
+import asyncio
+import itertools
+import logging
+from typing import Optional, Dict, Any, Callable, Awaitable, Tuple
+from fastapi import WebSocket, WebSocketDisconnect
+from config import Config
+
+class WebSocketSendError(ConnectionError):
+    """API请求未能写入WebSocket（未连接或连接已关闭），请求确定未送达，可改用HTTP重发"""
+
+class OneBotWebSocket:
+    """OneBot v11 反向WebSocket连接：在同一条长连接上接收事件并调用API"""
+
+    def __init__(self):
+        self.websocket: Optional[WebSocket] = None
+        # echo -> (发出请求的连接, 等待响应的future)
+        self._pending: Dict[str, Tuple[WebSocket, asyncio.Future]] = {}
+        self._echo_seq = itertools.count(1)
+        self._send_lock: Optional[asyncio.Lock] = None
+        self._event_tasks: set = set()
+
+    @property
+    def connected(self) -> bool:
+        return self.websocket is not None
+
+    def _fail_pending(self, websocket: WebSocket, reason: str):
+        """让在该连接上发出、尚未收到响应的请求立即失败"""
+        for sent_on, future in list(self._pending.values()):
+            if sent_on is websocket and not future.done():
+                future.set_exception(ConnectionError(reason))
+
+    def _check_token(self, websocket: WebSocket) -> bool:
+        """校验LLOneBot携带的access token（未配置时不校验）"""
+        if not Config.WS_ACCESS_TOKEN:
+            return True
+        auth = websocket.headers.get('authorization', '')
+        token = auth[7:] if auth.lower().startswith('bearer ') else websocket.query_params.get('access_token', '')
+        return token == Config.WS_ACCESS_TOKEN
+
+    async def serve(self, websocket: WebSocket, on_event: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        """
+        处理一条来自LLOneBot的反向WebSocket连接，直到连接断开
+        :param websocket: FastAPI WebSocket对象
+        :param on_event: 收到事件上报时调用的处理函数
+        """
+        if not self._check_token(websocket):
+            logging.warning("WebSocket连接鉴权失败")
+            await websocket.close(code=1008)
+            return
+
+        await websocket.accept()
+        previous = self.websocket
+        self.websocket = websocket
+        if previous is not None:
+            logging.warning("已有WebSocket连接，新连接将替换旧连接")
+            # 旧连接上的请求不再等待响应；关闭旧连接使其接收循环退出
+            self._fail_pending(previous, "WebSocket连接已被新连接替换")
+            try:
+                await previous.close()
+            except Exception:
+                pass
+        logging.info("LLOneBot WebSocket已连接")
+
+        try:
+            while True:
+                text = await websocket.receive_text()
+                try:
+                    data = json.loads(text)
+                except ValueError:
+                    logging.warning(f"忽略无法解析的WebSocket消息: {text[:200]}")
+                    continue
+                if not isinstance(data, dict):
+                    logging.warning(f"忽略非对象的WebSocket消息: {text[:200]}")
+                    continue
+
+                # API调用的响应，按echo交给等待方
+                echo = data.get('echo')
+                if echo is not None and 'post_type' not in data:
+                    entry = self._pending.get(str(echo))
+                    if entry and not entry[1].done():
+                        entry[1].set_result(data)
+                    continue
+
+                # 心跳、生命周期等元事件无需业务处理
+                if data.get('post_type') == 'meta_event':
+                    continue
+
+                # 事件在独立任务中处理，避免阻塞接收循环
+                task = asyncio.create_task(on_event(data))
+                self._event_tasks.add(task)
+                task.add_done_callback(self._event_tasks.discard)
+
+        except WebSocketDisconnect:
+            logging.info("LLOneBot WebSocket已断开")
+        except Exception as e:
+            logging.error(f"WebSocket接收消息时发生错误: {str(e)}")
+        finally:
+            if self.websocket is websocket:
+                self.websocket = None
+            self._fail_pending(websocket, "WebSocket连接已断开")
+
+    async def call_action(self, action: str, params: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        通过WebSocket调用OneBot API，并等待同echo的响应
+        :param action: API名称，如 send_group_msg
+        :param params: API参数
+        :param timeout: 等待响应的超时(秒)，默认使用 WS_ACTION_TIMEOUT
+        :return: OneBot响应JSON
+        :raises WebSocketSendError: 未连接或写入失败（请求未送达）
+        :raises ConnectionError: 请求已发出但连接在收到响应前断开
+        """
+        websocket = self.websocket
+        if websocket is None:
+            raise WebSocketSendError("WebSocket未连接")
+        if self._send_lock is None:
+            self._send_lock = asyncio.Lock()
+
+        echo = str(next(self._echo_seq))
+        future = asyncio.get_running_loop().create_future()
+        self._pending[echo] = (websocket, future)
+        try:
+            async with self._send_lock:
+                try:
+                    await websocket.send_json({
+                        'action': action,
+                        'params': params,
+                        'echo': echo
+                    })
+                except (WebSocketDisconnect, RuntimeError, OSError) as e:
+                    raise WebSocketSendError(f"WebSocket发送失败: {e!r}") from e
+            return await asyncio.wait_for(future, timeout or Config.WS_ACTION_TIMEOUT)
+        finally:
+            self._pending.pop(echo, None)
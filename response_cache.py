@@ -0,0 +1,94 @@
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+class ResponseCache:
+    """AI回复缓存：每条记录带过期时间，超出条数或内存上限时按LRU淘汰"""
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int):
+        """
+        :param ttl: 默认过期时间(秒)
+        :param max_entries: 最大缓存条数
+        :param max_bytes: 缓存内容的最大字节数（按UTF-8估算）
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (过期时间, 回复, 占用字节数)，按最近使用排序
+        self._entries: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        """归一化提问：忽略大小写、多余空白和句尾语气符号"""
+        return ' '.join(prompt.split()).casefold().rstrip('。.!！~～ ')
+
+    @classmethod
+    def make_key(cls, preset: Dict[str, str], prompt: str, params: Dict[str, Any]) -> str:
+        """由预设、归一化提问和模型参数生成缓存键"""
+        raw = json.dumps(
+            [preset.get('role'), preset.get('content'), cls.normalize_prompt(prompt), params],
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key: str) -> Optional[str]:
+        """查询缓存，命中时刷新LRU顺序"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, reply: str, ttl: Optional[float] = None):
+        """写入缓存，超出上限时淘汰最久未使用的记录"""
+        size = len(key) + len(reply.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + (ttl or self.ttl), reply, size)
+        self._bytes += size
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self) -> int:
+        """清空缓存，返回清除的条数"""
+        count = len(self._entries)
+        self._entries.clear()
+        self._bytes = 0
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -0,0 +1,168 @@
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+from config import Config
+from expiring_map import ExpiringDict
+
+class SessionBackend(ABC):
+    """会话存储后端接口：按用户读取/写入对话消息列表"""
+
+    @abstractmethod
+    def load(self, user_id: int) -> Optional[Tuple[List[Dict[str, str]], float]]:
+        """
+        读取用户会话
+        :return: (消息列表, 最后更新时间戳)，不存在时返回None
+        """
+
+    @abstractmethod
+    def save(self, user_id: int, messages: List[Dict[str, str]]):
+        """写入用户会话（后端可以延迟批量落盘）"""
+
+    @abstractmethod
+    def delete(self, user_id: int):
+        """删除用户会话"""
+
+    async def purge(self, older_than: float) -> int:
+        """删除最后更新早于指定时间戳的会话，返回删除数量"""
+        return 0
+
+    async def flush(self):
+        """将待写入的数据落盘"""
+
+    async def close(self):
+        """落盘并释放资源"""
+        await self.flush()
+
+class MemorySessionBackend(SessionBackend):
+    """进程内会话存储，会话在超时后自动清除"""
+
+    def __init__(self, ttl: float):
+        self._sessions = ExpiringDict(ttl, clock=time.time)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def load(self, user_id: int) -> Optional[Tuple[List[Dict[str, str]], float]]:
+        return self._sessions.peek(user_id)
+
+    def save(self, user_id: int, messages: List[Dict[str, str]]):
+        self._sessions[user_id] = (list(messages), time.time())
+
+    def delete(self, user_id: int):
+        self._sessions.pop(user_id, None)
+
+    async def purge(self, older_than: float) -> int:
+        return len(self._sessions.expire())
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    SQLite会话存储（WAL模式）
+    写入先记在内存中，由 flush 在后台线程中批量提交；读取优先使用尚未落盘的数据。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # 读连接只在事件循环线程使用，写连接只在 flush 的工作线程中使用
+        self._read_conn = self._connect()
+        self._write_conn = self._connect(check_same_thread=False)
+        self._write_conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                user_id TEXT PRIMARY KEY,
+                messages TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._write_conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions (updated_at)"
+        )
+        self._write_conn.commit()
+        # 用户ID -> (消息列表, 更新时间)；值为None表示待删除
+        self._dirty: Dict[str, Optional[Tuple[List[Dict[str, str]], float]]] = {}
+        # 正在后台线程中提交的一批数据，提交完成前读取仍以它为准
+        self._flushing: Dict[str, Optional[Tuple[List[Dict[str, str]], float]]] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=check_same_thread)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def load(self, user_id: int) -> Optional[Tuple[List[Dict[str, str]], float]]:
+        key = str(user_id)
+        if key in self._dirty:
+            return self._dirty[key]
+        if key in self._flushing:
+            return self._flushing[key]
+        row = self._read_conn.execute(
+            "SELECT messages, updated_at FROM chat_sessions WHERE user_id = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def save(self, user_id: int, messages: List[Dict[str, str]]):
+        self._dirty[str(user_id)] = (list(messages), time.time())
+
+    def delete(self, user_id: int):
+        self._dirty[str(user_id)] = None
+
+    def _delete_older_than(self, older_than: float) -> int:
+        with self._write_conn:
+            cursor = self._write_conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (older_than,))
+        return cursor.rowcount
+
+    async def purge(self, older_than: float) -> int:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            return await asyncio.to_thread(self._delete_older_than, older_than)
+
+    def _write_batch(self, upserts: List[Tuple[str, str, float]], deletes: List[Tuple[str]]):
+        """在工作线程中以单个事务提交一批写入"""
+        with self._write_conn:
+            if upserts:
+                self._write_conn.executemany("""
+                    INSERT INTO chat_sessions (user_id, messages, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET messages = excluded.messages, updated_at = excluded.updated_at
+                """, upserts)
+            if deletes:
+                self._write_conn.executemany("DELETE FROM chat_sessions WHERE user_id = ?", deletes)
+
+    async def flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            self._flushing = batch
+            upserts = [
+                (key, json.dumps(value[0], ensure_ascii=False), value[1])
+                for key, value in batch.items() if value is not None
+            ]
+            deletes = [(key,) for key, value in batch.items() if value is None]
+            try:
+                await asyncio.to_thread(self._write_batch, upserts, deletes)
+            except Exception as e:
+                logging.error(f"会话批量写入失败: {str(e)}")
+                # 写入失败的数据放回待写入队列（不覆盖期间产生的更新）
+                for key, value in batch.items():
+                    self._dirty.setdefault(key, value)
+            finally:
+                self._flushing = {}
+
+    async def close(self):
+        await self.flush()
+        self._read_conn.close()
+        self._write_conn.close()
+
+def create_session_backend() -> SessionBackend:
+    """按配置创建会话存储后端"""
+    if Config.SESSION_BACKEND == "sqlite":
+        return SQLiteSessionBackend(Config.SESSION_DB_PATH)
+    return MemorySessionBackend(Config.SESSION_TIMEOUT)
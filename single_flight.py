@@ -0,0 +1,76 @@
+import json
+import asyncio
+import hashlib
+from typing import Dict, Any, Callable, Awaitable, TypeVar
+
+T = TypeVar('T')
+
+class _LeaderCancelled(Exception):
+    """发起调用的请求被取消，等待者需要自己重新发起调用"""
+
+class SingleFlight:
+    """合并相同的进行中请求：同一个键同时只发起一次上游调用，其余调用者共享其结果"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.upstream_calls = 0  # 实际发起的上游调用次数
+        self.saved_calls = 0     # 因合并而省下的上游调用次数
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """由完整请求体（上下文 + 模型参数）生成键"""
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: str, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        执行调用；若相同键的调用正在进行，则等待并返回它的结果（或异常）
+        :param key: 请求键
+        :param call: 无参协程函数，仅在没有同键调用时执行
+        """
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            try:
+                # shield：某个等待者被取消不影响发起者和其他等待者
+                result = await asyncio.shield(future)
+            except _LeaderCancelled:
+                # 发起者被取消不代表等待者也要取消：第一个醒来的等待者重新发起，其余等待者加入它
+                continue
+            self.saved_calls += 1
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.upstream_calls += 1
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            # 不能直接 cancel future，否则等待者会收到与自己无关的 CancelledError
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        """合并统计信息"""
+        return {
+            "upstream_calls": self.upstream_calls,
+            "saved_calls": self.saved_calls,
+            "inflight": self.inflight
+        }
@@ -0,0 +1,24 @@
+import os
+import sys
+import asyncio
+import contextlib
+import uvicorn
+
+# 项目为平铺的顶层模块，测试直接从仓库根目录导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@contextlib.asynccontextmanager
+async def serve_app(app):
+    """在当前事件循环中启动本地 uvicorn 服务（随机端口），退出时关闭；产出 http://127.0.0.1:端口"""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="critical", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
@@ -0,0 +1,75 @@
+from conversation import ConversationSession
+
+PRESET = {"content": "You are a helpful assistant.", "role": "system"}
+
+def _roles_and_contents(session):
+    return [(message["role"], message["content"]) for message in session.history()]
+
+def test_overlapping_requests_keep_question_answer_pairs():
+    session = ConversationSession(PRESET)
+    question_a = session.append("user", "A")
+    question_b = session.append("user", "B")
+
+    # A 的回复先到：插入到 A 之后而不是末尾
+    session.insert_after(question_a, "assistant", "reply A")
+    session.insert_after(question_b, "assistant", "reply B")
+
+    assert _roles_and_contents(session) == [
+        ("user", "A"), ("assistant", "reply A"), ("user", "B"), ("assistant", "reply B")
+    ]
+
+def test_failed_request_removes_only_its_own_question():
+    session = ConversationSession(PRESET)
+    question_a = session.append("user", "A")
+    question_b = session.append("user", "B")
+    session.insert_after(question_b, "assistant", "reply B")
+
+    assert session.remove(question_a)
+    assert not session.remove(question_a)
+    assert _roles_and_contents(session) == [("user", "B"), ("assistant", "reply B")]
+    assert session.turn_tokens == sum(tokens for _, tokens in session.turns)
+
+def test_equal_content_is_matched_by_identity():
+    session = ConversationSession(PRESET)
+    first = session.append("user", "同样的问题")
+    second = session.append("user", "同样的问题")
+
+    session.remove(second)
+    assert len(session) == 1
+    assert session.turns[0][0] is first
+
+def _long_session(turns):
+    session = ConversationSession(PRESET)
+    for i in range(turns):
+        session.append("user", f"问题{i}")
+        session.append("assistant", f"回答{i}")
+    return session
+
+def test_compactable_keeps_recent_messages_and_starts_remainder_with_user():
+    session = _long_session(5)
+    # 保留最近3条时剩余部分会以助手消息开头，因此多保留一条
+    compacted = session.compactable(3)
+    assert [message["content"] for message in compacted] == ["问题0", "回答0", "问题1", "回答1", "问题2", "回答2"]
+    assert session.compactable(10) == []
+
+def test_apply_summary_replaces_compacted_messages_and_restores():
+    session = _long_session(4)
+    compacted = session.compactable(2)
+    assert session.apply_summary("用户问了几个问题", compacted)
+    assert session.summary == "用户问了几个问题"
+    assert _roles_and_contents(session)[1:] == [("user", "问题3"), ("assistant", "回答3")]
+    assert session.to_messages()[0] == PRESET
+
+    restored = ConversationSession(PRESET)
+    restored.restore(session.history())
+    assert restored.summary == session.summary
+    assert restored.to_messages() == session.to_messages()
+
+def test_apply_summary_gives_up_when_messages_changed():
+    session = _long_session(4)
+    compacted = session.compactable(2)
+    # 生成摘要期间最早的消息被回滚
+    session.remove(compacted[0])
+    assert not session.apply_summary("过时的摘要", compacted)
+    assert session.summary == ""
+    assert len(session) == 7
@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from fastapi import FastAPI, Request
+from conftest import serve_app
+from config import Config
+
+def build_stub(requests: list) -> FastAPI:
+    """替身补全接口：摘要请求返回固定摘要，其余请求回显"""
+    app = FastAPI()
+
+    @app.post("/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        requests.append(body)
+        if body["messages"][0]["content"] == Config.HISTORY_SUMMARY_PROMPT:
+            content = "摘要：用户聊了很多"
+        else:
+            content = "echo:" + body["messages"][-1]["content"]
+        return {
+            "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+        }
+
+    return app
+
+@pytest.fixture
+def summary_config(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "HISTORY_DIR", str(tmp_path / "history"), raising=False)
+    monkeypatch.setattr(Config, "SESSION_BACKEND", "memory")
+    monkeypatch.setattr(Config, "USAGE_DB_PATH", str(tmp_path / "usage.db"))
+    monkeypatch.setattr(Config, "VIDEO_CATALOG_DB", str(tmp_path / "video_catalog.db"))
+    monkeypatch.setattr(Config, "LLM_ADAPTIVE_CONCURRENCY", False)
+    monkeypatch.setattr(Config, "HISTORY_SUMMARY_ENABLED", True)
+    monkeypatch.setattr(Config, "HISTORY_SUMMARY_TRIGGER_TOKENS", 20)
+    monkeypatch.setattr(Config, "HISTORY_SUMMARY_KEEP_MESSAGES", 2)
+    monkeypatch.setattr(Config, "HISTORY_SUMMARY_BACKEND", None)
+    Config.init()
+
+def test_history_is_compacted_after_reply(summary_config, monkeypatch):
+    async def scenario():
+        requests = []
+        async with serve_app(build_stub(requests)) as base:
+            monkeypatch.setattr(Config, "LLM_BACKENDS", [
+                {"name": "stub", "endpoint": f"{base}/chat/completions", "model": "stub", "api_key": "x"}
+            ])
+            from chat_manager import ChatManager
+            chat_manager = ChatManager()
+            try:
+                for i in range(4):
+                    status, reply = await chat_manager.get_chat_response(1, f"第{i}个比较长的问题，用来让历史超过阈值")
+                    assert status == 200
+                    await asyncio.gather(*chat_manager._compaction_tasks)
+
+                session = chat_manager.sessions.peek(1)
+                assert session.summary == "摘要：用户聊了很多"
+                assert len(session) <= 2
+                # 后续请求带上摘要而不是完整历史
+                await chat_manager.get_chat_response(1, "最后一个问题")
+                chats = [body for body in requests if body["messages"][0]["content"] != Config.HISTORY_SUMMARY_PROMPT]
+                assert any("摘要：用户聊了很多" in message["content"] for message in chats[-1]["messages"])
+                # 摘要的用量不计入用户的每日额度
+                assert len(requests) > len(chats)
+                assert chat_manager.usage.tokens_today(1) == 15 * len(chats)
+            finally:
+                await chat_manager.close()
+
+    asyncio.run(scenario())
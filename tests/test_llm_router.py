@@ -0,0 +1,143 @@
+import asyncio
+import httpx
+import pytest
+from fastapi import FastAPI, Response
+from conftest import serve_app
+from config import Config
+from llm_router import LLMBackend, LLMRouter, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+
+def build_stub(name: str, state: dict) -> FastAPI:
+    """替身补全接口：state["status"] 不为200时返回该错误码"""
+    app = FastAPI()
+
+    @app.post("/chat/completions")
+    async def completions(response: Response):
+        state["calls"] = state.get("calls", 0) + 1
+        response.status_code = state.get("status", 200)
+        return {"choices": [{"message": {"role": "assistant", "content": name}}]}
+
+    return app
+
+def _should_failover(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+async def _complete(client: httpx.AsyncClient, backend: LLMBackend) -> str:
+    response = await client.post(backend.endpoint, json={})
+    response.raise_for_status()
+    return response.json()["choices"][0]["message"]["content"]
+
+def test_failover_opens_breaker_and_half_open_trial_recovers():
+    async def scenario():
+        primary, secondary = {}, {}
+        async with serve_app(build_stub("primary", primary)) as first, \
+                serve_app(build_stub("secondary", secondary)) as second, \
+                httpx.AsyncClient() as client:
+            backends = [
+                LLMBackend("primary", f"{first}/chat/completions", "m", "k"),
+                LLMBackend("secondary", f"{second}/chat/completions", "m", "k"),
+            ]
+            router = LLMRouter(backends, failure_threshold=2, open_seconds=0.2)
+            request = lambda backend: _complete(client, backend)
+
+            primary["status"] = 503
+            assert await router.call(request, _should_failover) == "secondary"
+            assert await router.call(request, _should_failover) == "secondary"
+            assert backends[0].state == STATE_OPEN
+            assert router.failovers == 2
+
+            # 熔断期间不再请求故障后端
+            calls = primary["calls"]
+            assert await router.call(request, _should_failover) == "secondary"
+            assert primary["calls"] == calls
+
+            # 冷却结束后放行一次试探，成功即恢复
+            primary["status"] = 200
+            await asyncio.sleep(0.25)
+            backends[1].latency = 10.0
+            assert await router.call(request, _should_failover) == "primary"
+            assert backends[0].state == STATE_CLOSED
+
+    asyncio.run(scenario())
+
+def test_candidates_does_not_claim_half_open_trial():
+    backends = [LLMBackend("a", "http://a/chat/completions", "m", "k"),
+                LLMBackend("b", "http://b/chat/completions", "m", "k")]
+    router = LLMRouter(backends, failure_threshold=1, open_seconds=0.0)
+    router.record_failure(backends[1])
+    assert backends[1].state == STATE_OPEN
+
+    # 只查看候选列表（如流式请求取首选、或前一个后端已成功）不会占用试探机会
+    for _ in range(3):
+        assert backends[1] in router.candidates()
+    assert backends[1].state == STATE_OPEN
+
+    assert router.try_acquire(backends[1])
+    assert backends[1].state == STATE_HALF_OPEN
+    # 试探结果出来前其他请求不能再占用
+    assert not router.try_acquire(backends[1])
+    assert backends[1] not in router.candidates()
+
+def test_cancelled_trial_is_released():
+    async def scenario():
+        backend = LLMBackend("slow", "http://slow/chat/completions", "m", "k")
+        router = LLMRouter([backend], failure_threshold=1, open_seconds=0.0)
+        router.record_failure(backend)
+
+        async def hang(backend):
+            await asyncio.sleep(10)
+
+        task = asyncio.create_task(router.call(hang, _should_failover))
+        await asyncio.sleep(0.01)
+        assert backend.state == STATE_HALF_OPEN
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # 被取消的试探交还机会，后端不会一直停在半开状态
+        assert backend.state == STATE_OPEN
+        assert router.try_acquire(backend)
+
+    asyncio.run(scenario())
+
+@pytest.fixture
+def chat_config(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, "HISTORY_DIR", str(tmp_path / "history"), raising=False)
+    monkeypatch.setattr(Config, "SESSION_BACKEND", "memory")
+    monkeypatch.setattr(Config, "USAGE_DB_PATH", str(tmp_path / "usage.db"))
+    monkeypatch.setattr(Config, "VIDEO_CATALOG_DB", str(tmp_path / "video_catalog.db"))
+    monkeypatch.setattr(Config, "LLM_ADAPTIVE_CONCURRENCY", False)
+    monkeypatch.setattr(Config, "LLM_BACKENDS", [
+        {"name": "down", "endpoint": "http://127.0.0.1:9/chat/completions", "model": "m", "api_key": "k"}
+    ])
+    monkeypatch.setattr(Config, "LLM_BREAKER_OPEN_SECONDS", 0.0)
+    monkeypatch.setattr(Config, "LLM_MAX_CONCURRENT", 1)
+    monkeypatch.setattr(Config, "LLM_QUEUE_MAX_WAIT", 0.05)
+    Config.init()
+
+def test_stream_queue_timeout_does_not_claim_half_open_trial(chat_config):
+    async def scenario():
+        from chat_manager import ChatManager
+        chat_manager = ChatManager()
+        backend = chat_manager.router.backends[0]
+        for _ in range(Config.LLM_BREAKER_FAILURES):
+            chat_manager.router.record_failure(backend)
+        assert backend.state == STATE_OPEN
+        try:
+            # 唯一的并发额度被占用，流式请求排队超时
+            await chat_manager.dispatcher.acquire(0)
+            segments = []
+
+            async def on_segment(text):
+                segments.append(text)
+
+            status, _ = await chat_manager.get_chat_response_stream(1, "你好", on_segment)
+            assert status == 503
+            assert segments == []
+            # 排队期间没有占用试探机会，下一个请求仍可以试探该后端
+            assert backend.state == STATE_OPEN
+            assert chat_manager.router.try_acquire(backend)
+        finally:
+            chat_manager.dispatcher.release()
+            await chat_manager.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,38 @@
+from llm_scheduler import LLMDispatcher, AdaptiveConcurrency
+
+def _controller(monkeypatch, initial_limit=16):
+    clock = [1000.0]
+    monkeypatch.setattr("llm_scheduler.time.monotonic", lambda: clock[0])
+    dispatcher = LLMDispatcher(max_concurrent=initial_limit, max_wait=60, notice_delay=5)
+    controller = AdaptiveConcurrency(dispatcher, min_limit=1, max_limit=32, initial_limit=initial_limit)
+    return controller, clock
+
+def test_long_reply_is_not_a_latency_spike(monkeypatch):
+    controller, _ = _controller(monkeypatch)
+    for _ in range(10):
+        controller.on_success(1.0, 50)
+    # 回复长40倍、总耗时也长40倍：每token耗时不变
+    controller.on_success(40.0, 2000)
+    assert controller.decreases == 0
+    assert controller.limit >= 16
+
+def test_short_reply_does_not_affect_baseline(monkeypatch):
+    controller, _ = _controller(monkeypatch)
+    controller.on_success(1.0, 50)
+    baseline = controller.baseline
+    # 短回复的耗时主要是首字延迟
+    controller.on_success(2.0, 3)
+    controller.on_success(2.0, None)
+    assert controller.baseline == baseline
+    assert controller.decreases == 0
+
+def test_sustained_slowdown_cuts_limit_once(monkeypatch):
+    controller, clock = _controller(monkeypatch)
+    for _ in range(10):
+        controller.on_success(1.0, 100)
+    # 上游永久变慢5倍：第一次判为突增，之后基线追上新水平，不会每秒都下调到下限
+    for _ in range(30):
+        clock[0] += 1.5
+        controller.on_success(5.0, 100)
+    assert controller.decreases <= 2
+    assert controller.limit > controller.min_limit
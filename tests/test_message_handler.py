@@ -0,0 +1,57 @@
+import asyncio
+from fastapi import FastAPI, Request
+from conftest import serve_app
+from message_handler import MessageHandler
+
+def build_app(requests: list) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/{action}")
+    async def http_action(action: str, request: Request):
+        requests.append((action, await request.json()))
+        return {"status": "ok", "retcode": 0, "data": {}}
+
+    return app
+
+def _texts(requests):
+    return [
+        "".join(segment["data"]["text"] for segment in body["message"] if segment["type"] == "text")
+        for _, body in requests
+    ]
+
+def test_stream_fragments_merge_without_line_breaks():
+    async def scenario():
+        requests = []
+        async with serve_app(build_app(requests)) as base:
+            handler = MessageHandler()
+            handler.server_url = f"{base}/send_group_msg"
+            reply = object()
+            # 分段断在句子中间，且保留了原始空白
+            handler.enqueue_group_message(1, "42", "  Hello, wor", stream=reply)
+            handler.enqueue_message(1, {"type": "text", "data": {"text": "ld. How are"}}, stream=reply)
+            handler.enqueue_message(1, {"type": "text", "data": {"text": " you?\n"}}, stream=reply)
+            handler.enqueue_message(1, "另一条消息")
+            await handler.close()
+
+        assert len(requests) == 1
+        assert requests[0][1]["message"][0] == {"type": "at", "data": {"qq": "42"}}
+        assert _texts(requests) == ["Hello, world. How are you?\n另一条消息"]
+
+    asyncio.run(scenario())
+
+def test_separate_messages_are_joined_by_line_breaks():
+    async def scenario():
+        requests = []
+        async with serve_app(build_app(requests)) as base:
+            handler = MessageHandler()
+            handler.private_url = f"{base}/send_private_msg"
+            handler.enqueue_private_message(7, "第一条")
+            handler.enqueue_private_message(7, "第二条")
+            # 不同的流式回复之间同样换行
+            handler.enqueue_private_message(7, "回复A\n", stream=object())
+            handler.enqueue_private_message(7, "回复B", stream=object())
+            await handler.close()
+
+        assert _texts(requests) == ["第一条\n第二条\n回复A\n回复B"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,146 @@
+import json
+import asyncio
+import pytest
+import websockets
+from fastapi import FastAPI, Request, WebSocket
+from conftest import serve_app
+from config import Config
+from onebot_ws import OneBotWebSocket, WebSocketSendError
+from message_handler import MessageHandler
+
+class StandInOneBot:
+    """本地替身LLOneBot：反向WebSocket客户端，上报事件并应答API调用"""
+
+    def __init__(self, url: str, answer: bool = True):
+        self.url = url
+        self.answer = answer
+        self.actions = []
+        self.connection = None
+        self._task = None
+
+    async def __aenter__(self):
+        self.connection = await websockets.connect(self.url)
+        self._task = asyncio.create_task(self._reply_loop())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._task.cancel()
+        await self.connection.close()
+
+    async def _reply_loop(self):
+        try:
+            async for frame in self.connection:
+                request = json.loads(frame)
+                self.actions.append(request)
+                if self.answer:
+                    await self.connection.send(json.dumps({
+                        "status": "ok", "retcode": 0,
+                        "data": {"message_id": len(self.actions)},
+                        "echo": request["echo"]
+                    }))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def post_event(self, event):
+        await self.connection.send(json.dumps(event))
+
+def build_app(onebot: OneBotWebSocket, events: list, http_requests: list) -> FastAPI:
+    app = FastAPI()
+
+    async def on_event(event):
+        events.append(event)
+
+    @app.websocket(Config.WS_PATH)
+    async def ws_endpoint(websocket: WebSocket):
+        await onebot.serve(websocket, on_event)
+
+    @app.post("/{action}")
+    async def http_action(action: str, request: Request):
+        http_requests.append((action, await request.json()))
+        return {"status": "ok", "retcode": 0, "data": {}}
+
+    return app
+
+@pytest.fixture
+def ws_transport(monkeypatch):
+    monkeypatch.setattr(Config, "ONEBOT_TRANSPORT", "ws")
+    monkeypatch.setattr(Config, "WS_ACCESS_TOKEN", "")
+    monkeypatch.setattr(Config, "WS_HTTP_FALLBACK", True)
+
+async def _wait_for(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "等待超时"
+        await asyncio.sleep(0.01)
+
+def test_events_and_actions_share_one_connection(ws_transport):
+    async def scenario():
+        onebot, events, http_requests = OneBotWebSocket(), [], []
+        async with serve_app(build_app(onebot, events, http_requests)) as base:
+            handler = MessageHandler(websocket=onebot)
+            handler.server_url = f"{base}/send_group_msg"
+            async with StandInOneBot(base.replace("http", "ws") + Config.WS_PATH) as bot:
+                await _wait_for(lambda: onebot.connected)
+                await bot.post_event({"post_type": "message", "message_type": "group", "raw_message": "hi"})
+                # 心跳元事件与无法解析的帧被跳过，连接保持
+                await bot.post_event({"post_type": "meta_event", "meta_event_type": "heartbeat"})
+                await bot.connection.send("{not json")
+                await bot.connection.send("[1, 2]")
+
+                response = await handler.send_message(123, [{"type": "text", "data": {"text": "hello"}}])
+                await _wait_for(lambda: events)
+
+                assert response["data"]["message_id"] == 1
+                assert bot.actions[0]["action"] == "send_group_msg"
+                assert bot.actions[0]["params"]["group_id"] == 123
+                assert [event["raw_message"] for event in events] == ["hi"]
+                assert onebot.connected
+                assert http_requests == []
+            await handler.close()
+
+    asyncio.run(scenario())
+
+def test_replaced_connection_fails_pending_calls(ws_transport):
+    async def scenario():
+        onebot = OneBotWebSocket()
+        async with serve_app(build_app(onebot, [], [])) as base:
+            url = base.replace("http", "ws") + Config.WS_PATH
+            async with StandInOneBot(url, answer=False):
+                await _wait_for(lambda: onebot.connected)
+                first = onebot.websocket
+                call = asyncio.create_task(onebot.call_action("send_group_msg", {}, timeout=10))
+                await asyncio.sleep(0.05)
+
+                async with StandInOneBot(url) as second:
+                    await _wait_for(lambda: onebot.websocket is not first)
+                    # 旧连接上的请求立即失败，而不是等到超时
+                    with pytest.raises(ConnectionError):
+                        await asyncio.wait_for(call, 1)
+                    response = await onebot.call_action("send_group_msg", {"group_id": 1})
+                    assert response["retcode"] == 0
+                    assert len(second.actions) == 1
+
+    asyncio.run(scenario())
+
+class _ClosedSocket:
+    """模拟已关闭的连接：写入时抛出 RuntimeError"""
+
+    async def send_json(self, data):
+        raise RuntimeError('Cannot call "send" once a close message has been sent.')
+
+def test_send_failure_falls_back_to_http(ws_transport):
+    async def scenario():
+        onebot, http_requests = OneBotWebSocket(), []
+        async with serve_app(build_app(onebot, [], http_requests)) as base:
+            onebot.websocket = _ClosedSocket()
+            with pytest.raises(WebSocketSendError):
+                await onebot.call_action("send_group_msg", {})
+
+            handler = MessageHandler(websocket=onebot)
+            handler.server_url = f"{base}/send_group_msg"
+            response = await handler.send_message(7, "hello")
+            assert response is not None and response.status_code == 200
+            assert http_requests == [("send_group_msg", {"group_id": 7, "message": "hello"})]
+            await handler.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from single_flight import SingleFlight
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def call():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", call) for _ in range(5)))
+        assert results == ["result"] * 5
+        assert calls == 1
+        assert flight.stats() == {"upstream_calls": 1, "saved_calls": 4, "inflight": 0}
+
+    asyncio.run(scenario())
+
+def test_cancelled_leader_hands_the_call_to_a_waiter():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def call():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.1)
+            return calls
+
+        leader = asyncio.create_task(flight.do("key", call))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(flight.do("key", call)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # 等待者不受发起者取消的影响：其中一个重新发起调用，其余共享其结果
+        assert await asyncio.gather(*waiters) == [2, 2, 2]
+        assert calls == 2
+        assert flight.inflight == 0
+
+    asyncio.run(scenario())
+
+def test_errors_are_shared_with_waiters():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        results = await asyncio.gather(*(flight.do("key", call) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+    asyncio.run(scenario())
@@ -0,0 +1,175 @@
+import time
+import sqlite3
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from config import Config
+
+# 统计维度
+SCOPE_USER = "user"
+SCOPE_GROUP = "group"
+SCOPE_PRESET = "preset"
+
+# 后台任务（如历史摘要）的用量记在该用户键下，不计入任何真实用户的每日额度
+SYSTEM_USER = "system"
+
+class UsageTracker:
+    """
+    LLM用量统计：按用户/群/预设累计请求数、提示与补全token数和上游耗时
+    计数先累加在内存中，由 flush 定期在后台线程中批量合并进SQLite（按天分行）；
+    同时维护当天每个用户的token用量，用于在调用上游之前检查每日额度。
+    """
+
+    def __init__(self, db_path: str, daily_quota: int):
+        """
+        :param db_path: 统计库路径
+        :param daily_quota: 每个用户每天的token上限，0表示不限制
+        """
+        self.db_path = db_path
+        self.daily_quota = daily_quota
+        # 只在 flush/查询的工作线程中使用，由 _lock 保证串行
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage_stats (
+                day TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                key TEXT NOT NULL,
+                requests INTEGER NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                latency REAL NOT NULL,
+                PRIMARY KEY (day, scope, key)
+            )
+        """)
+        self._conn.commit()
+        # (日期, 维度, 键) -> [请求数, 提示token, 补全token, 累计耗时(秒)]，尚未落盘的增量
+        self._pending: Dict[Tuple[str, str, str], List[float]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        # 当天各用户已用token（含已落盘部分），跨天时重置
+        self._day = self._today()
+        self._daily_tokens: Dict[str, int] = dict(self._conn.execute(
+            "SELECT key, prompt_tokens + completion_tokens FROM usage_stats WHERE day = ? AND scope = ?",
+            (self._day, SCOPE_USER)
+        ))
+
+    @staticmethod
+    def _today() -> str:
+        return time.strftime("%Y-%m-%d")
+
+    def _roll_day(self):
+        today = self._today()
+        if today != self._day:
+            self._day = today
+            self._daily_tokens.clear()
+
+    def tokens_today(self, user_id: Any) -> int:
+        """用户当天已用token数"""
+        self._roll_day()
+        return self._daily_tokens.get(str(user_id), 0)
+
+    def quota_exceeded(self, user_id: Any) -> bool:
+        """用户当天的token用量是否已达到上限"""
+        return self.daily_quota > 0 and self.tokens_today(user_id) >= self.daily_quota
+
+    def record(self, user_id: Any, group_id: Optional[Any], preset: Any,
+               usage: Optional[Dict[str, Any]], latency: float):
+        """
+        记录一次上游调用
+        :param usage: 响应中的 usage 字段（缺失时只记录请求数和耗时）
+        :param latency: 上游调用耗时(秒)，不含排队时间
+        """
+        usage = usage or {}
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        self._roll_day()
+
+        keys = [(SCOPE_USER, str(user_id)), (SCOPE_PRESET, str(preset))]
+        if group_id is not None:
+            keys.append((SCOPE_GROUP, str(group_id)))
+        for scope, key in keys:
+            counter = self._pending.get((self._day, scope, key))
+            if counter is None:
+                counter = self._pending[(self._day, scope, key)] = [0, 0, 0, 0.0]
+            counter[0] += 1
+            counter[1] += prompt_tokens
+            counter[2] += completion_tokens
+            counter[3] += latency
+
+        user_key = str(user_id)
+        self._daily_tokens[user_key] = self._daily_tokens.get(user_key, 0) + prompt_tokens + completion_tokens
+
+    def _write_batch(self, rows: List[Tuple]):
+        with self._conn:
+            self._conn.executemany("""
+                INSERT INTO usage_stats (day, scope, key, requests, prompt_tokens, completion_tokens, latency)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(day, scope, key) DO UPDATE SET
+                    requests = requests + excluded.requests,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens,
+                    latency = latency + excluded.latency
+            """, rows)
+
+    async def flush(self):
+        """将内存中的增量合并进统计库"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            rows = [(*key, *counter) for key, counter in batch.items()]
+            try:
+                await asyncio.to_thread(self._write_batch, rows)
+            except Exception as e:
+                logging.error(f"用量统计写入失败: {str(e)}")
+                # 写入失败的增量并回待写入数据
+                for key, counter in batch.items():
+                    pending = self._pending.setdefault(key, [0, 0, 0, 0.0])
+                    for i, value in enumerate(counter):
+                        pending[i] += value
+
+    async def run_flusher(self, interval: float):
+        """后台任务：定期落盘"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def _query_top(self, scope: str, since: str, limit: int) -> List[Tuple]:
+        return self._conn.execute("""
+            SELECT key, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens), SUM(latency)
+            FROM usage_stats WHERE scope = ? AND day >= ?
+            GROUP BY key ORDER BY SUM(prompt_tokens + completion_tokens) DESC LIMIT ?
+        """, (scope, since, limit)).fetchall()
+
+    async def top(self, scope: str, since: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        查询用量最高的用户/群/预设
+        :param scope: SCOPE_USER / SCOPE_GROUP / SCOPE_PRESET
+        :param since: 起始日期（YYYY-MM-DD，含），默认当天
+        :param limit: 返回条数
+        """
+        await self.flush()
+        async with self._lock:
+            rows = await asyncio.to_thread(self._query_top, scope, since or self._today(), limit)
+        return [
+            {
+                "key": key,
+                "requests": requests,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "avg_latency": latency / requests if requests else 0.0,
+                "cost": self.cost(prompt_tokens, completion_tokens)
+            }
+            for key, requests, prompt_tokens, completion_tokens, latency in rows
+        ]
+
+    @staticmethod
+    def cost(prompt_tokens: int, completion_tokens: int) -> float:
+        """按配置的单价（元/百万token）估算费用"""
+        return (prompt_tokens * Config.USAGE_PROMPT_PRICE + completion_tokens * Config.USAGE_COMPLETION_PRICE) / 1_000_000
+
+    async def close(self):
+        await self.flush()
+        self._conn.close()
@@ -0,0 +1,127 @@
+import os
+import random
+import sqlite3
+import logging
+import numpy as np
+import pandas as pd
+from typing import Dict, Hashable, List, Optional
+from expiring_map import ExpiringDict
+
+def load_video_ids(path: str) -> List[str]:
+    """读取视频表格中所有非空单元格（按行优先顺序）作为BV号"""
+    df = pd.read_excel(path)
+    cells = df.to_numpy().ravel()
+    videos = [str(cell).strip() for cell in cells if pd.notnull(cell)]
+    return [video for video in videos if video]
+
+class VideoCatalog:
+    """
+    视频目录：表格中的BV号一次性读入紧凑数组，文件修改时间变化后自动重载
+    随机推荐为O(1)；可按群/用户使用"洗牌袋"，一轮内不重复，相邻两次不重复
+    """
+
+    def __init__(self, path: str, bag_ttl: float = 86400):
+        """
+        :param path: 视频表格路径（每个非空单元格为一个BV号）
+        :param bag_ttl: 群/用户的洗牌袋闲置多久后回收(秒)
+        """
+        self.path = path
+        self._mtime: Optional[int] = None
+        self._version = 0
+        self._videos = np.array([], dtype=str)
+        # 键 -> [版本号, 打乱后的下标数组, 当前位置, 上一次的下标]
+        self._bags = ExpiringDict(bag_ttl)
+
+    def __len__(self) -> int:
+        self._reload_if_changed()
+        return len(self._videos)
+
+    def _reload_if_changed(self):
+        """文件修改时间变化时重新加载"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logging.error(f"读取视频文件失败: {str(e)}")
+            return
+        if mtime == self._mtime:
+            return
+
+        try:
+            self._videos = np.array(load_video_ids(self.path), dtype=str)
+            self._mtime = mtime
+            self._version += 1
+            self._bags.clear()
+            logging.info(f"视频目录已加载: {len(self._videos)} 个视频")
+        except Exception as e:
+            logging.error(f"加载视频目录失败: {str(e)}")
+
+    def _next_from_bag(self, key: Hashable) -> int:
+        """从该键的洗牌袋中取出下一个下标，取完后重新洗牌"""
+        count = len(self._videos)
+        bag = self._bags.get(key)
+        if bag is None or bag[0] != self._version:
+            bag = [self._version, None, count, None]
+            self._bags[key] = bag
+
+        if bag[2] >= count:
+            order = np.random.permutation(count).astype(np.int32)
+            # 新一轮的第一个不能与上一轮最后一个相同
+            if count > 1 and order[0] == bag[3]:
+                order[0], order[-1] = order[-1], order[0]
+            bag[1] = order
+            bag[2] = 0
+
+        index = int(bag[1][bag[2]])
+        bag[2] += 1
+        bag[3] = index
+        return index
+
+    def pick(self, key: Optional[Hashable] = None) -> Optional[str]:
+        """
+        随机选取一个视频
+        :param key: 去重范围（如群号/用户ID），为None时完全随机
+        :return: BV号，目录为空时返回None
+        """
+        self._reload_if_changed()
+        count = len(self._videos)
+        if not count:
+            return None
+        index = random.randrange(count) if key is None else self._next_from_bag(key)
+        return str(self._videos[index])
+
+class VideoMetadataStore:
+    """只读访问离线编译的视频信息库（由 video_catalog_compiler.py 生成）"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        # 信息库可能在机器人启动后才生成，首次查询时再打开
+        if self._conn is None and os.path.exists(self.db_path):
+            self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        return self._conn
+
+    def get(self, bvid: str) -> Optional[Dict[str, str]]:
+        """
+        查询视频信息
+        :return: {'title', 'cover_url', 'jump_url'}，信息库中没有时返回None
+        """
+        try:
+            conn = self._connect()
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT title, cover_url, jump_url FROM videos WHERE bvid = ?", (bvid,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"查询视频信息库失败: {str(e)}")
+            return None
+        if row is None:
+            return None
+        return {'title': row[0], 'cover_url': row[1], 'jump_url': row[2]}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
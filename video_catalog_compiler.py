@@ -0,0 +1,160 @@
+"""
+离线编译视频信息库：读取视频表格，批量获取B站视频标题/封面/链接并写入本地SQLite
+
+用法：
+    python video_catalog_compiler.py                 # 只获取新增的和超过7天未更新的视频
+    python video_catalog_compiler.py --max-age 0     # 全部重新获取
+    python video_catalog_compiler.py --prune         # 同时删除表格中已移除的视频
+"""
+import time
+import sqlite3
+import asyncio
+import logging
+import argparse
+import httpx
+from typing import Dict, List, Optional
+from config import Config
+from video_catalog import load_video_ids
+
+BILIBILI_VIEW_API = "https://api.bilibili.com/x/web-interface/view"
+BILIBILI_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+async def fetch_video_info(client: httpx.AsyncClient, bvid: str) -> Optional[Dict[str, str]]:
+    """
+    从B站接口获取视频信息
+    :return: {'title', 'cover_url', 'jump_url'}，失败时返回None
+    """
+    try:
+        response = await client.get(
+            BILIBILI_VIEW_API,
+            params={"bvid": bvid},
+            headers={**BILIBILI_HEADERS, "Cookie": Config.BILIBILI_COOKIE},
+            timeout=10.0
+        )
+        if response.status_code != 200:
+            logging.error(f"获取视频信息失败: {bvid} 状态码 {response.status_code}")
+            return None
+
+        data = response.json()
+        if data.get('code') != 0:
+            logging.error(f"获取视频信息失败: {bvid} {data.get('code')} {data.get('message')}")
+            return None
+        items = data.get('data') or {}
+
+        return {
+            'title': items.get('title', '无标题'),
+            'cover_url': items.get('pic', '').replace('http://', 'https://', 1),
+            'jump_url': f"https://www.bilibili.com/video/{bvid}"
+        }
+    except Exception as e:
+        logging.error(f"获取视频信息出错: {bvid} {str(e)}")
+        return None
+
+def open_catalog(db_path: str) -> sqlite3.Connection:
+    """打开（必要时创建）视频信息库"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS videos (
+            bvid TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            cover_url TEXT NOT NULL,
+            jump_url TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    """)
+    conn.commit()
+    return conn
+
+def select_pending(conn: sqlite3.Connection, bvids: List[str], max_age: float) -> List[str]:
+    """筛选需要获取的视频：信息库中没有的，或获取时间早于 max_age 秒之前的"""
+    fetched = dict(conn.execute("SELECT bvid, fetched_at FROM videos"))
+    stale_before = time.time() - max_age
+    pending = []
+    for bvid in dict.fromkeys(bvids):
+        fetched_at = fetched.get(bvid)
+        if fetched_at is None or fetched_at < stale_before:
+            pending.append(bvid)
+    return pending
+
+async def compile_catalog(bvids: List[str], conn: sqlite3.Connection, concurrency: int,
+                          delay: float, batch_size: int = 50) -> Dict[str, int]:
+    """
+    以有限并发获取视频信息并分批写入信息库
+    :param bvids: 需要获取的BV号
+    :param conn: 信息库连接
+    :param concurrency: 最大并发请求数
+    :param delay: 每个请求结束后占用并发额度的额外等待(秒)，避免触发B站风控
+    :param batch_size: 每提交一次事务写入的条数
+    :return: 成功/失败数量
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    rows = []
+    result = {"ok": 0, "failed": 0}
+
+    def write_rows():
+        with conn:
+            conn.executemany("""
+                INSERT INTO videos (bvid, title, cover_url, jump_url, fetched_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(bvid) DO UPDATE SET
+                    title = excluded.title, cover_url = excluded.cover_url,
+                    jump_url = excluded.jump_url, fetched_at = excluded.fetched_at
+            """, rows)
+        rows.clear()
+
+    async def resolve(client: httpx.AsyncClient, bvid: str):
+        async with semaphore:
+            info = await fetch_video_info(client, bvid)
+            await asyncio.sleep(delay)
+        if info is None:
+            result["failed"] += 1
+            return
+        rows.append((bvid, info['title'], info['cover_url'], info['jump_url'], time.time()))
+        result["ok"] += 1
+        if len(rows) >= batch_size:
+            write_rows()
+        done = result["ok"] + result["failed"]
+        if done % 100 == 0:
+            print(f"进度: {done}/{len(bvids)}")
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        await asyncio.gather(*(resolve(client, bvid) for bvid in bvids))
+    if rows:
+        write_rows()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="离线编译视频信息库")
+    parser.add_argument("--input", default=Config.VIDEO_FILE, help="视频表格路径")
+    parser.add_argument("--output", default=Config.VIDEO_CATALOG_DB, help="信息库路径")
+    parser.add_argument("--concurrency", type=int, default=4, help="最大并发请求数")
+    parser.add_argument("--delay", type=float, default=0.2, help="每个请求后的额外等待(秒)")
+    parser.add_argument("--max-age", type=float, default=7, help="超过该天数的信息重新获取，0表示全部重新获取")
+    parser.add_argument("--prune", action="store_true", help="删除表格中已不存在的视频")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    bvids = load_video_ids(args.input)
+    conn = open_catalog(args.output)
+    try:
+        if args.prune:
+            keep = set(bvids)
+            removed = [(bvid,) for (bvid,) in conn.execute("SELECT bvid FROM videos") if bvid not in keep]
+            with conn:
+                conn.executemany("DELETE FROM videos WHERE bvid = ?", removed)
+            print(f"已删除 {len(removed)} 个不在表格中的视频")
+
+        pending = select_pending(conn, bvids, args.max_age * 86400)
+        print(f"表格中共 {len(set(bvids))} 个视频，需要获取 {len(pending)} 个")
+        if pending:
+            result = asyncio.run(compile_catalog(pending, conn, args.concurrency, args.delay))
+            print(f"完成: 成功 {result['ok']} 个，失败 {result['failed']} 个（失败的视频下次运行时重试）")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+from expiring_map import ExpiringDict
+
+class VideoPrefetchPool:
+    """
+    视频推荐预取池：后台预先选好视频、查好信息并构建好消息段，请求到来时直接取出发送
+    每个去重范围（群/用户，或None表示全局）各有一个小池，闲置一段时间后回收
+    """
+
+    def __init__(self, resolve: Callable[[Optional[Hashable]], Awaitable[Optional[Any]]],
+                 size: int, refill_rate: float, idle_ttl: float = 3600):
+        """
+        :param resolve: 为指定去重范围构建一条推荐消息的协程函数，失败时返回None
+        :param size: 每个范围保留的消息条数
+        :param refill_rate: 后台补充速率上限(条/秒)
+        :param idle_ttl: 范围闲置多久后回收其池子(秒)
+        """
+        self.resolve = resolve
+        self.size = size
+        self.refill_rate = refill_rate
+        self._pools = ExpiringDict(idle_ttl)
+        self._wakeup: Optional[asyncio.Event] = None
+        self.hits = 0
+        self.misses = 0
+        self.refilled = 0
+        self.failures = 0
+
+    def _signal(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def take(self, key: Optional[Hashable] = None) -> Optional[Any]:
+        """
+        取出一条预构建的推荐消息
+        :param key: 去重范围
+        :return: 消息段，池为空时返回None（调用方需现场构建）
+        """
+        if self.size <= 0:
+            return None
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = deque()
+            self._pools[key] = pool
+        payload = pool.popleft() if pool else None
+        if payload is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self._signal()
+        return payload
+
+    def clear(self):
+        self._pools.clear()
+
+    async def _refill_once(self) -> bool:
+        """为存量最少的范围补充一条；没有缺额或构建失败时返回False，等待下一次取用再试"""
+        self._pools.expire()
+        key, pool = None, None
+        for candidate in self._pools:
+            candidate_pool = self._pools.peek(candidate)
+            if len(candidate_pool) < self.size and (pool is None or len(candidate_pool) < len(pool)):
+                key, pool = candidate, candidate_pool
+        if pool is None:
+            return False
+
+        try:
+            payload = await self.resolve(key)
+        except Exception as e:
+            logging.error(f"预取视频推荐失败: {str(e)}")
+            payload = None
+        if payload is None:
+            self.failures += 1
+            return False
+        # 构建期间池子可能已被回收
+        if self._pools.peek(key) is pool:
+            pool.append(payload)
+            self.refilled += 1
+        return True
+
+    async def run(self, warm_keys: Iterable[Optional[Hashable]] = ()):
+        """
+        后台任务：按速率上限补充各池子，池子都满时等待下一次取用
+        :param warm_keys: 启动时即预取的范围
+        """
+        if self.size <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        for key in warm_keys:
+            self._pools.setdefault(key, deque())
+        interval = 1.0 / self.refill_rate if self.refill_rate > 0 else 0
+        while True:
+            try:
+                worked = await self._refill_once()
+            except Exception as e:
+                logging.error(f"预取任务出错: {str(e)}")
+                worked = False
+            if worked:
+                await asyncio.sleep(interval)
+                continue
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "pooled": sum(len(self._pools.peek(key)) for key in self._pools),
+            "scopes": len(self._pools),
+            "refilled": self.refilled,
+            "failures": self.failures
+        }